@@ -4,10 +4,32 @@ import io
 import re
 import os
 import json
+import copy
 import time
 import datetime
+import asyncio
+import threading
+import concurrent.futures
 import operator
+import collections
+import array
+import bisect
 import urllib
+import zlib
+import hashlib
+import shlex
+import shutil
+import struct
+import mmap
+import atexit
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+import sqlite3
 import requests
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -17,6 +39,7 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # =========================================================
 
 # REST API Endpoints
+API_ENDPOINT_ENTITY = "/api/v1/entity/"
 API_ENDPOINT_APPLICATIONS = "/api/v1/entity/applications"
 API_ENDPOINT_SERVICES = "/api/v1/entity/services"
 API_ENDPOINT_PROCESS_GROUPS = "/api/v1/entity/infrastructure/process-groups"
@@ -27,6 +50,7 @@ API_ENDPOINT_TIMESERIES = "/api/v1/timeseries"
 API_ENDPOINT_THRESHOLDS = "/api/v1/thresholds"
 API_ENDPOINT_EVENTS = "/api/v1/events"
 API_ENDPOINT_PROBLEMS = "/api/v1/problem"
+API_ENDPOINTS = [API_ENDPOINT_APPLICATIONS, API_ENDPOINT_SERVICES, API_ENDPOINT_PROCESS_GROUPS, API_ENDPOINT_HOSTS, API_ENDPOINT_PROCESSES, API_ENDPOINT_CUSTOM, API_ENDPOINT_TIMESERIES, API_ENDPOINT_THRESHOLDS, API_ENDPOINT_EVENTS, API_ENDPOINT_PROBLEMS]
 
 # HTTP Methods when calling the Dynatrace API via queryDynatraceAPIEx
 HTTP_GET = "GET"
@@ -68,12 +92,43 @@ config = {
     "apitoken"    : "smpltoken",  # YOUR API TOKEN, generated with Dynatrace
     "cacheupdate" : -1,           # -1 = NEVER, 0=ALWAYS, X=After X seconds
     "cachedir"    : "",           # cache directory. If empty or None we take the current working directory!
-    "debug"       : 0             # 0 == no debugging output, 1== debug log output
+    "debug"       : 0,            # 0 == no debugging output, 1== debug log output
+    "poolsize"    : 10,           # max number of pooled HTTP connections we keep open to the Dynatrace tenant
+    "keepalive"   : 1,            # 1 = reuse connections across API calls (HTTP keep-alive), 0 = new connection for every call
+    "connecttimeout" : 10,        # seconds we wait to establish a connection to the Dynatrace tenant
+    "readtimeout" : 120,          # seconds we wait for the Dynatrace tenant to send a response
+    "concurrency" : 8,            # max number of Dynatrace API calls we have in flight at the same time. 1 = strictly serial
+    "memocache"   : 67108864,     # bytes of API responses we keep parsed in memory while running a command. 0 = turned off
+    "cachebackend" : "file",      # file = one JSON file per query, sqlite = single SQLite file in the cachedir
+    "cachecompress" : 1,          # sqlite only: 1 = zlib compress cached responses, 0 = store as plain JSON
+    "cacheencoding" : "json",     # file only: json = one JSON document per query, ndjson = entity lists with one entity per line plus an index of their offsets
+    "cachesize"   : 1073741824,   # bytes of cached responses we keep per tenant before evicting the least recently used. 0 = no limit
+    "cachestale"  : 0,            # seconds after cacheupdate we still serve an entry while refreshing it in the background. 0 = refresh right away
+    "cachenegative" : 60,         # seconds we remember API errors (4xx) of a query. 0 = turned off
+    "cachepolicy" : {},           # regex on <endpoint>?<querystring> -> TTL (-1, 0, X seconds or resolution) instead of cacheupdate - also instead of 0. First match wins
+    "timealign"   : 0,            # seconds we round "X minutes prior to now" timeframes - and the WebUI now - down to, so repeated and warmed queries hit the same cache entry. 0 = no rounding
+    "prefetch"    : 0,            # 1 = learn which queries usually follow which and prefetch the follow-ups into the cache in the background. 0 = turned off
+    "prefetchconcurrency" : 2,    # max number of prefetch API calls in flight at the same time
+    "prefetchbytes" : 10485760,   # bytes of responses we prefetch at most per run
+    "entitymodel" : "dict",       # dict = entity lists we keep in memory are plain JSON objects, compact = slotted records with shared strings and id arrays
+    "entitysync"  : 0             # 0 = expired entity lists are downloaded again, X = only fetch the entities seen since the last sync - and the full list every X seconds
 }
 
+# default values for all configuration options. config gets replaced by whatever is in dtconfig.json which might not contain all options
+configDefaults = dict(config)
+
 global_doPrint = False
 global_timestampcheck = datetime.datetime(2000, 1, 1, ).timestamp()   # if timestamp int values are larger than this we assume it is a timestamp
 
+def getConfigValue(name):
+    "Returns the configured value or - if not configured in dtconfig.json - the default value"
+    return getAttributeOrDefault(config, name, getAttributeOrNone(configDefaults, name))
+
+def debugLog(message):
+    "Prints the message in case debug output is turned on"
+    if (getAttributeOrDefault(config, "debug", 0) == 1) :
+        print("DEBUG - " + message)
+
 # Returns the Authentication Header for the Dynatrace REST API
 def getAuthenticationHeader():
     return {"Authorization" : "Api-Token " + config["apitoken"]}
@@ -94,10 +149,9 @@ def getRequestUrl(apiEndpoint, queryString):
     return requestUrl
 
 # Constructs the cached filename based on API Endpoint and Query String
-def getCacheFilename(apiEndpoint, queryString):
-    
-    # get the cachedir from our config or use the current working directory
-    cachedir = getAttributeOrNone(config, "cachdir")
+def getCacheDirectory():
+    "Returns the cachedir from our config or the directory of dtcli.py - always with a trailing slash"
+    cachedir = getAttributeOrNone(config, "cachedir")
     if cachedir is None or cachedir == "":
         cachedir = os.path.dirname(os.path.abspath(__file__))
 
@@ -105,12 +159,22 @@ def getCacheFilename(apiEndpoint, queryString):
     if not cachedir.endswith(osfileslashes) :
         cachedir += osfileslashes
 
-    fullCacheFilename = cachedir + osfileslashes + config["tenanthost"].replace("https://","").replace(".", "_") + osfileslashes + apiEndpoint.replace("/","_")
+    return cachedir
+
+def getCacheTenant():
+    "Returns the name under which we cache data of the current tenant, e.g: smpljson or abc12345_live_dynatrace_com"
+    return config["tenanthost"].replace("https://","").replace(".", "_")
+
+def getCacheKey(apiEndpoint, queryString):
+    "Returns the key of a query within the tenant's cache, e.g: _api_v1_timeseries/timeseriesId=com_dynatrace_builtin_host_cpu_system"
+    cacheKey = apiEndpoint.replace("/","_")
     if(queryString is not None and len(queryString) > 0):
-        fullCacheFilename += osfileslashes + urllib.parse.unquote(queryString).replace(".", "_").replace(":", "_").replace("?", "_").replace("&", "_")
-    fullCacheFilename += ".json"
+        cacheKey += osfileslashes + urllib.parse.unquote(queryString).replace(".", "_").replace(":", "_").replace("?", "_").replace("&", "_")
+    return cacheKey
 
-    return fullCacheFilename
+# Constructs the cached filename based on API Endpoint and Query String
+def getCacheFilename(apiEndpoint, queryString):
+    return getCacheDirectory() + getCacheTenant() + osfileslashes + getCacheKey(apiEndpoint, queryString) + ".json"
 
 # TODO: implement better encoding - right now its about replacing spaces with %20
 def encodeString(strValue):
@@ -127,6 +191,14 @@ class NameValue:
         else:
             self.value = defaultValue
 
+def getAlignedNowTimestamp():
+    "Returns now in seconds - rounded down to timealign seconds, so that the same relative query within timealign seconds results in the same timestamps and therefore the same cached query"
+    now = int(datetime.datetime.now().timestamp())
+    timeAlign = int(getConfigValue("timealign"))
+    if timeAlign > 0:
+        now = now - (now % timeAlign)
+    return now
+
 # Timeframe definition
 class TimeframeDef:
     def __init__(self, timeframe):
@@ -142,6 +214,8 @@ class TimeframeDef:
         self.timestamp = []
         self.allowedConsts = ["hour", "2hours", "6hours", "day", "week", "month"]
 
+        now = getAlignedNowTimestamp()
+
         self.timeframestr = timeframe.split(":")
         for timeframe in self.timeframestr:
             if operator.contains(self.allowedConsts, timeframe):
@@ -150,7 +224,7 @@ class TimeframeDef:
                 # if it is an int check whether it is a number we convert relative to now or whether it is a full timestamp
                 tsint = int(timeframe)
                 if tsint < global_timestampcheck:
-                    self.timestamp.append(1000 * int(datetime.datetime.now().timestamp() - tsint*60))
+                    self.timestamp.append(1000 * (now - tsint*60))
                 else:
                     self.timestamp.append(int(timeframe))
                 
@@ -165,7 +239,8 @@ class TimeframeDef:
         return self.isValid() and len(self.timeframestr) > 1
 
     def getNowAsStringForWebUI(self):
-        return str(1000*datetime.datetime.now().timestamp())
+        # the same now our relative timeframes are based on - otherwise links and reports wouldnt show the data we queried
+        return str(1000*getAlignedNowTimestamp())
 
     def timeframeAsStrForWebUI(self, frame=0):
         if self.isRelative(frame):
@@ -218,6 +293,1017 @@ def parseNameValue(nameValue, defaultName, defaultValue):
     partitions = nameValue.partition("=")
     return NameValue(partitions[0], partitions[2])
 
+# =========================================================
+# HTTP Connection Pool - one shared session for all API calls
+# =========================================================
+global_httpSession = None
+global_httpSessionLock = threading.Lock()
+global_cacheKeyLocks = {}
+global_cacheKeyLocksLock = threading.Lock()
+
+def getHttpSession():
+    "Returns the shared HTTP session used for all calls to the Dynatrace API"
+    "The session keeps a pool of up to poolsize keep-alive connections so we dont pay TCP+TLS handshake for every API call"
+    global global_httpSession
+    with global_httpSessionLock:
+        if global_httpSession is None:
+            poolsize = int(getConfigValue("poolsize"))
+            adapter = requests.adapters.HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.verify = False
+            if int(getConfigValue("keepalive")) == 0:
+                session.headers["Connection"] = "close"
+            global_httpSession = session
+    return global_httpSession
+
+def getHttpTimeout():
+    "Returns the (connect, read) timeout in seconds for calls to the Dynatrace API"
+    return (float(getConfigValue("connecttimeout")), float(getConfigValue("readtimeout")))
+
+def getHttpConnectionStatistics():
+    "Returns how many requests we sent and how many connections we had to open for it across all pooled connections"
+    statistics = {"requests" : 0, "connections" : 0, "reused" : 0}
+    if global_httpSession is None:
+        return statistics
+
+    # http:// and https:// are mounted on the same adapter - so make sure we only count it once
+    adapters = {}
+    for adapter in global_httpSession.adapters.values():
+        adapters[id(adapter)] = adapter
+
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for poolKey in pools.keys():
+            pool = pools[poolKey]
+            if pool is not None:
+                statistics["requests"] += pool.num_requests
+                statistics["connections"] += pool.num_connections
+
+    statistics["reused"] = max(0, statistics["requests"] - statistics["connections"])
+    return statistics
+
+def httpConnectionStatisticsAsStr():
+    "Returns the connection pool statistics as printable string"
+    statistics = getHttpConnectionStatistics()
+    return "requests: " + str(statistics["requests"]) + ", connections opened: " + str(statistics["connections"]) + ", connections reused: " + str(statistics["reused"])
+
+def sendDynatraceAPIRequest(httpMethod, apiEndpoint, queryString, postBody, additionalHeaders=None):
+    "Sends the request to the Dynatrace API through our pooled HTTP session. postBody is only sent for POST, PUT and DELETE"
+    requestBody = None
+    if httpMethod != HTTP_GET:
+        requestBody = postBody
+
+    requestHeaders = getAuthenticationHeader()
+    if additionalHeaders is not None:
+        requestHeaders.update(additionalHeaders)
+
+    startTime = time.time()
+    try:
+        myResponse = getHttpSession().request(httpMethod, getRequestUrl(apiEndpoint, queryString), headers=requestHeaders, json=requestBody, timeout=getHttpTimeout())
+    except requests.exceptions.Timeout as e:
+        raise Exception("Error", "Dynatrace API call timed out: " + str(e))
+    except requests.exceptions.ConnectionError as e:
+        raise Exception("Error", "Cannot connect to Dynatrace API: " + str(e))
+
+    debugLog("HTTP " + httpMethod + " " + apiEndpoint + " returned " + str(myResponse.status_code) + " in " + str(int((time.time() - startTime) * 1000)) + "ms - " + httpConnectionStatisticsAsStr())
+    return myResponse
+
+def getCacheKeyLock(cacheKey):
+    "Returns the lock object that guards reading and filling the cache for that cache key within this process"
+    with global_cacheKeyLocksLock:
+        cacheKeyLock = getAttributeOrNone(global_cacheKeyLocks, cacheKey)
+        if cacheKeyLock is None:
+            cacheKeyLock = threading.Lock()
+            global_cacheKeyLocks[cacheKey] = cacheKeyLock
+    return cacheKeyLock
+
+# =========================================================
+# Response Memo - in-memory LRU of parsed API responses for the current run
+# NOTE: the memo hands out the same objects to every caller - callers must not modify what queryDynatraceAPIEx returns
+# =========================================================
+global_responseMemo = collections.OrderedDict()
+global_responseMemoLock = threading.Lock()
+global_responseMemoStatistics = {"hits" : 0, "misses" : 0, "bytes" : 0}
+
+def getResponseMemoKey(httpMethod, apiEndpoint, queryString):
+    "Returns the key we memorize a response with: method, tenant, endpoint and query string"
+    return (httpMethod, config["tenanthost"], apiEndpoint, queryString)
+
+def lookupResponseMemo(memoKey, countMiss=True):
+    "Returns a (jsonContent,) tuple in case we have that response in our memo, otherwise None"
+    with global_responseMemoLock:
+        memoEntry = getAttributeOrNone(global_responseMemo, memoKey)
+        if memoEntry is None:
+            if countMiss:
+                global_responseMemoStatistics["misses"] += 1
+            return None
+
+        global_responseMemo.move_to_end(memoKey)
+        global_responseMemoStatistics["hits"] += 1
+        debugLog("served from response memo: " + memoKey[2] + "?" + memoKey[3])
+        return (memoEntry[0],)
+
+def storeResponseMemo(memoKey, jsonContent, contentBytes):
+    "Memorizes the parsed response. contentBytes is the size of the raw response which we use to stay within memocache bytes"
+    memoCapacity = int(getConfigValue("memocache"))
+    if jsonContent is None or contentBytes > memoCapacity:
+        return
+
+    with global_responseMemoLock:
+        previousEntry = global_responseMemo.pop(memoKey, None)
+        if previousEntry is not None:
+            global_responseMemoStatistics["bytes"] -= previousEntry[1]
+
+        global_responseMemo[memoKey] = (jsonContent, contentBytes)
+        global_responseMemoStatistics["bytes"] += contentBytes
+
+        # evict the least recently used responses until we are back within our capacity
+        while global_responseMemoStatistics["bytes"] > memoCapacity:
+            evictedEntry = global_responseMemo.popitem(last=False)[1]
+            global_responseMemoStatistics["bytes"] -= evictedEntry[1]
+
+def clearResponseMemo():
+    "Forgets all memorized responses"
+    with global_responseMemoLock:
+        global_responseMemo.clear()
+        global_responseMemoStatistics["bytes"] = 0
+
+def responseMemoStatisticsAsStr():
+    "Returns the memo statistics as printable string"
+    return "hits: " + str(global_responseMemoStatistics["hits"]) + ", misses: " + str(global_responseMemoStatistics["misses"]) + ", entries: " + str(len(global_responseMemo)) + ", bytes: " + str(global_responseMemoStatistics["bytes"])
+
+# =========================================================
+# Cache Backends - where we store the responses of HTTP GET calls
+# file   = one JSON file per query in a directory per tenant, sharded by the hash of the query (default). Still reads the old layout of our smpljson demo data
+# sqlite = all queries of all tenants in a single SQLite file in the cachedir
+# =========================================================
+CACHE_BACKEND_FILE = "file"
+CACHE_BACKEND_SQLITE = "sqlite"
+CACHE_ENCODING_JSON = "json"
+CACHE_ENCODING_NDJSON = "ndjson"
+CACHE_SQLITE_FILENAME = "dtcli-cache.sqlite"
+CACHE_INDEX_FILENAME = "cacheindex.idx"
+CACHE_FILL_LOCK_FILENAME = "fill.lock"
+CACHE_STATE_FRESH = "fresh"
+CACHE_STATE_STALE = "stale"      # older than cacheupdate but within cachestale - served while we refresh it in the background
+CACHE_STATE_EXPIRED = "expired"
+CACHE_TTL_RESOLUTION = "resolution"
+CACHE_NEGATIVE_EXCLUDED_STATUS = [401, 403, 408, 429]   # auth problems and throttling say nothing about the query itself - we never cache those
+CACHE_STATS_TOPENDPOINTS = 5
+
+global_cacheBackends = {}
+global_cacheBackendsLock = threading.Lock()
+
+class CacheFileLock:
+    "Exclusive lock on a lock file that is shared by all dtcli processes using the same cachedir"
+    def __init__(self, lockFilename):
+        self.lockFilename = lockFilename
+        self.lockFile = None
+
+    def acquire(self):
+        directory = os.path.dirname(self.lockFilename)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.lockFile = open(self.lockFilename, "a+")
+        if not self.lockFileRegion(False):
+            debugLog("Waiting for another dtcli process holding " + self.lockFilename)
+            startTime = time.time()
+            self.lockFileRegion(True)
+            debugLog("Waited " + str(int((time.time() - startTime) * 1000)) + "ms for " + self.lockFilename)
+
+    def lockFileRegion(self, blocking):
+        "Locks the lock file. Returns False in case blocking is False and another process holds the lock"
+        if fcntl is not None:
+            try:
+                if blocking:
+                    fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX)
+                else:
+                    fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            return True
+
+        # Windows: we lock the first byte of the file. LK_LOCK gives up after 10 seconds - so we keep trying
+        self.lockFile.seek(0)
+        while True:
+            try:
+                msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.05)
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_UN)
+            else:
+                self.lockFile.seek(0)
+                msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.lockFile.close()
+            self.lockFile = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.release()
+
+def writeFileAtomically(filename, text, modifiedAt=None):
+    "Writes to a temp file in the same directory and renames it - readers in other processes either see the old or the new file but never a half written one"
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    fileDescriptor, temporaryFilename = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".tmp")
+    try:
+        with os.fdopen(fileDescriptor, "w") as output_file:
+            output_file.write(text)
+        os.chmod(temporaryFilename, 0o644)
+        if modifiedAt is not None:
+            os.utime(temporaryFilename, (modifiedAt, modifiedAt))
+        os.replace(temporaryFilename, filename)
+    except Exception as e:
+        if os.path.exists(temporaryFilename):
+            os.remove(temporaryFilename)
+        raise e
+
+def getCacheFillLockFilename(apiEndpoint, queryString):
+    "Returns the lock file that guards filling the cache for that query across dtcli processes - for all cache backends"
+    "All queries of a hash shard share one lock file - so a tenant never has more than 256 of them, no matter how many distinct queries we run"
+    return os.path.dirname(getHashedCacheFilename(getCacheDirectory(), getCacheTenant(), getCacheKey(apiEndpoint, queryString), ".lock")) + osfileslashes + CACHE_FILL_LOCK_FILENAME
+
+class CacheEntry:
+    "An entry in the cache. The content itself is only loaded when really needed"
+    def __init__(self, storedAt, contentBytes, loader, validators=None, resolution=None, negative=None):
+        self.storedAt = storedAt            # unix timestamp when this entry was stored - or last revalidated with the API
+        self.contentBytes = contentBytes    # size of the stored JSON content
+        self.loader = loader                # function that loads and parses the JSON content
+        self.validators = validators        # {"etag", "lastModified"} the API returned with the content - if any
+        self.resolution = resolution        # resolutionInMillisUTC of a cached timeseries result - used by the resolution cachepolicy
+        self.negative = negative            # HTTP status of a cached API error (see cachenegative) - None for regular entries
+
+    def getContent(self):
+        return self.loader()
+
+class FileCacheIndex:
+    "The index of a file cache tenant directory: bytes, store and last access time of every entry plus the hit/miss counters of that tenant"
+    "Reads only update the index in memory - we write it when storing or removing entries and when we flush at the end of the run"
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.entries = None
+        self.hits = 0
+        self.misses = 0
+        self.storedEntries = {}
+        self.removedEntries = set()
+        self.accessedEntries = {}
+        self.pendingHits = 0
+        self.pendingMisses = 0
+
+    def readIndexFile(self):
+        try:
+            with open(self.filename) as indexFile:
+                indexContent = json.load(indexFile)
+        except (OSError, ValueError):
+            indexContent = {}
+        return {"hits" : getAttributeOrDefault(indexContent, "hits", 0), "misses" : getAttributeOrDefault(indexContent, "misses", 0), "entries" : getAttributeOrDefault(indexContent, "entries", {})}
+
+    def getEntries(self):
+        "Returns entryHash -> {key, endpoint, bytes, storedAt, lastAccess[, validatedAt][, validators][, resolution][, negative]}"
+        with self.lock:
+            if self.entries is None:
+                indexContent = self.readIndexFile()
+                self.entries = indexContent["entries"]
+                self.hits = indexContent["hits"]
+                self.misses = indexContent["misses"]
+            return self.entries
+
+    def getStatistics(self):
+        "Returns (entries, hits, misses)"
+        with self.lock:
+            return (self.getEntries(), self.hits, self.misses)
+
+    def store(self, entryHash, cacheKey, apiEndpoint, contentBytes, storedAt, validators=None, resolution=None, negative=None):
+        with self.lock:
+            entry = {"key" : cacheKey, "endpoint" : apiEndpoint, "bytes" : contentBytes, "storedAt" : storedAt, "lastAccess" : time.time()}
+            if validators is not None:
+                entry["validators"] = validators
+            if resolution is not None:
+                entry["resolution"] = resolution
+            if negative is not None:
+                entry["negative"] = negative
+            self.getEntries()[entryHash] = entry
+            self.storedEntries[entryHash] = entry
+            self.removedEntries.discard(entryHash)
+
+    def markValidated(self, entryHash, validatedAt):
+        with self.lock:
+            entry = getAttributeOrNone(self.getEntries(), entryHash)
+            if entry is not None:
+                entry["validatedAt"] = validatedAt
+                self.storedEntries[entryHash] = entry
+
+    def remove(self, entryHash):
+        with self.lock:
+            self.getEntries().pop(entryHash, None)
+            self.storedEntries.pop(entryHash, None)
+            self.removedEntries.add(entryHash)
+
+    def recordAccess(self, entryHash, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.pendingHits += 1
+            else:
+                self.misses += 1
+                self.pendingMisses += 1
+
+            entry = getAttributeOrNone(self.getEntries(), entryHash)
+            if entry is not None:
+                entry["lastAccess"] = time.time()
+                self.accessedEntries[entryHash] = entry["lastAccess"]
+
+    def hasChanges(self):
+        return len(self.storedEntries) > 0 or len(self.removedEntries) > 0 or len(self.accessedEntries) > 0 or self.pendingHits > 0 or self.pendingMisses > 0
+
+    def sync(self):
+        "Merges our changes into what is currently on disk - other dtcli processes might share the same cachedir - and writes the index"
+        with self.lock:
+            if not self.hasChanges():
+                # nothing to write - but we pick up what other processes wrote the next time we need the entries
+                self.entries = None
+                return
+
+            # other dtcli processes merge their changes into the same index file
+            with CacheFileLock(self.filename[:-len(".idx")] + ".lock"):
+                self.mergeAndWrite()
+
+    def mergeAndWrite(self):
+        with self.lock:
+            indexContent = self.readIndexFile()
+            entries = indexContent["entries"]
+            for entryHash in self.removedEntries:
+                entries.pop(entryHash, None)
+            entries.update(self.storedEntries)
+            for entryHash, lastAccess in self.accessedEntries.items():
+                entry = getAttributeOrNone(entries, entryHash)
+                if entry is not None:
+                    entry["lastAccess"] = max(entry["lastAccess"], lastAccess)
+            indexContent["hits"] += self.pendingHits
+            indexContent["misses"] += self.pendingMisses
+
+            writeCacheIndexFile(self.filename, indexContent)
+
+            self.entries = entries
+            self.hits = indexContent["hits"]
+            self.misses = indexContent["misses"]
+            self.storedEntries = {}
+            self.removedEntries = set()
+            self.accessedEntries = {}
+            self.pendingHits = 0
+            self.pendingMisses = 0
+
+class FileCacheBackend:
+    "One JSON file per query: <cachedir>/<tenant>/<shard>/<hash of the cache key>.json plus a cacheindex.idx per tenant"
+    "Files of the old layout <cachedir>/<tenant>/<endpoint>[/<querystring>].json - e.g: our smpljson demo data - are still read"
+    name = CACHE_BACKEND_FILE
+
+    def __init__(self, cacheDirectory):
+        self.cacheDirectory = cacheDirectory
+        self.indexes = {}
+        self.indexesLock = threading.Lock()
+
+    def getIndex(self, tenant):
+        with self.indexesLock:
+            index = getAttributeOrNone(self.indexes, tenant)
+            if index is None:
+                index = FileCacheIndex(self.cacheDirectory + tenant + osfileslashes + CACHE_INDEX_FILENAME)
+                self.indexes[tenant] = index
+        return index
+
+    def findEntryFile(self, apiEndpoint, queryString):
+        "Returns (filename, stat) of the cached query - the hashed file or a file of the old layout - or None"
+        cacheKey = getCacheKey(apiEndpoint, queryString)
+        for fullCacheFilename in [getHashedCacheFilename(self.cacheDirectory, getCacheTenant(), cacheKey, ".json"), getCacheFilename(apiEndpoint, queryString)]:
+            try:
+                return (fullCacheFilename, os.stat(fullCacheFilename))
+            except OSError:
+                # doesnt exist - or the old layout exceeds the max filename length of the OS
+                pass
+        return None
+
+    def lookup(self, apiEndpoint, queryString):
+        entryFile = self.findEntryFile(apiEndpoint, queryString)
+        if entryFile is None:
+            return lookupCacheSnapshot(apiEndpoint, queryString)
+        fullCacheFilename = entryFile[0]
+
+        # a revalidated entry keeps its file - the index knows when we last validated it and the validators we need for that
+        storedAt = entryFile[1].st_mtime
+        validators = None
+        resolution = None
+        negative = None
+        indexEntry = getAttributeOrNone(self.getIndex(getCacheTenant()).getEntries(), getCacheKeyHash(getCacheKey(apiEndpoint, queryString)))
+        if indexEntry is not None:
+            storedAt = max(storedAt, getAttributeOrDefault(indexEntry, "validatedAt", 0))
+            validators = getAttributeOrNone(indexEntry, "validators")
+            resolution = getAttributeOrNone(indexEntry, "resolution")
+            negative = getAttributeOrNone(indexEntry, "negative")
+        return CacheEntry(storedAt, entryFile[1].st_size, lambda: self.loadContent(fullCacheFilename), validators, resolution, negative)
+
+    def loadContent(self, fullCacheFilename):
+        with open(fullCacheFilename) as json_data:
+            return json.load(json_data)
+
+    def store(self, apiEndpoint, queryString, jsonText, validators=None, resolution=None, negative=None):
+        tenant = getCacheTenant()
+        self.storeEx(tenant, getCacheKey(apiEndpoint, queryString), apiEndpoint, time.time(), jsonText, True, validators, resolution, negative)
+
+        # lets stay within our byte budget
+        cacheSize = int(getConfigValue("cachesize"))
+        if cacheSize > 0 and self.getTotalBytes(tenant) > cacheSize:
+            self.prune(tenant, cacheSize)
+
+    def storeEx(self, tenant, cacheKey, apiEndpoint, storedAt, jsonText, commit=True, validators=None, resolution=None, negative=None):
+        fullCacheFilename = getHashedCacheFilename(self.cacheDirectory, tenant, cacheKey, ".json")
+        writeFileAtomically(fullCacheFilename, jsonText, storedAt)
+
+        index = self.getIndex(tenant)
+        index.store(getCacheKeyHash(cacheKey), cacheKey, apiEndpoint, os.path.getsize(fullCacheFilename), storedAt, validators, resolution, negative)
+        if commit:
+            index.sync()
+
+    def markValidated(self, apiEndpoint, queryString, validatedAt):
+        "The API confirmed our cached content is still current - the entry counts as stored at validatedAt from now on"
+        index = self.getIndex(getCacheTenant())
+        index.markValidated(getCacheKeyHash(getCacheKey(apiEndpoint, queryString)), validatedAt)
+        index.sync()
+
+    def migrate(self, tenant, sourceDirectory):
+        "Imports all cached queries of a directory with the old file cache layout, e.g: smpljson. Returns the number of imported entries"
+        importedEntries = 0
+        for cacheKey, fullCacheFilename in listCacheFiles(sourceDirectory):
+            self.storeEx(tenant, cacheKey, getEndpointForCacheKey(cacheKey), os.path.getmtime(fullCacheFilename), readCacheFileAsText(fullCacheFilename), False)
+            importedEntries += 1
+        self.getIndex(tenant).sync()
+        return importedEntries
+
+    def exportEntries(self, tenant):
+        "Returns (cacheKey, apiEndpoint, storedAt, resolution, loadText) of every cached query of the tenant - of the old and the hashed layout. API errors are left out"
+        exportedEntries = []
+        for cacheKey, fullCacheFilename in listCacheFiles(self.cacheDirectory + tenant):
+            exportedEntries.append((cacheKey, getEndpointForCacheKey(cacheKey), os.path.getmtime(fullCacheFilename), None, lambda fullCacheFilename=fullCacheFilename: readCacheFileAsText(fullCacheFilename)))
+
+        index = self.getIndex(tenant)
+        with index.lock:
+            index.sync()
+            for entry in index.getEntries().values():
+                if getAttributeOrNone(entry, "negative") is None:
+                    fullCacheFilename = getHashedCacheFilename(self.cacheDirectory, tenant, entry["key"], ".json")
+                    exportedEntries.append((entry["key"], entry["endpoint"], max(entry["storedAt"], getAttributeOrDefault(entry, "validatedAt", 0)), getAttributeOrNone(entry, "resolution"), lambda fullCacheFilename=fullCacheFilename: readCacheFileAsText(fullCacheFilename)))
+        return exportedEntries
+
+    def getVersion(self, apiEndpoint, queryString):
+        entryFile = self.findEntryFile(apiEndpoint, queryString)
+        if entryFile is None:
+            return getCacheSnapshotVersion(apiEndpoint, queryString)
+        return str(entryFile[1].st_mtime_ns) + "-" + str(entryFile[1].st_size)
+
+    def recordAccess(self, apiEndpoint, queryString, hit):
+        self.getIndex(getCacheTenant()).recordAccess(getCacheKeyHash(getCacheKey(apiEndpoint, queryString)), hit)
+
+    def removeEntry(self, tenant, entryHash):
+        "Removes the cached content and every index we persisted next to it, e.g: the timeseries catalog"
+        shardDirectory = self.cacheDirectory + tenant + osfileslashes + entryHash[:2]
+        if os.path.isdir(shardDirectory):
+            for filename in os.listdir(shardDirectory):
+                # we keep the lock file - another process might hold it right now
+                if filename.startswith(entryHash + ".") and not filename.endswith(".lock"):
+                    os.remove(shardDirectory + osfileslashes + filename)
+        self.getIndex(tenant).remove(entryHash)
+
+    def removeExpired(self, tenant, storedBefore):
+        "Removes all cached queries of the tenant that were stored before that timestamp. Returns the number of removed entries"
+        "Only entries of the hashed layout are removed - directories with the old layout, e.g: the smpljson demo data, are only read and migrated"
+        removedEntries = 0
+        index = self.getIndex(tenant)
+        with index.lock:
+            index.sync()
+            for entryHash, entry in list(index.getEntries().items()):
+                if max(entry["storedAt"], getAttributeOrDefault(entry, "validatedAt", 0)) < storedBefore:
+                    self.removeEntry(tenant, entryHash)
+                    removedEntries += 1
+            index.sync()
+        return removedEntries
+
+    def getTotalBytes(self, tenant):
+        index = self.getIndex(tenant)
+        with index.lock:
+            return sum([entry["bytes"] for entry in index.getEntries().values()])
+
+    def prune(self, tenant, maxBytes):
+        "Removes the least recently used entries of the tenant until we are within maxBytes. Returns the number of removed entries"
+        removedEntries = 0
+        index = self.getIndex(tenant)
+        with index.lock:
+            index.sync()
+            totalBytes = self.getTotalBytes(tenant)
+            for entryHash, entry in sorted(index.getEntries().items(), key=lambda indexEntry: indexEntry[1]["lastAccess"]):
+                if totalBytes <= maxBytes:
+                    break
+                self.removeEntry(tenant, entryHash)
+                totalBytes -= entry["bytes"]
+                removedEntries += 1
+            index.sync()
+
+        if removedEntries > 0:
+            debugLog("Evicted " + str(removedEntries) + " least recently used cache entries of " + tenant + " to stay within " + str(maxBytes) + " bytes")
+        return removedEntries
+
+    def getTenants(self):
+        "Returns all tenants that have a cache index in our cachedir"
+        if not os.path.isdir(self.cacheDirectory):
+            return []
+        return [tenant for tenant in sorted(os.listdir(self.cacheDirectory)) if os.path.isfile(self.cacheDirectory + tenant + osfileslashes + CACHE_INDEX_FILENAME)]
+
+    def getStatistics(self, tenant):
+        index = self.getIndex(tenant)
+        index.sync()
+        entries, hits, misses = index.getStatistics()
+        return buildCacheStatistics(tenant, [(entry["endpoint"], entry["bytes"], getAttributeOrNone(entry, "negative")) for entry in entries.values()], hits, misses)
+
+    def flush(self):
+        with self.indexesLock:
+            indexes = list(self.indexes.values())
+        for index in indexes:
+            index.sync()
+
+class SqliteCacheBackend:
+    "All cached queries in a single SQLite file. Content is stored zlib compressed in case cachecompress is 1"
+    name = CACHE_BACKEND_SQLITE
+
+    def __init__(self, cacheDirectory):
+        self.filename = cacheDirectory + CACHE_SQLITE_FILENAME
+        self.threadState = threading.local()
+        self.accessLock = threading.Lock()
+        self.accessedEntries = {}
+        self.accessCounters = {}
+
+    def getConnection(self):
+        "Every thread gets its own connection to our SQLite file"
+        connection = getattr(self.threadState, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.filename)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.filename, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache (tenant TEXT NOT NULL, cachekey TEXT NOT NULL, endpoint TEXT, storedat REAL NOT NULL, bytes INTEGER NOT NULL, compressed INTEGER NOT NULL, content BLOB, lastaccess REAL, etag TEXT, lastmodified TEXT, validatedat REAL, resolution INTEGER, negative INTEGER, PRIMARY KEY (tenant, cachekey))")
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_storedat ON cache (tenant, storedat)")
+            connection.execute("CREATE TABLE IF NOT EXISTS cachestats (tenant TEXT NOT NULL PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL)")
+            # cache files created by older versions of dtcli miss some of our columns
+            columns = [column[1] for column in connection.execute("PRAGMA table_info(cache)").fetchall()]
+            for columnName, columnType in [("lastaccess", "REAL"), ("etag", "TEXT"), ("lastmodified", "TEXT"), ("validatedat", "REAL"), ("resolution", "INTEGER"), ("negative", "INTEGER")]:
+                if not operator.contains(columns, columnName):
+                    connection.execute("ALTER TABLE cache ADD COLUMN " + columnName + " " + columnType)
+            connection.commit()
+            self.threadState.connection = connection
+        return connection
+
+    def lookup(self, apiEndpoint, queryString):
+        tenant = getCacheTenant()
+        cacheKey = getCacheKey(apiEndpoint, queryString)
+        row = self.getConnection().execute("SELECT MAX(storedat, COALESCE(validatedat, 0)), bytes, etag, lastmodified, resolution, negative FROM cache WHERE tenant=? AND cachekey=?", (tenant, cacheKey)).fetchone()
+        if row is None:
+            return lookupCacheSnapshot(apiEndpoint, queryString)
+        validators = None
+        if row[2] is not None or row[3] is not None:
+            validators = {"etag" : row[2], "lastModified" : row[3]}
+        return CacheEntry(row[0], row[1], lambda: self.loadContent(tenant, cacheKey), validators, row[4], row[5])
+
+    def loadContent(self, tenant, cacheKey):
+        row = self.getConnection().execute("SELECT compressed, content FROM cache WHERE tenant=? AND cachekey=?", (tenant, cacheKey)).fetchone()
+        content = row[1]
+        if row[0] == 1:
+            content = zlib.decompress(content)
+        return json.loads(content)
+
+    def store(self, apiEndpoint, queryString, jsonText, validators=None, resolution=None, negative=None):
+        tenant = getCacheTenant()
+        self.storeEx(tenant, getCacheKey(apiEndpoint, queryString), apiEndpoint, time.time(), jsonText, True, validators, resolution, negative)
+
+        # lets stay within our byte budget
+        cacheSize = int(getConfigValue("cachesize"))
+        if cacheSize > 0 and self.getTotalBytes(tenant) > cacheSize:
+            self.prune(tenant, cacheSize)
+
+    def storeEx(self, tenant, cacheKey, apiEndpoint, storedAt, jsonText, commit=True, validators=None, resolution=None, negative=None):
+        content = jsonText.encode("utf-8")
+        contentBytes = len(content)
+        compressed = 0
+        if int(getConfigValue("cachecompress")) == 1:
+            content = zlib.compress(content)
+            compressed = 1
+
+        if validators is None:
+            validators = {}
+
+        connection = self.getConnection()
+        connection.execute("INSERT OR REPLACE INTO cache (tenant, cachekey, endpoint, storedat, bytes, compressed, content, lastaccess, etag, lastmodified, resolution, negative) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (tenant, cacheKey, apiEndpoint, storedAt, contentBytes, compressed, content, time.time(), getAttributeOrNone(validators, "etag"), getAttributeOrNone(validators, "lastModified"), resolution, negative))
+        if commit:
+            connection.commit()
+
+    def markValidated(self, apiEndpoint, queryString, validatedAt):
+        "The API confirmed our cached content is still current - the entry counts as stored at validatedAt from now on"
+        connection = self.getConnection()
+        connection.execute("UPDATE cache SET validatedat=? WHERE tenant=? AND cachekey=?", (validatedAt, getCacheTenant(), getCacheKey(apiEndpoint, queryString)))
+        connection.commit()
+
+    def migrate(self, tenant, sourceDirectory):
+        "Imports all cached queries of a file cache tenant directory, e.g: smpljson. Returns the number of imported entries"
+        importedEntries = 0
+        for cacheKey, fullCacheFilename in listCacheFiles(sourceDirectory):
+            self.storeEx(tenant, cacheKey, getEndpointForCacheKey(cacheKey), os.path.getmtime(fullCacheFilename), readCacheFileAsText(fullCacheFilename), False)
+            importedEntries += 1
+        self.getConnection().commit()
+        return importedEntries
+
+    def exportEntries(self, tenant):
+        "Returns (cacheKey, apiEndpoint, storedAt, resolution, loadText) of every cached query of the tenant. API errors are left out"
+        rows = self.getConnection().execute("SELECT cachekey, endpoint, MAX(storedat, COALESCE(validatedat, 0)), resolution FROM cache WHERE tenant=? AND negative IS NULL", (tenant,)).fetchall()
+        return [(row[0], row[1], row[2], row[3], lambda cacheKey=row[0]: json.dumps(self.loadContent(tenant, cacheKey))) for row in rows]
+
+    def getVersion(self, apiEndpoint, queryString):
+        row = self.getConnection().execute("SELECT storedat, bytes FROM cache WHERE tenant=? AND cachekey=?", (getCacheTenant(), getCacheKey(apiEndpoint, queryString))).fetchone()
+        if row is None:
+            return getCacheSnapshotVersion(apiEndpoint, queryString)
+        return repr(row[0]) + "-" + str(row[1])
+
+    def recordAccess(self, apiEndpoint, queryString, hit):
+        "We only remember the access here - flush writes it to the database"
+        tenant = getCacheTenant()
+        with self.accessLock:
+            counters = getAttributeOrNone(self.accessCounters, tenant)
+            if counters is None:
+                counters = [0, 0]
+                self.accessCounters[tenant] = counters
+            if hit:
+                counters[0] += 1
+            else:
+                counters[1] += 1
+            self.accessedEntries[(tenant, getCacheKey(apiEndpoint, queryString))] = time.time()
+
+    def removeExpired(self, tenant, storedBefore):
+        "Removes all cached queries of the tenant that were stored before that timestamp. Returns the number of removed entries"
+        connection = self.getConnection()
+        removedEntries = connection.execute("DELETE FROM cache WHERE tenant=? AND MAX(storedat, COALESCE(validatedat, 0)) < ?", (tenant, storedBefore)).rowcount
+        connection.commit()
+        return removedEntries
+
+    def getTotalBytes(self, tenant):
+        return self.getConnection().execute("SELECT COALESCE(SUM(bytes), 0) FROM cache WHERE tenant=?", (tenant,)).fetchone()[0]
+
+    def prune(self, tenant, maxBytes):
+        "Removes the least recently used entries of the tenant until we are within maxBytes. Returns the number of removed entries"
+        self.flush()
+        connection = self.getConnection()
+        totalBytes = self.getTotalBytes(tenant)
+        removedEntries = 0
+        for cacheKey, contentBytes in connection.execute("SELECT cachekey, bytes FROM cache WHERE tenant=? ORDER BY COALESCE(lastaccess, storedat)", (tenant,)).fetchall():
+            if totalBytes <= maxBytes:
+                break
+            connection.execute("DELETE FROM cache WHERE tenant=? AND cachekey=?", (tenant, cacheKey))
+            totalBytes -= contentBytes
+            removedEntries += 1
+        connection.commit()
+
+        if removedEntries > 0:
+            debugLog("Evicted " + str(removedEntries) + " least recently used cache entries of " + tenant + " to stay within " + str(maxBytes) + " bytes")
+        return removedEntries
+
+    def getTenants(self):
+        if not os.path.isfile(self.filename):
+            return []
+        connection = self.getConnection()
+        return sorted(set([row[0] for row in connection.execute("SELECT DISTINCT tenant FROM cache").fetchall()] + [row[0] for row in connection.execute("SELECT tenant FROM cachestats").fetchall()]))
+
+    def getStatistics(self, tenant):
+        self.flush()
+        connection = self.getConnection()
+        counters = connection.execute("SELECT hits, misses FROM cachestats WHERE tenant=?", (tenant,)).fetchone()
+        if counters is None:
+            counters = (0, 0)
+        return buildCacheStatistics(tenant, connection.execute("SELECT endpoint, bytes, negative FROM cache WHERE tenant=?", (tenant,)).fetchall(), counters[0], counters[1])
+
+    def flush(self):
+        with self.accessLock:
+            accessedEntries = self.accessedEntries
+            accessCounters = self.accessCounters
+            self.accessedEntries = {}
+            self.accessCounters = {}
+        if len(accessedEntries) == 0 and len(accessCounters) == 0:
+            return
+
+        connection = self.getConnection()
+        connection.executemany("UPDATE cache SET lastaccess=? WHERE tenant=? AND cachekey=?", [(lastAccess, key[0], key[1]) for key, lastAccess in accessedEntries.items()])
+        for tenant, counters in accessCounters.items():
+            connection.execute("INSERT OR IGNORE INTO cachestats (tenant, hits, misses) VALUES (?, 0, 0)", (tenant,))
+            connection.execute("UPDATE cachestats SET hits=hits+?, misses=misses+? WHERE tenant=?", (counters[0], counters[1], tenant))
+        connection.commit()
+
+# =========================================================
+# Cache Snapshots - all cached queries of a tenant packed into a single archive, e.g: to replay a realistic tenant offline like smpljson
+# Layout: <magic> <zlib compressed JSON of each entry> ... <zlib compressed JSON index> <trailer: offset and length of the index>
+# An imported snapshot is memory-mapped and both cache backends read from it whenever they dont have a query themselves - we never unpack it
+# =========================================================
+CACHE_SNAPSHOT_MAGIC = b"DTSNAP01"
+CACHE_SNAPSHOT_EXTENSION = ".dtsnap"
+CACHE_SNAPSHOT_TRAILER = struct.Struct("<QQ")
+
+global_cacheSnapshots = {}
+global_cacheSnapshotsLock = threading.Lock()
+
+class CacheSnapshot:
+    "A read-only, memory-mapped snapshot archive. Its index maps cacheKey -> [offset, length, bytes, endpoint, storedAt, resolution]"
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as snapshotFile:
+            if os.fstat(snapshotFile.fileno()).st_size < len(CACHE_SNAPSHOT_MAGIC) + CACHE_SNAPSHOT_TRAILER.size:
+                raise Exception("Error", filename + " is not a dtcli snapshot")
+            self.content = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.content[:len(CACHE_SNAPSHOT_MAGIC)] != CACHE_SNAPSHOT_MAGIC:
+            raise Exception("Error", filename + " is not a dtcli snapshot")
+
+        indexOffset, indexLength = CACHE_SNAPSHOT_TRAILER.unpack(self.content[-CACHE_SNAPSHOT_TRAILER.size:])
+        index = json.loads(zlib.decompress(self.content[indexOffset:indexOffset + indexLength]).decode("utf-8"))
+        self.tenant = index["tenant"]
+        self.createdAt = index["createdAt"]
+        self.entries = index["entries"]
+
+    def lookup(self, cacheKey):
+        indexEntry = getAttributeOrNone(self.entries, cacheKey)
+        if indexEntry is None:
+            return None
+        return CacheEntry(indexEntry[4], indexEntry[2], lambda: self.loadContent(indexEntry), None, indexEntry[5])
+
+    def loadText(self, indexEntry):
+        return zlib.decompress(self.content[indexEntry[0]:indexEntry[0] + indexEntry[1]]).decode("utf-8")
+
+    def loadContent(self, indexEntry):
+        return json.loads(self.loadText(indexEntry))
+
+    def getVersion(self, cacheKey):
+        indexEntry = getAttributeOrNone(self.entries, cacheKey)
+        if indexEntry is None:
+            return None
+        return "snapshot-" + repr(self.createdAt) + "-" + str(indexEntry[0])
+
+def getCacheSnapshotFilename(tenant):
+    return getCacheDirectory() + tenant + CACHE_SNAPSHOT_EXTENSION
+
+def getCacheSnapshot(tenant):
+    "Returns the snapshot imported for that tenant into the current cachedir - or None. We map it again in case it got replaced by another import"
+    filename = getCacheSnapshotFilename(tenant)
+    try:
+        modifiedAt = os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+    with global_cacheSnapshotsLock:
+        cacheSnapshot = getAttributeOrNone(global_cacheSnapshots, filename)
+        if cacheSnapshot is None or cacheSnapshot[0] != modifiedAt:
+            cacheSnapshot = (modifiedAt, CacheSnapshot(filename))
+            global_cacheSnapshots[filename] = cacheSnapshot
+    return cacheSnapshot[1]
+
+def lookupCacheSnapshot(apiEndpoint, queryString):
+    "Returns the CacheEntry of that query from the snapshot of the current tenant - or None"
+    cacheSnapshot = getCacheSnapshot(getCacheTenant())
+    if cacheSnapshot is None:
+        return None
+    return cacheSnapshot.lookup(getCacheKey(apiEndpoint, queryString))
+
+def getCacheSnapshotVersion(apiEndpoint, queryString):
+    cacheSnapshot = getCacheSnapshot(getCacheTenant())
+    if cacheSnapshot is None:
+        return None
+    return cacheSnapshot.getVersion(getCacheKey(apiEndpoint, queryString))
+
+def exportCacheSnapshot(filename, tenant):
+    "Packs all cached queries of the tenant - of its imported snapshot and of the cachebackend - into a snapshot archive. Returns the number of packed queries"
+    snapshotEntries = {}
+    cacheSnapshot = getCacheSnapshot(tenant)
+    if cacheSnapshot is not None:
+        for cacheKey, indexEntry in cacheSnapshot.entries.items():
+            snapshotEntries[cacheKey] = (indexEntry[3], indexEntry[4], indexEntry[5], lambda indexEntry=indexEntry: cacheSnapshot.loadText(indexEntry))
+    for cacheKey, apiEndpoint, storedAt, resolution, loadText in getCacheBackend().exportEntries(tenant):
+        snapshotEntries[cacheKey] = (apiEndpoint, storedAt, resolution, loadText)
+
+    # just like writeFileAtomically - but we stream the entries into the temp file
+    directory = os.path.dirname(os.path.abspath(filename))
+    fileDescriptor, temporaryFilename = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".tmp")
+    try:
+        index = {}
+        with os.fdopen(fileDescriptor, "wb") as snapshotFile:
+            snapshotFile.write(CACHE_SNAPSHOT_MAGIC)
+            offset = len(CACHE_SNAPSHOT_MAGIC)
+            for cacheKey in sorted(snapshotEntries):
+                apiEndpoint, storedAt, resolution, loadText = snapshotEntries[cacheKey]
+                content = loadText().encode("utf-8")
+                compressedContent = zlib.compress(content)
+                snapshotFile.write(compressedContent)
+                index[cacheKey] = [offset, len(compressedContent), len(content), apiEndpoint, storedAt, resolution]
+                offset += len(compressedContent)
+
+            compressedIndex = zlib.compress(json.dumps({"tenant" : tenant, "createdAt" : time.time(), "entries" : index}).encode("utf-8"))
+            snapshotFile.write(compressedIndex)
+            snapshotFile.write(CACHE_SNAPSHOT_TRAILER.pack(offset, len(compressedIndex)))
+        os.chmod(temporaryFilename, 0o644)
+        os.replace(temporaryFilename, filename)
+    except Exception as e:
+        if os.path.exists(temporaryFilename):
+            os.remove(temporaryFilename)
+        raise e
+
+    return len(index)
+
+def importCacheSnapshot(filename, tenant=None):
+    "Copies a snapshot archive to <cachedir>/<tenant>.dtsnap - default is the tenant it was exported from. Returns (tenant, number of queries)"
+    cacheSnapshot = CacheSnapshot(filename)
+    if tenant is None:
+        tenant = cacheSnapshot.tenant
+
+    targetFilename = getCacheSnapshotFilename(tenant)
+    directory = os.path.dirname(os.path.abspath(targetFilename))
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    fileDescriptor, temporaryFilename = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".tmp")
+    os.close(fileDescriptor)
+    try:
+        shutil.copyfile(filename, temporaryFilename)
+        os.chmod(temporaryFilename, 0o644)
+        os.replace(temporaryFilename, targetFilename)
+    except Exception as e:
+        if os.path.exists(temporaryFilename):
+            os.remove(temporaryFilename)
+        raise e
+
+    return (tenant, len(cacheSnapshot.entries))
+
+def getCacheBackend():
+    "Returns the cache backend configured in cachebackend for the current cachedir"
+    backendName = getConfigValue("cachebackend")
+    cacheDirectory = getCacheDirectory()
+    with global_cacheBackendsLock:
+        cacheBackend = getAttributeOrNone(global_cacheBackends, (backendName, cacheDirectory))
+        if cacheBackend is None:
+            if backendName == CACHE_BACKEND_FILE:
+                cacheBackend = FileCacheBackend(cacheDirectory)
+            elif backendName == CACHE_BACKEND_SQLITE:
+                cacheBackend = SqliteCacheBackend(cacheDirectory)
+            else:
+                raise Exception("Error", "Cache backend '" + str(backendName) + "' not supported. Use " + CACHE_BACKEND_FILE + " or " + CACHE_BACKEND_SQLITE)
+            if len(global_cacheBackends) == 0:
+                atexit.register(flushCacheBackends)
+            global_cacheBackends[(backendName, cacheDirectory)] = cacheBackend
+    return cacheBackend
+
+def flushCacheBackends():
+    "Writes what we only kept in memory - last access times and hit/miss counters - of all cache backends we used"
+    with global_cacheBackendsLock:
+        cacheBackends = list(global_cacheBackends.values())
+    for cacheBackend in cacheBackends:
+        try:
+            cacheBackend.flush()
+        except Exception as e:
+            debugLog("Couldnt flush " + cacheBackend.name + " cache: " + str(e))
+
+def getCacheKeyHash(cacheKey):
+    "Returns the hash we use to store a cache key in the file cache"
+    return hashlib.sha1(cacheKey.encode("utf-8")).hexdigest()
+
+def getHashedCacheFilename(cacheDirectory, tenant, cacheKey, extension):
+    "Returns <cachedir>/<tenant>/<first 2 chars of hash>/<hash><extension> - the 2 char shards keep directories small"
+    cacheKeyHash = getCacheKeyHash(cacheKey)
+    return cacheDirectory + tenant + osfileslashes + cacheKeyHash[:2] + osfileslashes + cacheKeyHash + extension
+
+def buildCacheStatistics(tenant, entries, hits, misses):
+    "Returns the statistics of a tenant's cache. entries is a list of (endpoint, bytes, negative)"
+    endpoints = {}
+    for apiEndpoint, contentBytes, negative in entries:
+        endpointStatistics = getAttributeOrNone(endpoints, apiEndpoint)
+        if endpointStatistics is None:
+            endpointStatistics = {"endpoint" : apiEndpoint, "entries" : 0, "bytes" : 0}
+            endpoints[apiEndpoint] = endpointStatistics
+        endpointStatistics["entries"] += 1
+        endpointStatistics["bytes"] += contentBytes
+
+    hitRatio = None
+    if hits + misses > 0:
+        hitRatio = round(hits / (hits + misses), 4)
+
+    largestEndpoints = sorted(endpoints.values(), key=lambda endpointStatistics: endpointStatistics["bytes"], reverse=True)
+    negativeEntries = [entry for entry in entries if entry[2] is not None]
+    return {"tenant" : tenant, "entries" : len(entries), "bytes" : sum([entry[1] for entry in entries]), "negativeentries" : len(negativeEntries), "negativebytes" : sum([entry[1] for entry in negativeEntries]), "hits" : hits, "misses" : misses, "hitratio" : hitRatio, "largestendpoints" : largestEndpoints[:CACHE_STATS_TOPENDPOINTS]}
+
+def getCacheEntryState(cacheEntry, apiEndpoint, queryString):
+    "Applies cacheupdate: -1 = always use the cache, 0 = never use the cache, X = use the cache if the entry is younger than X seconds"
+    "Unless cacheupdate is -1 the TTL of the first matching cachepolicy wins over cacheupdate - with the same -1, 0 and X semantics"
+    "With cachestale S entries older than the TTL but younger than TTL+S are still served - as stale - while we refresh them in the background"
+    if cacheEntry is None:
+        return CACHE_STATE_EXPIRED
+    cacheupdate = getAttributeOrNone(config, "cacheupdate")
+    if(cacheupdate is None):
+        cacheupdate = -1
+    else:
+        cacheupdate = int(config["cacheupdate"])
+    if(cacheupdate == -1):
+        return CACHE_STATE_FRESH
+
+    if cacheEntry.negative is not None:
+        # errors are only remembered for a short time - and never served stale
+        if (time.time() - cacheEntry.storedAt) < int(getConfigValue("cachenegative")):
+            return CACHE_STATE_FRESH
+        return CACHE_STATE_EXPIRED
+
+    cacheTtl = getCachePolicyTtl(apiEndpoint, queryString, cacheEntry, cacheupdate)
+    if(cacheTtl == -1):
+        return CACHE_STATE_FRESH
+    if(cacheTtl > 0):
+        cacheEntryAge = time.time() - cacheEntry.storedAt
+        if cacheEntryAge < cacheTtl:
+            return CACHE_STATE_FRESH
+        if cacheEntryAge < cacheTtl + int(getConfigValue("cachestale")):
+            return CACHE_STATE_STALE
+    return CACHE_STATE_EXPIRED
+
+def getCachePolicyTtl(apiEndpoint, queryString, cacheEntry, cacheupdate):
+    "Returns the TTL of the first cachepolicy pattern that matches <endpoint>?<querystring> - or cacheupdate if none matches"
+    "A TTL of resolution means: as long as the resolutionInMillisUTC of the cached timeseries result"
+    for policyPattern, policyTtl in getConfigValue("cachepolicy").items():
+        if re.match(policyPattern, apiEndpoint + "?" + queryString) is None:
+            continue
+        if policyTtl == CACHE_TTL_RESOLUTION:
+            if (cacheEntry.resolution is not None) and (cacheEntry.resolution > 0):
+                return max(1, cacheEntry.resolution // 1000)
+            return cacheupdate
+        return int(policyTtl)
+    return cacheupdate
+
+def getContentResolution(jsonContent, queryString=""):
+    "Returns the resolutionInMillisUTC of a timeseries query result - or None for everything else"
+    "A total (queryMode=total) covers the whole timeframe - its resolution doesnt tell how long it stays current"
+    if operator.contains(queryString.split("&"), "queryMode=" + TIMESERIES_QUERYMODE_TOTAL):
+        return None
+    if isinstance(jsonContent, dict) and isinstance(jsonContent.get("result"), dict):
+        resolution = jsonContent["result"].get("resolutionInMillisUTC")
+        if isinstance(resolution, int):
+            return resolution
+    return None
+
+def listCacheFiles(tenantDirectory):
+    "Returns (cacheKey, filename) for every cached query in a file cache tenant directory with the old layout like smpljson"
+    cacheFiles = []
+    if not tenantDirectory.endswith(osfileslashes):
+        tenantDirectory += osfileslashes
+    for directory, subdirectories, filenames in os.walk(tenantDirectory):
+        if os.path.normpath(directory) == os.path.normpath(tenantDirectory):
+            # the shard directories of the hashed layout are not part of the old layout
+            subdirectories[:] = [subdirectory for subdirectory in subdirectories if re.fullmatch("[0-9a-f]{2}", subdirectory) is None]
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".json"):
+                fullCacheFilename = os.path.join(directory, filename)
+                cacheKey = fullCacheFilename[len(tenantDirectory):-5].replace(os.sep, osfileslashes)
+                cacheFiles.append((cacheKey, fullCacheFilename))
+    return cacheFiles
+
+def getEndpointForCacheKey(cacheKey):
+    "Returns the API endpoint a cache key belongs to - or the first part of the cache key if it is none of our known endpoints"
+    endpointPart = cacheKey.partition(osfileslashes)[0]
+    for apiEndpoint in API_ENDPOINTS:
+        if apiEndpoint.replace("/", "_") == endpointPart:
+            return apiEndpoint
+    return endpointPart
+
+def readCacheFileAsText(fullCacheFilename):
+    "Returns the content of a cache file as JSON text. Older cache files - like our smpljson demo data - are not always UTF-8"
+    with open(fullCacheFilename, "rb") as cacheFile:
+        content = cacheFile.read()
+    try:
+        content = content.decode("utf-8")
+    except UnicodeDecodeError:
+        content = content.decode("latin-1")
+
+    # we parse it to make sure it is valid JSON and store it the same way we store API responses
+    return json.dumps(json.loads(content))
+
 def queryDynatraceAPI(isGet, apiEndpoint, queryString, postBody):
     "Executes a Dynatrace REST API Query - either GET or POST. Internally calls queryDynatraceAPIEx"
     if isGet : httpMethod = HTTP_GET
@@ -227,68 +1313,692 @@ def queryDynatraceAPI(isGet, apiEndpoint, queryString, postBody):
 def queryDynatraceAPIEx(httpMethod, apiEndpoint, queryString, postBody):
     "Executes a Dynatrace REST API Query. First validates if data is already available in Cache."
 
-    if (getAttributeOrDefault(config, "debug", 0) == 1) :
-        print("DEBUG - queryDynatraceAPIEx: " + apiEndpoint + "?" + queryString + " - BODY: " + str(postBody))
-
-    # we first validate if we have the file in cache. NOTE: we only store HTTP GET data in the Cache. NO POST!
-    fullCacheFilename = getCacheFilename(apiEndpoint, queryString)
-    readFromCache = False
-    if(os.path.isfile(fullCacheFilename)):
-        cacheupdate = getAttributeOrNone(config, "cacheupdate")
-        if(cacheupdate is None):
-            cacheupdate = -1
-        else:
-            cacheupdate = int(config["cacheupdate"])
-        if(cacheupdate == -1):
-            readFromCache = True
-        if(cacheupdate > 0):
-            now = datetime.datetime.now()
-            lastModified = datetime.datetime.fromtimestamp(os.path.getmtime(fullCacheFilename))
-            if((now - lastModified).seconds < cacheupdate):
-                readFromCache = True
+    debugLog("queryDynatraceAPIEx: " + apiEndpoint + "?" + queryString + " - BODY: " + str(postBody))
 
-    jsonContent = None
-    if (httpMethod == HTTP_GET) and readFromCache:
-        with open(fullCacheFilename) as json_data:
-            jsonContent = json.load(json_data)
+    # within one run we serve repeated reads from our in-memory memo. Any write might change what we read - so we forget everything
+    memoKey = getResponseMemoKey(httpMethod, apiEndpoint, queryString)
+    if httpMethod == HTTP_GET:
+        memoEntry = lookupResponseMemo(memoKey)
+        if memoEntry is not None:
+            return memoEntry[0]
     else:
-        myResponse = None
+        clearResponseMemo()
+
+    # we first validate if we have the data in our cache. NOTE: we only store HTTP GET data in the Cache. NO POST!
+    cacheBackend = getCacheBackend()
+
+    # identical queries running concurrently wait for each other so only the first one has to go to the API or write the cache
+    with getCacheKeyLock(cacheBackend.name + ":" + getCacheTenant() + ":" + getCacheKey(apiEndpoint, queryString)):
+        cacheEntry = None
+        cacheState = CACHE_STATE_EXPIRED
+        cacheFillLock = None
         if httpMethod == HTTP_GET:
-            myResponse = requests.get(getRequestUrl(apiEndpoint, queryString), headers=getAuthenticationHeader(), verify=False)
-        elif httpMethod == HTTP_POST:
-            myResponse = requests.post(getRequestUrl(apiEndpoint, queryString), headers=getAuthenticationHeader(), verify=False, json=postBody)
-        elif httpMethod == HTTP_PUT:
-            myResponse = requests.put(getRequestUrl(apiEndpoint, queryString), headers=getAuthenticationHeader(), verify=False, json=postBody)
-        elif httpMethod == HTTP_DELETE:
-            myResponse = requests.delete(getRequestUrl(apiEndpoint, queryString), headers=getAuthenticationHeader(), verify=False, json=postBody)
-
-        # For successful API call, response code will be 200 (OK)
-        if(myResponse.ok):
-            if(len(myResponse.text) > 0):
-                jsonContent = json.loads(myResponse.text)
-
-            if (httpMethod == HTTP_GET) and jsonContent is not None:
-                # lets ensure the directory is there
-                directory = os.path.dirname(fullCacheFilename)
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-
-                # now lets save the content to the cache as well
-                with open(fullCacheFilename, "w+") as output_file:
-                    json.dump(jsonContent, output_file)
+            # a concurrent query for the same key might have just filled the memo while we waited for the lock
+            memoEntry = lookupResponseMemo(memoKey, False)
+            if memoEntry is not None:
+                return memoEntry[0]
+            cacheEntry = cacheBackend.lookup(apiEndpoint, queryString)
+            cacheState = getCacheEntryState(cacheEntry, apiEndpoint, queryString)
+
+            if cacheState == CACHE_STATE_EXPIRED:
+                # other dtcli processes sharing our cachedir might fill that entry right now - we wait for them and read what they stored
+                cacheFillLock = CacheFileLock(getCacheFillLockFilename(apiEndpoint, queryString))
+                cacheFillLock.acquire()
+                cacheEntry = cacheBackend.lookup(apiEndpoint, queryString)
+                cacheState = getCacheEntryState(cacheEntry, apiEndpoint, queryString)
 
-        else:
+        try:
+            if httpMethod == HTTP_GET:
+                cacheBackend.recordAccess(apiEndpoint, queryString, cacheState != CACHE_STATE_EXPIRED)
+            if cacheState != CACHE_STATE_EXPIRED and cacheEntry.negative is not None:
+                jsonContent = serveNegativeCacheEntry(cacheEntry, apiEndpoint, queryString)
+            elif cacheState != CACHE_STATE_EXPIRED:
+                jsonContent = cacheEntry.getContent()
+                storeResponseMemo(memoKey, jsonContent, cacheEntry.contentBytes)
+                if cacheState == CACHE_STATE_STALE:
+                    scheduleCacheRefresh(apiEndpoint, queryString)
+            else:
+                jsonContent = fetchDynatraceAPIResponse(httpMethod, apiEndpoint, queryString, postBody, cacheBackend, memoKey, cacheEntry)
+        finally:
+            if cacheFillLock is not None:
+                cacheFillLock.release()
+
+    if httpMethod == HTTP_GET and isPrefetchEnabled():
+        prefetchFollowUps(apiEndpoint, queryString)
+
+    return jsonContent
+
+def fetchDynatraceAPIResponse(httpMethod, apiEndpoint, queryString, postBody, cacheBackend, memoKey, cacheEntry=None):
+    "Sends the request to the Dynatrace API and - for HTTP GET - stores the response in the cache and the memo"
+    "In case we have an expired cacheEntry with validators we only ask the API whether it changed since"
+    jsonContent = None
+    conditionalHeaders = None
+    if (httpMethod == HTTP_GET) and isEntitySyncEnabled(apiEndpoint, queryString):
+        # an expired entity list might only need the entities seen since we last synced it
+        jsonContent = syncEntityList(apiEndpoint, queryString, cacheBackend, memoKey, cacheEntry)
+        if jsonContent is not None:
+            return jsonContent
+    if (httpMethod == HTTP_GET) and (cacheEntry is not None):
+        conditionalHeaders = getConditionalRequestHeaders(cacheEntry.validators)
+
+    myResponse = sendDynatraceAPIRequest(httpMethod, apiEndpoint, queryString, postBody, conditionalHeaders)
+
+    if (conditionalHeaders is not None) and (myResponse.status_code == 304):
+        # not modified: the cached content is still current - we just reset its age
+        countRevalidation("notmodified")
+        cacheBackend.markValidated(apiEndpoint, queryString, time.time())
+        jsonContent = cacheEntry.getContent()
+        storeResponseMemo(memoKey, jsonContent, cacheEntry.contentBytes)
+        if isEntitySyncEnabled(apiEndpoint, queryString):
+            writeEntitySyncState(apiEndpoint, queryString, time.time())
+        return jsonContent
+    if conditionalHeaders is not None:
+        countRevalidation("modified")
+
+    # For successful API call, response code will be 200 (OK)
+    if(myResponse.ok):
+        if(len(myResponse.text) > 0):
             jsonContent = json.loads(myResponse.text)
-            errorMessage = ""
-            if(jsonContent["error"]):
-                errorMessage = jsonContent["error"]["message"]
-                if global_doPrint:
-                    print("Dynatrace API returned an error: " + errorMessage)
-            jsonContent = None
-            raise Exception("Error", "Dynatrace API returned an error: " + errorMessage)
+
+        # now lets save the content to the cache as well
+        if (httpMethod == HTTP_GET) and jsonContent is not None:
+            jsonText, entityLines = encodeCacheContent(cacheBackend, apiEndpoint, jsonContent)
+            cacheBackend.store(apiEndpoint, queryString, jsonText, getResponseValidators(myResponse), getContentResolution(jsonContent, queryString))
+            if entityLines is not None:
+                writeEntityLineIndex(cacheBackend, apiEndpoint, queryString, entityLines)
+            if isEntitySyncEnabled(apiEndpoint, queryString):
+                writeEntitySyncState(apiEndpoint, queryString, time.time())
+                countEntitySync("full")
+            storeResponseMemo(memoKey, jsonContent, len(myResponse.content))
+
+    else:
+        jsonContent = json.loads(myResponse.text)
+        if (httpMethod == HTTP_GET) and isNegativeCacheEnabled() and (400 <= myResponse.status_code < 500) and not operator.contains(CACHE_NEGATIVE_EXCLUDED_STATUS, myResponse.status_code):
+            # so repeated queries for something that doesnt exist dont have to go to the API again
+            cacheBackend.store(apiEndpoint, queryString, json.dumps(jsonContent), None, None, myResponse.status_code)
+            countNegativeCache("stored")
+        raiseDynatraceAPIError(jsonContent, myResponse.status_code)
 
     return jsonContent
 
+class DynatraceAPIError(Exception):
+    "An error response of the Dynatrace API - as opposed to timeouts or connection errors. statusCode is the HTTP status of the response"
+    def __init__(self, errorMessage, statusCode):
+        super().__init__("Error", errorMessage)
+        self.statusCode = statusCode
+
+def raiseDynatraceAPIError(jsonContent, statusCode):
+    "Raises the error the Dynatrace API returned in jsonContent"
+    errorMessage = ""
+    if(jsonContent["error"]):
+        errorMessage = jsonContent["error"]["message"]
+        if global_doPrint:
+            print("Dynatrace API returned an error: " + errorMessage)
+    raise DynatraceAPIError("Dynatrace API returned an error: " + errorMessage, statusCode)
+
+def serveNegativeCacheEntry(cacheEntry, apiEndpoint, queryString):
+    "Raises the cached API error - just like the API did when we stored it"
+    countNegativeCache("hits")
+    debugLog("served from negative cache (HTTP " + str(cacheEntry.negative) + "): " + apiEndpoint + "?" + queryString)
+    raiseDynatraceAPIError(cacheEntry.getContent(), cacheEntry.negative)
+
+def isNegativeCacheEnabled():
+    return int(getConfigValue("cachenegative")) > 0
+
+global_negativeCacheStatistics = {"hits" : 0, "stored" : 0}
+global_negativeCacheStatisticsLock = threading.Lock()
+
+def countNegativeCache(statisticsKey):
+    with global_negativeCacheStatisticsLock:
+        global_negativeCacheStatistics[statisticsKey] += 1
+
+def negativeCacheStatisticsAsStr():
+    "Returns the negative cache statistics as printable string"
+    return "hits: " + str(global_negativeCacheStatistics["hits"]) + ", stored: " + str(global_negativeCacheStatistics["stored"])
+
+def getResponseValidators(myResponse):
+    "Returns the ETag and Last-Modified headers of the response as validators - or None if the API didnt send any"
+    validators = {}
+    if myResponse.headers.get("ETag") is not None:
+        validators["etag"] = myResponse.headers.get("ETag")
+    if myResponse.headers.get("Last-Modified") is not None:
+        validators["lastModified"] = myResponse.headers.get("Last-Modified")
+    if len(validators) == 0:
+        return None
+    return validators
+
+def getConditionalRequestHeaders(validators):
+    "Returns the If-None-Match / If-Modified-Since headers for the validators of a cache entry - or None if we cant revalidate it"
+    if validators is None:
+        return None
+    conditionalHeaders = {}
+    if getAttributeOrNone(validators, "etag") is not None:
+        conditionalHeaders["If-None-Match"] = validators["etag"]
+    if getAttributeOrNone(validators, "lastModified") is not None:
+        conditionalHeaders["If-Modified-Since"] = validators["lastModified"]
+    if len(conditionalHeaders) == 0:
+        return None
+    return conditionalHeaders
+
+global_revalidationStatistics = {"notmodified" : 0, "modified" : 0}
+global_revalidationStatisticsLock = threading.Lock()
+
+def countRevalidation(result):
+    with global_revalidationStatisticsLock:
+        global_revalidationStatistics[result] += 1
+
+def revalidationStatisticsAsStr():
+    "Returns the conditional request statistics as printable string"
+    return "revalidations: " + str(global_revalidationStatistics["notmodified"] + global_revalidationStatistics["modified"]) + ", not modified (304): " + str(global_revalidationStatistics["notmodified"]) + ", modified: " + str(global_revalidationStatistics["modified"])
+
+# =========================================================
+# Incremental Entity Sync - with entitysync X an expired entity list only asks the API for the entities seen since the last sync
+# (startTimestamp/endTimestamp) and merges them by entityId into the cached list. Every X seconds we download the full list again - that drops vanished entities
+# =========================================================
+ENTITY_SYNC_OVERLAP = 300             # seconds the time window of an incremental sync reaches back before the last sync - covers late updates and clock skew
+ENTITY_SYNC_TIME_PARAMETERS = ["startTimestamp", "endTimestamp", "relativeTime"]
+
+global_entitySyncStatistics = {"incremental" : 0, "full" : 0, "updated" : 0, "added" : 0}
+global_entitySyncStatisticsLock = threading.Lock()
+
+def isEntitySyncEnabled(apiEndpoint, queryString):
+    "True if entitysync is turned on and the query is an entity list the API can filter by time window - and doesnt do so already"
+    if (int(getConfigValue("entitysync")) <= 0) or not operator.contains(ENTITY_PUSHDOWN_ENDPOINTS, apiEndpoint):
+        return False
+    for parameter in queryString.split("&"):
+        if operator.contains(ENTITY_SYNC_TIME_PARAMETERS, parameter.partition("=")[0]):
+            return False
+    return True
+
+def getEntitySyncFilename(apiEndpoint, queryString):
+    return getCacheIndexFilename(apiEndpoint, queryString, "sync")
+
+def loadEntitySyncState(apiEndpoint, queryString):
+    "Returns {version, fullSyncAt, syncedAt} of the cached list - or None if we dont know when it was synced or it was replaced since"
+    syncFilename = getEntitySyncFilename(apiEndpoint, queryString)
+    if not os.path.isfile(syncFilename):
+        return None
+    try:
+        with open(syncFilename) as json_data:
+            syncState = json.load(json_data)
+    except ValueError:
+        return None
+    if getAttributeOrNone(syncState, "version") != getCacheEntryVersion(apiEndpoint, queryString):
+        return None
+    return syncState
+
+def writeEntitySyncState(apiEndpoint, queryString, syncedAt, fullSyncAt=None):
+    "Remembers when we synced the cached list - fullSyncAt None means we just downloaded the full list"
+    if fullSyncAt is None:
+        fullSyncAt = syncedAt
+    writeCacheIndexFile(getEntitySyncFilename(apiEndpoint, queryString), {"version" : getCacheEntryVersion(apiEndpoint, queryString), "fullSyncAt" : fullSyncAt, "syncedAt" : syncedAt})
+
+def mergeEntityLists(entityList, changedEntities):
+    "Merges the changed entities by entityId into entityList - an entity only replaces the one we have if it wasnt seen earlier. New entities are appended"
+    "Returns (number of updated entities, number of added entities)"
+    positions = {}
+    for position, entity in enumerate(entityList):
+        entityId = getAttributeOrNone(entity, "entityId")
+        if type(entityId) is str:
+            positions[entityId] = position
+
+    updatedEntities = 0
+    addedEntities = 0
+    for entity in changedEntities:
+        entityId = getAttributeOrNone(entity, "entityId")
+        position = positions.get(entityId) if type(entityId) is str else None
+        if position is None:
+            if type(entityId) is str:
+                positions[entityId] = len(entityList)
+            entityList.append(entity)
+            addedEntities += 1
+        elif getAttributeOrDefault(entity, "lastSeenTimestamp", 0) >= getAttributeOrDefault(entityList[position], "lastSeenTimestamp", 0):
+            entityList[position] = entity
+            updatedEntities += 1
+    return (updatedEntities, addedEntities)
+
+def getEntitySyncStart(entityList, syncedAt):
+    "Returns the start of the time window of the next incremental sync in ms: the latest lastSeenTimestamp of the list - the clock of the API -"
+    "or when we last synced, whatever is earlier. Minus ENTITY_SYNC_OVERLAP"
+    syncStart = int(syncedAt * 1000)
+    lastSeenTimestamps = [entity["lastSeenTimestamp"] for entity in entityList if type(getAttributeOrNone(entity, "lastSeenTimestamp")) is int]
+    if len(lastSeenTimestamps) > 0:
+        syncStart = min(syncStart, max(lastSeenTimestamps))
+    return syncStart - ENTITY_SYNC_OVERLAP * 1000
+
+def syncEntityList(apiEndpoint, queryString, cacheBackend, memoKey, cacheEntry):
+    "Fetches only the entities seen since the last sync of the cached list and merges them into it. Returns the merged list"
+    "Returns None in case we have to download the full list: nothing cached, never synced, the full sync is due or the incremental request failed"
+    if (cacheEntry is None) or (cacheEntry.negative is not None):
+        return None
+    syncState = loadEntitySyncState(apiEndpoint, queryString)
+    now = time.time()
+    if (syncState is None) or (now - syncState["fullSyncAt"] >= int(getConfigValue("entitysync"))):
+        return None
+    entityList = cacheEntry.getContent()
+    if (type(entityList) is not list) or not all(type(entity) is dict for entity in entityList):
+        return None
+
+    syncQueryString = "startTimestamp=" + str(getEntitySyncStart(entityList, syncState["syncedAt"])) + "&endTimestamp=" + str(int(now * 1000))
+    if len(queryString) > 0:
+        syncQueryString = queryString + "&" + syncQueryString
+    try:
+        myResponse = sendDynatraceAPIRequest(HTTP_GET, apiEndpoint, syncQueryString, None)
+        if not myResponse.ok:
+            raise Exception("Error", "Dynatrace API returned HTTP " + str(myResponse.status_code))
+        changedEntities = []
+        if len(myResponse.text) > 0:
+            changedEntities = json.loads(myResponse.text)
+        if (type(changedEntities) is not list) or not all(type(entity) is dict for entity in changedEntities):
+            raise Exception("Error", "Dynatrace API didnt return a list of entities")
+    except Exception as err:
+        # timeouts, connection errors, error responses or a body we cant parse - the full download will tell
+        debugLog("Incremental sync of " + apiEndpoint + "?" + queryString + " failed - downloading the full list: " + str(err))
+        return None
+
+    updatedEntities, addedEntities = mergeEntityLists(entityList, changedEntities)
+    jsonText, entityLines = encodeCacheContent(cacheBackend, apiEndpoint, entityList)
+    cacheBackend.store(apiEndpoint, queryString, jsonText, None, None)
+    if entityLines is not None:
+        writeEntityLineIndex(cacheBackend, apiEndpoint, queryString, entityLines)
+    writeEntitySyncState(apiEndpoint, queryString, now, syncState["fullSyncAt"])
+    storeResponseMemo(memoKey, entityList, len(jsonText))
+
+    debugLog("Incremental sync of " + apiEndpoint + "?" + queryString + ": " + str(len(changedEntities)) + " entities seen since the last sync, " + str(updatedEntities) + " updated, " + str(addedEntities) + " added")
+    countEntitySync("incremental", updatedEntities, addedEntities)
+    return entityList
+
+def countEntitySync(statisticsKey, updatedEntities=0, addedEntities=0):
+    with global_entitySyncStatisticsLock:
+        global_entitySyncStatistics[statisticsKey] += 1
+        global_entitySyncStatistics["updated"] += updatedEntities
+        global_entitySyncStatistics["added"] += addedEntities
+
+def entitySyncStatisticsAsStr():
+    "Returns the entity sync statistics as printable string"
+    return "incremental: " + str(global_entitySyncStatistics["incremental"]) + ", full: " + str(global_entitySyncStatistics["full"]) + ", updated entities: " + str(global_entitySyncStatistics["updated"]) + ", added entities: " + str(global_entitySyncStatistics["added"])
+
+# =========================================================
+# Background Cache Refresh - refreshes stale cache entries (see cachestale) while callers already work with the stale content
+# The CLI waits for all pending refreshes before it exits. Long running processes, e.g: wsgi.py, simply keep refreshing in the background
+# =========================================================
+global_cacheRefreshExecutor = None
+global_cacheRefreshes = {}
+global_cacheRefreshesLock = threading.Lock()
+global_cacheRefreshStatistics = {"scheduled" : 0, "refreshed" : 0, "skipped" : 0, "failed" : 0}
+
+def getCacheRefreshExecutor():
+    "Returns the thread pool that executes our background refreshes"
+    global global_cacheRefreshExecutor
+    with global_cacheRefreshesLock:
+        if global_cacheRefreshExecutor is None:
+            global_cacheRefreshExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=getQueryConcurrency(), thread_name_prefix="dtcli-refresh")
+    return global_cacheRefreshExecutor
+
+def scheduleCacheRefresh(apiEndpoint, queryString):
+    "Refreshes that cache entry in the background - unless a refresh for it is already pending"
+    refreshKey = (config["tenanthost"], apiEndpoint, queryString)
+    executor = getCacheRefreshExecutor()
+    with global_cacheRefreshesLock:
+        if operator.contains(global_cacheRefreshes, refreshKey):
+            return
+        global_cacheRefreshStatistics["scheduled"] += 1
+        global_cacheRefreshes[refreshKey] = executor.submit(refreshCacheEntry, refreshKey, apiEndpoint, queryString)
+    debugLog("scheduled background refresh of stale cache entry: " + apiEndpoint + "?" + queryString)
+
+def refreshCacheEntry(refreshKey, apiEndpoint, queryString):
+    "Fetches a stale cache entry from the API again - unless another thread or dtcli process did that in the meantime"
+    try:
+        cacheBackend = getCacheBackend()
+        with getCacheKeyLock(cacheBackend.name + ":" + getCacheTenant() + ":" + getCacheKey(apiEndpoint, queryString)):
+            with CacheFileLock(getCacheFillLockFilename(apiEndpoint, queryString)):
+                cacheEntry = cacheBackend.lookup(apiEndpoint, queryString)
+                if getCacheEntryState(cacheEntry, apiEndpoint, queryString) == CACHE_STATE_FRESH:
+                    statisticsKey = "skipped"
+                else:
+                    fetchDynatraceAPIResponse(HTTP_GET, apiEndpoint, queryString, None, cacheBackend, getResponseMemoKey(HTTP_GET, apiEndpoint, queryString), cacheEntry)
+                    statisticsKey = "refreshed"
+    except Exception as e:
+        debugLog("background refresh of " + apiEndpoint + "?" + queryString + " failed: " + str(e))
+        statisticsKey = "failed"
+
+    with global_cacheRefreshesLock:
+        global_cacheRefreshStatistics[statisticsKey] += 1
+        global_cacheRefreshes.pop(refreshKey, None)
+
+def waitForCacheRefreshes():
+    "Blocks until all pending background refreshes are done"
+    while True:
+        with global_cacheRefreshesLock:
+            pendingRefreshes = list(global_cacheRefreshes.values())
+        if len(pendingRefreshes) == 0:
+            return
+        concurrent.futures.wait(pendingRefreshes)
+
+def cacheRefreshStatisticsAsStr():
+    "Returns the background refresh statistics as printable string"
+    return "scheduled: " + str(global_cacheRefreshStatistics["scheduled"]) + ", refreshed: " + str(global_cacheRefreshStatistics["refreshed"]) + ", skipped: " + str(global_cacheRefreshStatistics["skipped"]) + ", failed: " + str(global_cacheRefreshStatistics["failed"])
+
+# =========================================================
+# Speculative Prefetch - learns per tenant which query usually follows which (see prefetch) and fetches the likely follow-ups into the cache in the background
+# Timestamps relative to now are learned as offset, e.g: startTimestamp={now-3600000}, so a follow-up can also be prefetched in a later run
+# =========================================================
+PREFETCH_SEQUENCE_WINDOW = 600                  # seconds between two queries so that we still consider the second one a follow-up of the first
+PREFETCH_MIN_COUNT = 2                          # a follow-up has to be seen at least that often ...
+PREFETCH_MIN_CONFIDENCE = 0.5                   # ... and in at least that share of all follow-ups of a query before we prefetch it
+PREFETCH_MAX_FOLLOWUPS = 5                      # follow-ups we remember per query
+PREFETCH_MAX_QUERIES = 1000                     # queries we remember per tenant - the least recently seen get dropped first
+PREFETCH_PENDING_TIMEOUT = 86400                # seconds a prefetched query has to get used to count as prefetch hit
+PREFETCH_RELATIVE_RANGE = 31 * 86400 * 1000     # timestamps within that many milliseconds before now are learned relative to now
+
+global_prefetchModels = {}
+global_prefetchModelsLock = threading.Lock()
+global_prefetchExecutor = None
+global_prefetches = {}
+global_prefetchesLock = threading.Lock()
+global_prefetchStatistics = {"scheduled" : 0, "prefetched" : 0, "skipped" : 0, "overbudget" : 0, "failed" : 0, "bytes" : 0}
+
+def isPrefetchEnabled():
+    "Prefetching makes no sense when we only use the cache"
+    return int(getConfigValue("prefetch")) > 0 and int(config["cacheupdate"]) != -1
+
+def getPrefetchTemplate(apiEndpoint, queryString):
+    "Returns <endpoint>?<querystring> with every startTimestamp and endTimestamp within the last PREFETCH_RELATIVE_RANGE replaced by {now-<milliseconds>}"
+    nowTimestamp = getAlignedNowTimestamp() * 1000
+    def toRelativeTimestamp(match):
+        offset = nowTimestamp - int(match.group(2))
+        if offset < 0 or offset > PREFETCH_RELATIVE_RANGE:
+            return match.group(0)
+        return match.group(1) + "={now-" + str(offset) + "}"
+    return apiEndpoint + "?" + re.sub("(startTimestamp|endTimestamp)=([0-9]+)", toRelativeTimestamp, queryString)
+
+def resolvePrefetchTemplate(template):
+    "Returns (apiEndpoint, queryString) of a prefetch template with its {now-<milliseconds>} resolved against now"
+    nowTimestamp = getAlignedNowTimestamp() * 1000
+    apiEndpoint, _, queryString = template.partition("?")
+    return apiEndpoint, re.sub("\\{now-([0-9]+)\\}", lambda match: str(nowTimestamp - int(match.group(1))), queryString)
+
+def applyPrefetchOperation(model, operation):
+    "Applies a recorded operation to a prefetch model: (\"query\", template, cacheKey, queriedAt) or (\"prefetch\", cacheKey, prefetchedAt)"
+    if operation[0] == "query":
+        template, cacheKey, queriedAt = operation[1:]
+        last = model["last"]
+        if last is not None and last[0] != template and 0 <= queriedAt - last[1] <= PREFETCH_SEQUENCE_WINDOW:
+            lastQuery = getAttributeOrNone(model["queries"], last[0])
+            if lastQuery is not None:
+                lastQuery["count"] += 1
+                lastQuery["next"][template] = getAttributeOrDefault(lastQuery["next"], template, 0) + 1
+        query = model["queries"].setdefault(template, {"seen" : queriedAt, "count" : 0, "next" : {}})
+        query["seen"] = max(query["seen"], queriedAt)
+        if last is None or queriedAt >= last[1]:
+            model["last"] = [template, queriedAt]
+
+        # somebody asked for what we prefetched
+        if model["pending"].pop(cacheKey, None) is not None:
+            model["prefetchhits"] += 1
+    elif operation[0] == "prefetch":
+        model["prefetched"] += 1
+        model["pending"][operation[1]] = operation[2]
+
+def trimPrefetchModel(model, now):
+    "Keeps the prefetch model within PREFETCH_MAX_QUERIES and PREFETCH_MAX_FOLLOWUPS and forgets prefetches nobody used within PREFETCH_PENDING_TIMEOUT"
+    for query in model["queries"].values():
+        if len(query["next"]) > PREFETCH_MAX_FOLLOWUPS:
+            query["next"] = dict(sorted(query["next"].items(), key=lambda followUp: followUp[1], reverse=True)[:PREFETCH_MAX_FOLLOWUPS])
+    if len(model["queries"]) > PREFETCH_MAX_QUERIES:
+        model["queries"] = dict(sorted(model["queries"].items(), key=lambda query: query[1]["seen"], reverse=True)[:PREFETCH_MAX_QUERIES])
+    model["pending"] = {cacheKey : prefetchedAt for cacheKey, prefetchedAt in model["pending"].items() if now - prefetchedAt <= PREFETCH_PENDING_TIMEOUT}
+
+class PrefetchModel:
+    "The learned follow-ups of a tenant, stored in <cachedir>/<tenant>/prefetch.idx: the last query, template -> {seen, count, next: {template: count}}"
+    "plus the prefetch counters and the prefetched queries nobody asked for yet. Just like FileCacheIndex we only change it in memory and merge our changes when we flush at the end of the run"
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.model = None
+        self.pendingOperations = []
+
+    def readModelFile(self):
+        try:
+            with open(self.filename) as modelFile:
+                modelContent = json.load(modelFile)
+        except (OSError, ValueError):
+            modelContent = {}
+        return {"last" : getAttributeOrNone(modelContent, "last"), "prefetched" : getAttributeOrDefault(modelContent, "prefetched", 0), "prefetchhits" : getAttributeOrDefault(modelContent, "prefetchhits", 0), "pending" : getAttributeOrDefault(modelContent, "pending", {}), "queries" : getAttributeOrDefault(modelContent, "queries", {})}
+
+    def getModel(self):
+        with self.lock:
+            if self.model is None:
+                self.model = self.readModelFile()
+            return self.model
+
+    def applyOperation(self, operation):
+        with self.lock:
+            applyPrefetchOperation(self.getModel(), operation)
+            self.pendingOperations.append(operation)
+
+    def recordQuery(self, template, cacheKey, queriedAt):
+        self.applyOperation(("query", template, cacheKey, queriedAt))
+
+    def recordPrefetch(self, cacheKey, prefetchedAt):
+        self.applyOperation(("prefetch", cacheKey, prefetchedAt))
+
+    def getFollowUps(self, template):
+        "Returns the templates that followed that template often enough to be worth a prefetch"
+        with self.lock:
+            query = getAttributeOrNone(self.getModel()["queries"], template)
+            if query is None:
+                return []
+            return [followUp for followUp, count in query["next"].items() if count >= PREFETCH_MIN_COUNT and count >= PREFETCH_MIN_CONFIDENCE * query["count"]]
+
+    def getStatistics(self):
+        "Returns prefetched, prefetchhits and prefetchhitratio"
+        with self.lock:
+            model = self.getModel()
+            hitRatio = None
+            if model["prefetched"] > 0:
+                hitRatio = round(model["prefetchhits"] / model["prefetched"], 4)
+            return {"prefetched" : model["prefetched"], "prefetchhits" : model["prefetchhits"], "prefetchhitratio" : hitRatio}
+
+    def sync(self):
+        "Merges our changes into what is currently on disk - other dtcli processes might learn for the same tenant - and writes the model"
+        with self.lock:
+            if len(self.pendingOperations) == 0:
+                self.model = None
+                return
+
+            with CacheFileLock(self.filename[:-len(".idx")] + ".lock"):
+                model = self.readModelFile()
+                for operation in self.pendingOperations:
+                    applyPrefetchOperation(model, operation)
+                trimPrefetchModel(model, time.time())
+                writeCacheIndexFile(self.filename, model)
+                self.model = model
+                self.pendingOperations = []
+
+def getPrefetchModelFilename(tenant):
+    return getCacheDirectory() + tenant + osfileslashes + "prefetch.idx"
+
+def getPrefetchModel(tenant):
+    "Returns the prefetch model of that tenant in the current cachedir"
+    filename = getPrefetchModelFilename(tenant)
+    with global_prefetchModelsLock:
+        prefetchModel = getAttributeOrNone(global_prefetchModels, filename)
+        if prefetchModel is None:
+            prefetchModel = PrefetchModel(filename)
+            if len(global_prefetchModels) == 0:
+                atexit.register(flushPrefetchModels)
+            global_prefetchModels[filename] = prefetchModel
+    return prefetchModel
+
+def flushPrefetchModels():
+    "Writes what we learned in this run into the prefetch models of all tenants we used"
+    with global_prefetchModelsLock:
+        prefetchModels = list(global_prefetchModels.values())
+    for prefetchModel in prefetchModels:
+        try:
+            prefetchModel.sync()
+        except Exception as e:
+            debugLog("Couldnt write prefetch model " + prefetchModel.filename + ": " + str(e))
+
+def getPrefetchStatistics(tenant):
+    "Returns the prefetch statistics of that tenant - or None if we never learned anything for it"
+    if not operator.contains(global_prefetchModels, getPrefetchModelFilename(tenant)) and not os.path.isfile(getPrefetchModelFilename(tenant)):
+        return None
+    return getPrefetchModel(tenant).getStatistics()
+
+def getPrefetchExecutor():
+    "Returns the thread pool that executes our prefetches - at most prefetchconcurrency at the same time"
+    global global_prefetchExecutor
+    with global_prefetchesLock:
+        if global_prefetchExecutor is None:
+            global_prefetchExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(getConfigValue("prefetchconcurrency"))), thread_name_prefix="dtcli-prefetch")
+    return global_prefetchExecutor
+
+def prefetchFollowUps(apiEndpoint, queryString):
+    "Learns that query as follow-up of the previous one and prefetches the follow-ups we learned for it"
+    prefetchModel = getPrefetchModel(getCacheTenant())
+    template = getPrefetchTemplate(apiEndpoint, queryString)
+    prefetchModel.recordQuery(template, getCacheKey(apiEndpoint, queryString), time.time())
+    for followUp in prefetchModel.getFollowUps(template):
+        followUpEndpoint, followUpQueryString = resolvePrefetchTemplate(followUp)
+        schedulePrefetch(followUpEndpoint, followUpQueryString)
+
+def schedulePrefetch(apiEndpoint, queryString):
+    "Prefetches that query in the background - unless it is already pending or we used up the prefetchbytes of this run"
+    prefetchKey = (config["tenanthost"], apiEndpoint, queryString)
+    executor = getPrefetchExecutor()
+    with global_prefetchesLock:
+        if operator.contains(global_prefetches, prefetchKey):
+            return
+        if global_prefetchStatistics["bytes"] >= int(getConfigValue("prefetchbytes")):
+            global_prefetchStatistics["overbudget"] += 1
+            return
+        global_prefetchStatistics["scheduled"] += 1
+        global_prefetches[prefetchKey] = executor.submit(prefetchQuery, prefetchKey, apiEndpoint, queryString)
+    debugLog("scheduled prefetch of follow-up query: " + apiEndpoint + "?" + queryString)
+
+def prefetchQuery(prefetchKey, apiEndpoint, queryString):
+    "Fetches a follow-up query into the cache - unless another thread or dtcli process already cached it"
+    prefetchedBytes = 0
+    try:
+        cacheBackend = getCacheBackend()
+        with getCacheKeyLock(cacheBackend.name + ":" + getCacheTenant() + ":" + getCacheKey(apiEndpoint, queryString)):
+            with CacheFileLock(getCacheFillLockFilename(apiEndpoint, queryString)):
+                cacheEntry = cacheBackend.lookup(apiEndpoint, queryString)
+                if getCacheEntryState(cacheEntry, apiEndpoint, queryString) != CACHE_STATE_EXPIRED:
+                    statisticsKey = "skipped"
+                else:
+                    fetchDynatraceAPIResponse(HTTP_GET, apiEndpoint, queryString, None, cacheBackend, getResponseMemoKey(HTTP_GET, apiEndpoint, queryString), cacheEntry)
+                    cacheEntry = cacheBackend.lookup(apiEndpoint, queryString)
+                    if cacheEntry is not None:
+                        prefetchedBytes = cacheEntry.contentBytes
+                    getPrefetchModel(getCacheTenant()).recordPrefetch(getCacheKey(apiEndpoint, queryString), time.time())
+                    statisticsKey = "prefetched"
+    except Exception as e:
+        debugLog("prefetch of " + apiEndpoint + "?" + queryString + " failed: " + str(e))
+        statisticsKey = "failed"
+
+    with global_prefetchesLock:
+        global_prefetchStatistics[statisticsKey] += 1
+        global_prefetchStatistics["bytes"] += prefetchedBytes
+        global_prefetches.pop(prefetchKey, None)
+
+def waitForPrefetches():
+    "Blocks until all pending prefetches are done"
+    while True:
+        with global_prefetchesLock:
+            pendingPrefetches = list(global_prefetches.values())
+        if len(pendingPrefetches) == 0:
+            return
+        concurrent.futures.wait(pendingPrefetches)
+
+def prefetchStatisticsAsStr():
+    "Returns the prefetch statistics as printable string"
+    return "scheduled: " + str(global_prefetchStatistics["scheduled"]) + ", prefetched: " + str(global_prefetchStatistics["prefetched"]) + ", skipped: " + str(global_prefetchStatistics["skipped"]) + ", over budget: " + str(global_prefetchStatistics["overbudget"]) + ", failed: " + str(global_prefetchStatistics["failed"]) + ", bytes: " + str(global_prefetchStatistics["bytes"])
+
+# =========================================================
+# Concurrent Query Engine
+# asyncio based: every query runs the regular blocking queryDynatraceAPIEx (incl. cache lookup and write) on a worker thread
+# while the event loop makes sure we never have more than "concurrency" calls in flight
+# =========================================================
+global_queryExecutor = None
+global_queryExecutorLock = threading.Lock()
+global_queryThreadState = threading.local()
+
+def getQueryConcurrency():
+    "Returns the max number of concurrent API calls - at least 1"
+    return max(1, int(getConfigValue("concurrency")))
+
+def getQueryExecutor():
+    "Returns the thread pool our asyncio query engine uses to execute the blocking API calls"
+    global global_queryExecutor
+    with global_queryExecutorLock:
+        if global_queryExecutor is None:
+            global_queryExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=getQueryConcurrency(), thread_name_prefix="dtcli-query")
+    return global_queryExecutor
+
+def runOnQueryThread(function, args):
+    "Executes function(*args) and flags the current thread so nested concurrent calls are executed serially instead of dead-locking the pool"
+    global_queryThreadState.isQueryThread = True
+    try:
+        return function(*args)
+    finally:
+        global_queryThreadState.isQueryThread = False
+
+async def callAsync(function, args, semaphore):
+    "Awaitable version of function(*args) - e.g: of queryDynatraceAPIEx or any of the do* functions"
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(getQueryExecutor(), runOnQueryThread, function, args)
+
+async def queryDynatraceAPIAsync(httpMethod, apiEndpoint, queryString, postBody, semaphore):
+    "Awaitable version of queryDynatraceAPIEx. Shares the same cache lookup and cache write logic"
+    return await callAsync(queryDynatraceAPIEx, (httpMethod, apiEndpoint, queryString, postBody), semaphore)
+
+async def runAllAsync(calls):
+    "Runs all calls, a list of (function, args), with at most concurrency calls in flight. Returns results in the same order - Exceptions are returned as result"
+    semaphore = asyncio.Semaphore(getQueryConcurrency())
+    return await asyncio.gather(*[callAsync(call[0], call[1], semaphore) for call in calls], return_exceptions=True)
+
+def runConcurrently(calls, returnExceptions=False):
+    "Sync facade of our asyncio query engine: executes all calls, a list of (function, args), concurrently and returns the list of results in the same order"
+    "If returnExceptions is False we raise the first exception (in order of calls) - otherwise failed calls return their Exception as result"
+    results = []
+    if len(calls) <= 1 or getQueryConcurrency() <= 1 or getattr(global_queryThreadState, "isQueryThread", False):
+        # nothing to parallelize or we are already on one of the query threads
+        for call in calls:
+            try:
+                results.append(call[0](*call[1]))
+            except Exception as e:
+                if not returnExceptions:
+                    raise e
+                results.append(e)
+        return results
+
+    try:
+        asyncio.get_running_loop()
+        loopIsRunning = True
+    except RuntimeError:
+        loopIsRunning = False
+
+    if loopIsRunning:
+        # we are called from within a running event loop, e.g: in a long running process - so we run our own loop on a separate thread
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as loopExecutor:
+            results = loopExecutor.submit(asyncio.run, runAllAsync(calls)).result()
+    else:
+        results = asyncio.run(runAllAsync(calls))
+
+    if not returnExceptions:
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    return results
+
+def queryDynatraceAPIConcurrently(queries, returnExceptions=False):
+    "Executes a list of queries, each a (httpMethod, apiEndpoint, queryString, postBody) tuple, concurrently and returns the results in the same order"
+    return runConcurrently([(queryDynatraceAPIEx, query) for query in queries], returnExceptions)
+
 class KeySearch:
     # key allows a regular keyname but also a format of [keylistname/][context:][key][?valuekey] - example: tags/AWS:Name
     # some examples of allowed key names
@@ -378,9 +2088,26 @@ def getAttributeFromFirstMatch(attributeName, objectlist):
     
     return "OBJECT DOESNT HAVE KEY " + attributeName
 
+def compileMatchValue(matchValue):
+    "Compiles the match string to a regex. Raises a Regex Error in case it is not a valid regular expression"
+    try:
+        return re.compile(matchValue)
+    except:
+        if global_doPrint:
+            print(matchValue + " is NOT VALID regular expression")
+        raise Exception("Regex Error", matchValue + " is NOT VALID regular expression") 
+
 def jsonFindValuesByKey(jsonContent, key, matchValue, returnKey):
     "Traverses through the jsonContent object. Searches for the request key and returns the returnKey in case matchValue matches"
-    return jsonFindValuesByKeyEx(jsonContent, key, matchValue, returnKey, None, None)
+    return CompiledKeySearch(key, matchValue, returnKey).findValues(jsonContent)
+
+def streamFindValuesByKey(jsonItems, key, matchValue, returnKey):
+    "Same as jsonFindValuesByKey on a list - but takes the list items one by one from an iterator, so we never need the whole list in memory"
+    keySearch = CompiledKeySearch(key, matchValue, returnKey)
+    result = []
+    for jsonItem in jsonItems:
+        result.extend(keySearch.findValues([jsonItem]))
+    return result
 
 def jsonFindValuesByKeyEx(jsonContent, key, matchValue, returnKey, parentJsonNodename, parentJsonContent):
     "INTERNAL helper function for jsonFindValuesByKeyEx"
@@ -389,12 +2116,7 @@ def jsonFindValuesByKeyEx(jsonContent, key, matchValue, returnKey, parentJsonNod
 
     # we convert the regular match string to a compilied regex. we do it right here so we only have to do it once
     if((matchValue is not None) and (type(matchValue) == str)):
-        try:
-            matchValue = re.compile(matchValue)
-        except:
-            if global_doPrint:
-                print(matchValue + " is NOT VALID regular expression")
-            raise Exception("Regex Error", matchValue + " is NOT VALID regular expression") 
+        matchValue = compileMatchValue(matchValue)
 
     # our final result list
     result = []
@@ -460,6 +2182,1247 @@ def jsonFindValuesByKeyEx(jsonContent, key, matchValue, returnKey, parentJsonNod
                     result.extend(subResult)
     return result
 
+# =========================================================
+# Compiled Key Search - the same search as jsonFindValuesByKeyEx, but key and match value are compiled once into a predicate
+# that only looks at the fields the KeySearch references and skips lists without any objects in them, e.g: the entity ids in fromRelationships
+# =========================================================
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+JSON_CONTAINER_TYPES = {list, dict}
+
+class KeySearchFallback(Exception):
+    "Raised by CompiledKeySearch for content where only jsonFindValuesByKeyEx gives the exact same result - or the exact same error"
+    pass
+
+def isRegexLiteral(pattern):
+    "Returns True if the regular expression only matches its own characters"
+    return REGEX_METACHARACTERS.isdisjoint(pattern)
+
+VALUE_MATCH_LITERAL = "literal"
+VALUE_MATCH_PREFIX = "prefix"
+VALUE_MATCH_REGEX = "regex"
+
+def getValueMatchTier(matchValue):
+    "Returns (tier, literal) - the cheapest way to do the same as re.match(matchValue, value) for string values:"
+    "literal: abc$ -> equality, prefix: abc or abc.* -> startswith (re.match only anchors at the start), regex: everything else"
+    if matchValue.endswith("$") and isRegexLiteral(matchValue[:-1]):
+        return (VALUE_MATCH_LITERAL, matchValue[:-1])
+
+    prefix = matchValue
+    if prefix.endswith(".*"):
+        prefix = prefix[:-2]
+    if isRegexLiteral(prefix):
+        return (VALUE_MATCH_PREFIX, prefix)
+
+    return (VALUE_MATCH_REGEX, None)
+
+def compileValueMatcher(matchValue):
+    "Returns a function that does the same as re.match(matchValue, value) for string values - in the cheapest tier, see getValueMatchTier"
+    if matchValue is None:
+        return None
+
+    tier, literal = getValueMatchTier(matchValue)
+    if tier == VALUE_MATCH_LITERAL:
+        # just like re, $ also matches right before a trailing newline
+        return lambda value: value == literal or value == literal + "\n"
+    if tier == VALUE_MATCH_PREFIX:
+        return lambda value: value.startswith(literal)
+
+    regex = compileMatchValue(matchValue)
+    return lambda value: regex.match(value) is not None
+
+class CompiledKeySearch:
+    "A KeySearch and its match value compiled into a predicate. findValues returns exactly what jsonFindValuesByKey always returned"
+    def __init__(self, key, matchValue, returnKey):
+        self.key = key
+        self.matchValue = matchValue
+        self.returnKey = returnKey
+        self.keySearch = KeySearch(key)
+        self.matcher = compileValueMatcher(matchValue)
+
+    def findValues(self, jsonContent):
+        if type(jsonContent) == str:
+            jsonContent = json.loads(jsonContent)
+
+        result = []
+        try:
+            if type(jsonContent) is dict:
+                self.findValuesInDict(jsonContent, None, None, result)
+            elif type(jsonContent) is list:
+                self.findValuesInList(jsonContent, None, None, result)
+        except KeySearchFallback:
+            return jsonFindValuesByKeyEx(jsonContent, self.key, self.matchValue, self.returnKey, None, None)
+        return result
+
+    def findValuesInList(self, jsonList, parentJsonNodename, parentJsonContent, result):
+        for item in jsonList:
+            itemType = type(item)
+            if itemType is dict:
+                if len(item) > 0:
+                    self.findValuesInDict(item, parentJsonNodename, parentJsonContent, result)
+            elif itemType is list:
+                # lists of plain values - e.g: entity ids - can never contain a match
+                if not JSON_CONTAINER_TYPES.isdisjoint(map(type, item)):
+                    self.findValuesInList(item, parentJsonNodename, parentJsonContent, result)
+
+    def findValuesInDict(self, jsonContent, parentJsonNodename, parentJsonContent, result):
+        key = self.keySearch
+        foundValueMatch = None
+        foundContextMatch = key.contextvalue is None
+        foundKeyMatch = key.keyvalue is None
+        for jsonkey, value in jsonContent.items():
+            valueType = type(value)
+            if valueType is list:
+                if jsonkey == key.keyvalue:
+                    raise KeySearchFallback()
+                if jsonkey == key.valuekeyname:
+                    # every matching list item is a match - no matter the context, key or parent list
+                    if self.matcher is None:
+                        raise KeySearchFallback()
+                    for listItem in value:
+                        if type(listItem) is not str:
+                            raise KeySearchFallback()
+                        if self.matcher(listItem):
+                            result.append(getAttributeFromFirstMatch(self.returnKey, [jsonContent, parentJsonContent]))
+                elif not JSON_CONTAINER_TYPES.isdisjoint(map(type, value)):
+                    # lists of plain values - e.g: entity ids - can never contain a match
+                    self.findValuesInList(value, jsonkey, jsonContent, result)
+            elif valueType is dict:
+                if len(value) > 0:
+                    self.findValuesInDict(value, jsonkey, jsonContent, result)
+            elif jsonkey == key.valuekeyname:
+                if value is not None:
+                    if self.matcher is None:
+                        foundValueMatch = getAttributeFromFirstMatch(self.returnKey, [jsonContent, parentJsonContent])
+                    elif valueType is not str:
+                        raise KeySearchFallback()
+                    elif self.matcher(value):
+                        foundValueMatch = getAttributeFromFirstMatch(self.returnKey, [jsonContent, parentJsonContent])
+            elif (key.contextvalue is not None) and (jsonkey == key.contextkeyname):
+                foundContextMatch = key.contextvalue == value
+            elif (key.keyvalue is not None) and (jsonkey == key.keykeyname):
+                foundKeyMatch = key.keyvalue == value
+
+        if (key.keylistname is None) or (key.keylistname == parentJsonNodename):
+            if (foundValueMatch is not None) and foundContextMatch and foundKeyMatch:
+                result.append(foundValueMatch)
+
+# =========================================================
+# Timeseries Catalog - indexed metadata of all timeseries from /api/v1/timeseries
+# answers "ts describe" with a dict lookup and "ts list" searches through a trigram index instead of walking the whole list
+# =========================================================
+TIMESERIES_CATALOG_SEARCHFIELDS = ["timeseriesId", "displayName", "detailedSource", "dimensions", "unit"]
+
+global_timeseriesCatalogs = {}
+global_timeseriesCatalogsLock = threading.Lock()
+
+def getCacheEntryVersion(apiEndpoint, queryString):
+    "Returns a version string of what is currently in the cache for that query - changes whenever the cached content gets updated. None if nothing is cached"
+    return getCacheBackend().getVersion(apiEndpoint, queryString)
+
+def getCacheIndexFilename(apiEndpoint, queryString, indexName):
+    "Returns the filename of an index we persist next to the cached content of that query, e.g: the timeseries catalog"
+    return getHashedCacheFilename(getCacheDirectory(), getCacheTenant(), getCacheKey(apiEndpoint, queryString), "." + indexName + ".idx")
+
+def writeCacheIndexFile(indexFilename, jsonContent):
+    "Persists an index next to the cache"
+    writeFileAtomically(indexFilename, json.dumps(jsonContent))
+
+def getTrigrams(value):
+    "Returns the set of all 3 character substrings of value"
+    trigrams = set()
+    for i in range(len(value) - 2):
+        trigrams.add(value[i:i+3])
+    return trigrams
+
+def getRegexRequiredLiterals(pattern):
+    "Returns a list of substrings that every string matching the regex pattern has to contain"
+    "Returns None if we cant tell, e.g: for alternations or groups. Then there is no shortcut and we have to check every value"
+    if ("|" in pattern) or ("(" in pattern):
+        return None
+
+    literals = []
+    current = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        literalChar = None
+        if c == "\\":
+            if i+1 < len(pattern) and not pattern[i+1].isalnum():
+                # escaped special character, e.g: \. is a regular literal
+                literalChar = pattern[i+1]
+                i += 2
+            else:
+                # character classes like \d or \w
+                literals.append(current)
+                current = ""
+                i += 2
+                continue
+        elif c == "[":
+            # character set - skip until the closing bracket
+            literals.append(current)
+            current = ""
+            i += 1
+            if i < len(pattern) and pattern[i] == "^": i += 1
+            if i < len(pattern) and pattern[i] == "]": i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                if pattern[i] == "\\": i += 1
+                i += 1
+            i += 1
+            continue
+        elif c == "{":
+            literals.append(current)
+            current = ""
+            while i < len(pattern) and pattern[i] != "}":
+                i += 1
+            i += 1
+            continue
+        elif c in ".^$*+?":
+            literals.append(current)
+            current = ""
+            i += 1
+            continue
+        else:
+            literalChar = c
+            i += 1
+
+        # the literal is only required if it is not followed by a quantifier that makes it optional
+        if i < len(pattern) and pattern[i] in "*?{":
+            literals.append(current)
+            current = ""
+        elif i < len(pattern) and pattern[i] == "+":
+            literals.append(current + literalChar)
+            current = ""
+        else:
+            current += literalChar
+
+    literals.append(current)
+    return [literal for literal in literals if len(literal) >= 3]
+
+class TimeseriesCatalog:
+    "Index over the timeseries metadata list: position by timeseriesId and a trigram index for each of the TIMESERIES_CATALOG_SEARCHFIELDS"
+    def __init__(self, timeseriesList, version):
+        self.version = version                  # version of the cache entry this catalog was built for
+        self.timeseriesList = timeseriesList    # the actual list as returned by /api/v1/timeseries
+        self.byTimeseriesId = {}                # timeseriesId -> position in timeseriesList
+        self.trigrams = {}                      # fieldname -> trigram -> list of positions in timeseriesList
+        self.searchFields = []                  # fields we can search through the index - only contain strings or lists of strings
+
+    def build(self):
+        "Builds the index from the timeseries list"
+        for fieldName in TIMESERIES_CATALOG_SEARCHFIELDS:
+            self.trigrams[fieldName] = {}
+        searchFields = list(TIMESERIES_CATALOG_SEARCHFIELDS)
+
+        for position, timeseries in enumerate(self.timeseriesList):
+            timeseriesId = getAttributeOrNone(timeseries, "timeseriesId")
+            if timeseriesId is not None and timeseriesId not in self.byTimeseriesId:
+                self.byTimeseriesId[timeseriesId] = position
+
+            for fieldName in TIMESERIES_CATALOG_SEARCHFIELDS:
+                fieldValue = getAttributeOrNone(timeseries, fieldName)
+                if fieldValue is None:
+                    continue
+                if type(fieldValue) is str:
+                    fieldValue = [fieldValue]
+                elif type(fieldValue) is not list or not all(type(item) is str for item in fieldValue):
+                    # we only index strings and list of strings. Everything else is searched the regular way
+                    if fieldName in searchFields:
+                        searchFields.remove(fieldName)
+                    continue
+
+                fieldTrigrams = self.trigrams[fieldName]
+                trigramsOfValue = set()
+                for item in fieldValue:
+                    trigramsOfValue.update(getTrigrams(item))
+                for trigram in trigramsOfValue:
+                    positions = fieldTrigrams.get(trigram)
+                    if positions is None:
+                        fieldTrigrams[trigram] = [position]
+                    else:
+                        positions.append(position)
+
+        self.searchFields = searchFields
+        for fieldName in TIMESERIES_CATALOG_SEARCHFIELDS:
+            if fieldName not in searchFields:
+                del self.trigrams[fieldName]
+        return self
+
+    def toJson(self):
+        "Returns the index as JSON object so we can persist it next to the cache - without the timeseries list itself"
+        return {"version" : self.version, "byTimeseriesId" : self.byTimeseriesId, "trigrams" : self.trigrams, "searchFields" : self.searchFields}
+
+    def fromJson(self, jsonContent):
+        "Loads the index from the persisted JSON object"
+        self.version = jsonContent["version"]
+        self.byTimeseriesId = jsonContent["byTimeseriesId"]
+        self.trigrams = jsonContent["trigrams"]
+        self.searchFields = jsonContent["searchFields"]
+        return self
+
+    def describe(self, timeseriesId):
+        "Returns the metadata of that timeseries or None"
+        position = self.byTimeseriesId.get(timeseriesId)
+        if position is None:
+            return None
+        return self.timeseriesList[position]
+
+    def findValuesByKey(self, key, matchValue, returnKey):
+        "Same as jsonFindValuesByKey on the timeseries list but only looks at those entries the trigram index says can match"
+        "Returns None in case the query cant be answered from the index, e.g: for tag style keys or fields that are not indexed"
+        if matchValue is None:
+            return None
+        keySearch = KeySearch(key)
+        if (keySearch.keylistname is not None) or (keySearch.contextvalue is not None) or (keySearch.keyvalue is not None):
+            return None
+        fieldName = keySearch.valuekeyname
+        if fieldName not in self.searchFields:
+            return None
+
+        matchRegex = compileMatchValue(matchValue)
+        candidates = range(len(self.timeseriesList))
+        requiredLiterals = getRegexRequiredLiterals(matchValue)
+        if requiredLiterals is not None and len(requiredLiterals) > 0:
+            fieldTrigrams = self.trigrams[fieldName]
+            candidateSet = None
+            for literal in requiredLiterals:
+                for trigram in getTrigrams(literal):
+                    positions = fieldTrigrams.get(trigram, [])
+                    if candidateSet is None:
+                        candidateSet = set(positions)
+                    else:
+                        candidateSet.intersection_update(positions)
+            candidates = sorted(candidateSet)
+
+        result = []
+        for position in candidates:
+            timeseries = self.timeseriesList[position]
+            fieldValue = getAttributeOrNone(timeseries, fieldName)
+            if type(fieldValue) is list:
+                for item in fieldValue:
+                    if matchRegex.match(item):
+                        result.append(getAttributeFromFirstMatch(returnKey, [timeseries, None]))
+            elif fieldValue is not None and matchRegex.match(fieldValue):
+                result.append(getAttributeFromFirstMatch(returnKey, [timeseries, None]))
+        return result
+
+def getTimeseriesCatalog():
+    "Returns the catalog of the timeseries metadata. The list itself is queried through queryDynatraceAPI so the regular cache policy applies"
+    "The index is persisted next to the cached list and only rebuilt when the cached list changes"
+    timeseriesList = queryDynatraceAPI(True, API_ENDPOINT_TIMESERIES, "", "")
+    version = getCacheEntryVersion(API_ENDPOINT_TIMESERIES, "")
+    catalogKey = (config["tenanthost"], version)
+
+    with global_timeseriesCatalogsLock:
+        catalog = getAttributeOrNone(global_timeseriesCatalogs, catalogKey)
+        if catalog is not None and catalog.timeseriesList is timeseriesList:
+            return catalog
+
+        catalog = None
+        catalogFilename = getCacheIndexFilename(API_ENDPOINT_TIMESERIES, "", "catalog")
+        if version is not None and os.path.isfile(catalogFilename):
+            try:
+                with open(catalogFilename) as json_data:
+                    persistedCatalog = json.load(json_data)
+                if getAttributeOrNone(persistedCatalog, "version") == version:
+                    catalog = TimeseriesCatalog(timeseriesList, version).fromJson(persistedCatalog)
+            except (ValueError, KeyError):
+                catalog = None
+
+        if catalog is None:
+            debugLog("Building timeseries catalog for " + str(len(timeseriesList)) + " timeseries")
+            catalog = TimeseriesCatalog(timeseriesList, version).build()
+            if version is not None:
+                writeCacheIndexFile(catalogFilename, catalog.toJson())
+
+        global_timeseriesCatalogs[catalogKey] = catalog
+        return catalog
+
+# =========================================================
+# Entity Index - inverted index over the tags and plain properties of a cached entity list, e.g: from /api/v1/entity/services
+# Persisted next to the cached list and only rebuilt when the list changes. Tag and property searches become lookups instead of scans
+# =========================================================
+ENTITY_INDEX_TAGLIST = "tags"
+ENTITY_INDEX_TAGFIELDS = ["context", "key", "value"]
+
+global_entityIndexes = {}
+global_entityIndexesLock = threading.Lock()
+
+class IndexedValues:
+    "value -> positions of an inverted index. Finds the positions of all values re.match(matchValue, value) matches:"
+    "literals are looked up, prefixes are a range in the sorted values and only real regular expressions are tested against every distinct value"
+    def __init__(self, valuePositions):
+        self.valuePositions = valuePositions
+        self.sortedValues = None
+
+    def findPositions(self, matchValue):
+        positions = []
+        tier, literal = getValueMatchTier(matchValue)
+        if tier == VALUE_MATCH_LITERAL:
+            for value in [literal, literal + "\n"]:
+                positions.extend(self.valuePositions.get(value, []))
+        elif tier == VALUE_MATCH_PREFIX:
+            if self.sortedValues is None:
+                self.sortedValues = sorted(self.valuePositions)
+            i = bisect.bisect_left(self.sortedValues, literal)
+            while i < len(self.sortedValues) and self.sortedValues[i].startswith(literal):
+                positions.extend(self.valuePositions[self.sortedValues[i]])
+                i += 1
+        else:
+            matchRegex = compileMatchValue(matchValue)
+            for value, valuePositions in self.valuePositions.items():
+                if matchRegex.match(value):
+                    positions.extend(valuePositions)
+        return positions
+
+class EntityIndex:
+    "Inverted index over an entity list: property -> value -> positions and (context, key, value) tag tuple -> [position, tag position]"
+    "plus statistics about the keys in the whole list that tell us whether the index returns exactly what jsonFindValuesByKey returns"
+    def __init__(self, entityList, version):
+        self.version = version                  # version of the cache entry this index was built for
+        self.entityList = entityList            # the actual entity list as returned by the API
+        self.properties = {}                    # property -> value -> positions. String and list of string properties - one position per list item
+        self.tags = []                          # [context, key, value, [[position, tag position], ...]] of every distinct tag
+        self.nestedKeys = set()                 # keys of all objects below the entities, e.g: in tags or fromRelationships
+        self.listKeys = set()                   # keys that have a list as value anywhere
+        self.irregularKeys = set()              # keys that have a value other than string, object, null or list of strings anywhere
+        self.plainTags = True                   # all tags are objects with just string or null values
+        self.indexedProperties = {}
+        self.indexedTags = None
+
+    def build(self):
+        "Builds the index from the entity list"
+        tagPositions = collections.OrderedDict()
+        for position, entity in enumerate(self.entityList):
+            for propertyName, value in entity.items():
+                self.collectKeyStatistics(propertyName, value, False)
+                if type(value) is str:
+                    values = [value]
+                elif type(value) is list and all(type(item) is str for item in value):
+                    values = value
+                else:
+                    continue
+                propertyValues = self.properties.setdefault(propertyName, {})
+                for item in values:
+                    propertyValues.setdefault(item, []).append(position)
+
+            tags = getAttributeOrNone(entity, ENTITY_INDEX_TAGLIST)
+            if tags is None:
+                continue
+            if type(tags) is not list:
+                self.plainTags = False
+                continue
+            for tagPosition, tag in enumerate(tags):
+                if type(tag) is not dict or not all(type(tagValue) is str or tagValue is None for tagValue in tag.values()):
+                    self.plainTags = False
+                    continue
+                tagTuple = tuple([getAttributeOrNone(tag, tagField) for tagField in ENTITY_INDEX_TAGFIELDS])
+                tagPositions.setdefault(tagTuple, []).append([position, tagPosition])
+
+        self.tags = [list(tagTuple) + [positions] for tagTuple, positions in tagPositions.items()]
+        return self
+
+    def collectKeyStatistics(self, key, value, nested):
+        if nested:
+            self.nestedKeys.add(key)
+        valueType = type(value)
+        if valueType is list:
+            self.listKeys.add(key)
+            self.collectListStatistics(key, value)
+        elif valueType is dict:
+            for childKey, childValue in value.items():
+                self.collectKeyStatistics(childKey, childValue, True)
+        elif (value is not None) and (valueType is not str):
+            self.irregularKeys.add(key)
+
+    def collectListStatistics(self, key, items):
+        for item in items:
+            itemType = type(item)
+            if itemType is not str:
+                self.irregularKeys.add(key)
+            if itemType is dict:
+                for childKey, childValue in item.items():
+                    self.collectKeyStatistics(childKey, childValue, True)
+            elif itemType is list:
+                self.collectListStatistics(key, item)
+
+    def toJson(self):
+        "Returns the index as JSON object so we can persist it next to the cache - without the entity list itself"
+        return {"version" : self.version, "properties" : self.properties, "tags" : self.tags, "nestedKeys" : sorted(self.nestedKeys), "listKeys" : sorted(self.listKeys), "irregularKeys" : sorted(self.irregularKeys), "plainTags" : self.plainTags}
+
+    def fromJson(self, jsonContent):
+        "Loads the index from the persisted JSON object"
+        self.version = jsonContent["version"]
+        self.properties = jsonContent["properties"]
+        self.tags = jsonContent["tags"]
+        self.nestedKeys = set(jsonContent["nestedKeys"])
+        self.listKeys = set(jsonContent["listKeys"])
+        self.irregularKeys = set(jsonContent["irregularKeys"])
+        self.plainTags = jsonContent["plainTags"]
+        return self
+
+    def getIndexedProperty(self, propertyName):
+        indexedValues = getAttributeOrNone(self.indexedProperties, propertyName)
+        if indexedValues is None:
+            indexedValues = IndexedValues(getAttributeOrDefault(self.properties, propertyName, {}))
+            self.indexedProperties[propertyName] = indexedValues
+        return indexedValues
+
+    def getIndexedTags(self, context, key, fieldName):
+        "Returns the IndexedValues of fieldName over all tags with that context and key - None means any context or key"
+        if fieldName == "value" and self.indexedTags is None:
+            # the common case: tag values by (context, key)
+            self.indexedTags = {}
+            for tag in self.tags:
+                if tag[2] is not None:
+                    self.indexedTags.setdefault((tag[0], tag[1]), {}).setdefault(tag[2], []).extend(tag[3])
+            self.indexedTags = {contextKey : IndexedValues(valuePositions) for contextKey, valuePositions in self.indexedTags.items()}
+
+        fieldIndex = operator.indexOf(ENTITY_INDEX_TAGFIELDS, fieldName)
+        if fieldName == "value" and context is not None and key is not None:
+            return [getAttributeOrDefault(self.indexedTags, (context, key), IndexedValues({}))]
+        if fieldName == "value":
+            return [indexedValues for contextKey, indexedValues in self.indexedTags.items() if (context is None or contextKey[0] == context) and (key is None or contextKey[1] == key)]
+
+        valuePositions = {}
+        for tag in self.tags:
+            if (context is None or tag[0] == context) and (key is None or tag[1] == key) and tag[fieldIndex] is not None:
+                valuePositions.setdefault(tag[fieldIndex], []).extend(tag[3])
+        return [IndexedValues(valuePositions)]
+
+    def findValuesByKey(self, key, matchValue, returnKey):
+        "Same as jsonFindValuesByKey on the entity list but looks the matching entities up in the index"
+        "Returns None in case the search cant be answered from the index in exactly the same way, e.g: searches into relationships or without a match value"
+        if matchValue is None:
+            return None
+        if getValueMatchTier(matchValue)[0] == VALUE_MATCH_REGEX:
+            # raises the same error as the scan for invalid regular expressions - even if there is nothing to match
+            compileMatchValue(matchValue)
+        keySearch = KeySearch(key)
+        fieldName = keySearch.valuekeyname
+
+        # 1: plain property of the entities, e.g: serviceTechnologyTypes=ASP.NET - the property must not be used anywhere below the entities
+        if (keySearch.keylistname is None) and (keySearch.contextvalue is None) and (keySearch.keyvalue is None):
+            if (fieldName in self.nestedKeys) or (fieldName in self.irregularKeys):
+                return None
+            positions = self.getIndexedProperty(fieldName).findPositions(matchValue)
+            return [getAttributeFromFirstMatch(returnKey, [self.entityList[position], None]) for position in sorted(positions)]
+
+        # 2: tags, e.g: tags/AWS:Name=et-demo.* or tags/?key=v123 - only if tags are what we expect them to be
+        if (keySearch.keylistname != ENTITY_INDEX_TAGLIST) or (not self.plainTags) or (ENTITY_INDEX_TAGLIST in self.nestedKeys):
+            return None
+        if (keySearch.contextvalue is not None) and (keySearch.contextkeyname != "context" or fieldName == "context"):
+            return None
+        if (keySearch.keyvalue is not None) and (keySearch.keykeyname != "key" or fieldName == "key" or keySearch.keyvalue in self.listKeys):
+            return None
+        if (not operator.contains(ENTITY_INDEX_TAGFIELDS, fieldName)) or (fieldName in self.listKeys) or (fieldName in self.irregularKeys):
+            return None
+
+        positions = []
+        for indexedValues in self.getIndexedTags(keySearch.contextvalue, keySearch.keyvalue, fieldName):
+            positions.extend(indexedValues.findPositions(matchValue))
+        result = []
+        for position, tagPosition in sorted(positions):
+            entity = self.entityList[position]
+            result.append(getAttributeFromFirstMatch(returnKey, [entity[ENTITY_INDEX_TAGLIST][tagPosition], entity]))
+        return result
+
+def getEntityIndex(apiEndpoint, queryString, entityList, projection=None):
+    "Returns the index of the cached entity list of that query - or None if the list isnt cached or isnt a list of entities"
+    "The index is persisted next to the cached list and only rebuilt when the cached list changes. Projected lists get their own index"
+    version = getCacheEntryVersion(apiEndpoint, queryString)
+    if version is None or not isEntityList(entityList):
+        return None
+    indexName = "entities"
+    if projection is not None:
+        indexName += "-" + projection.name
+    indexKey = (config["tenanthost"], apiEndpoint, queryString, version, indexName)
+
+    with global_entityIndexesLock:
+        entityIndex = getAttributeOrNone(global_entityIndexes, indexKey)
+        if entityIndex is not None and entityIndex.entityList is entityList:
+            return entityIndex
+
+        entityIndex = None
+        indexFilename = getCacheIndexFilename(apiEndpoint, queryString, indexName)
+        if os.path.isfile(indexFilename):
+            try:
+                with open(indexFilename) as json_data:
+                    persistedIndex = json.load(json_data)
+                if getAttributeOrNone(persistedIndex, "version") == version:
+                    entityIndex = EntityIndex(entityList, version).fromJson(persistedIndex)
+            except (ValueError, KeyError):
+                entityIndex = None
+
+        if entityIndex is None:
+            debugLog("Building entity index for " + str(len(entityList)) + " entities of " + apiEndpoint + "?" + queryString)
+            entityIndex = EntityIndex(entityList, version).build()
+            writeCacheIndexFile(indexFilename, entityIndex.toJson())
+
+        global_entityIndexes[indexKey] = entityIndex
+        return entityIndex
+
+# =========================================================
+# Compact Entity Model - with entitymodel compact we keep entity lists as slotted records instead of dicts of dicts: every string is stored
+# once per list, objects with the same keys share one key tuple, objects that repeat across entities - e.g: tags - are stored once and
+# lists of strings - e.g: the ids of relationships - are arrays of indexes into the string table. Entities are only expanded one at a time
+# =========================================================
+ENTITY_MODEL_DICT = "dict"
+ENTITY_MODEL_COMPACT = "compact"
+
+class CompactObject:
+    "A JSON object: a key tuple - shared with all objects that have the same keys - and a tuple of compact values"
+    __slots__ = ("keys", "values")
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+class CompactEntityList:
+    "A list of entities in the compact model. Indexing and iterating return the entities expanded to dicts - exactly as they were - one at a time"
+    "Lists of strings are arrays of indexes into the string table - plain lists never become arrays, so the type tells them apart"
+    def __init__(self, entities):
+        self.strings = []                       # every distinct string of the list
+        self.stringIndexes = {}                 # string -> index in strings
+        self.keyTuples = {}                     # the key tuples shared by objects with the same keys
+        self.sharedObjects = {}                 # objects with only string or null values - e.g: tags - we store only once
+        self.entities = [self.compact(entity) for entity in entities]
+
+        # we only need those while compacting
+        self.stringIndexes = None
+        self.keyTuples = None
+        self.sharedObjects = None
+
+    def internString(self, value):
+        index = self.stringIndexes.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.stringIndexes[value] = index
+        return index
+
+    def compact(self, value):
+        valueType = type(value)
+        if valueType is str:
+            return self.strings[self.internString(value)]
+        if valueType is dict:
+            keys = tuple([self.strings[self.internString(key)] for key in value])
+            keys = self.keyTuples.setdefault(keys, keys)
+            values = tuple([self.compact(item) for item in value.values()])
+            if all((type(item) is str) or (item is None) for item in values):
+                sharedObject = self.sharedObjects.get((keys, values))
+                if sharedObject is None:
+                    sharedObject = CompactObject(keys, values)
+                    self.sharedObjects[(keys, values)] = sharedObject
+                return sharedObject
+            return CompactObject(keys, values)
+        if valueType is list:
+            if (len(value) > 0) and all(type(item) is str for item in value):
+                return array.array("I", [self.internString(item) for item in value])
+            return tuple([self.compact(item) for item in value])
+        return value
+
+    def expand(self, value):
+        valueType = type(value)
+        if valueType is CompactObject:
+            return dict(zip(value.keys, [self.expand(item) for item in value.values]))
+        if valueType is array.array:
+            return [self.strings[index] for index in value]
+        if valueType is tuple:
+            return [self.expand(item) for item in value]
+        return value
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __getitem__(self, position):
+        return self.expand(self.entities[position])
+
+    def __iter__(self):
+        for entity in self.entities:
+            yield self.expand(entity)
+
+def getEntityModelList(entities):
+    "Returns the entities - a list or any other iterable - as list in the configured entitymodel"
+    if getConfigValue("entitymodel") == ENTITY_MODEL_COMPACT:
+        return CompactEntityList(entities)
+    return list(entities)
+
+def isEntityList(entityList):
+    "Returns True for a list of entities - in any entitymodel"
+    if isinstance(entityList, CompactEntityList):
+        return True
+    return (type(entityList) is list) and all(type(entity) is dict for entity in entityList)
+
+# =========================================================
+# Entity Query Plan - translates the filter of an ent query into the query parameters the v1 entity API supports itself, e.g: tag= and entity=
+# so the API only returns the matching entities. Whatever the API cant express is still applied to the - now much smaller - result
+# =========================================================
+ENTITY_PUSHDOWN_ENDPOINTS = [API_ENDPOINT_APPLICATIONS, API_ENDPOINT_SERVICES, API_ENDPOINT_PROCESS_GROUPS, API_ENDPOINT_HOSTS]
+
+ENTITY_LIGHT_PARAMETER = "includeDetails=false"
+
+class EntityQueryPlan:
+    "Where which part of an ent query gets filtered: queryString is what we send to the API, nameValue is the predicate we apply to its result"
+    def __init__(self, apiEndpoint, queryString, nameValue, projection=None):
+        self.apiEndpoint = apiEndpoint
+        self.queryString = queryString          # query string we send to the API, e.g: tag=[AWS]Name:et-demo-1
+        self.serverFilter = None                # the query parameter we pushed down, e.g: tag=[AWS]Name
+        self.nameValue = nameValue              # predicate we apply to the result, e.g: tags/AWS:Name=et-demo.*
+        self.projection = projection            # the fields we keep of the result - None means all
+        self.reason = None                      # why we didnt push anything down
+
+    def toString(self):
+        plan = "server: " + (self.apiEndpoint + "?" + self.queryString if len(self.queryString) > 0 else self.apiEndpoint)
+        if self.nameValue is not None:
+            plan += " | client: " + self.nameValue.name + "=" + str(self.nameValue.value)
+        if self.projection is not None:
+            plan += " | fields: " + self.projection.toString()
+        if self.reason is not None:
+            plan += " | not pushed down: " + self.reason
+        return plan
+
+def getEntityServerFilter(nameValue):
+    "Returns the query parameter that lets the v1 entity API do the filtering for that name=value - or None if the API cant express it"
+    "tags/CONTEXT:KEY=VALUE -> tag=[CONTEXT]KEY:VALUE for literal values - and tag=[CONTEXT]KEY for everything else. entityId=ID$ -> entity=ID"
+    if (nameValue is None) or (nameValue.value is None):
+        return None
+    keySearch = KeySearch(nameValue.name)
+    tier, literal = getValueMatchTier(nameValue.value)
+
+    if (keySearch.keylistname is None) and (keySearch.contextvalue is None) and (keySearch.keyvalue is None):
+        if (keySearch.valuekeyname == "entityId") and (tier == VALUE_MATCH_LITERAL) and (len(literal) > 0):
+            return "entity=" + urllib.parse.quote(literal, safe="")
+        return None
+
+    # the API can only filter tags by context and key - and by the exact value
+    if (keySearch.keylistname != ENTITY_INDEX_TAGLIST) or (keySearch.valuekeyname != "value"):
+        return None
+    if (keySearch.contextkeyname != "context") or (keySearch.keykeyname != "key"):
+        return None
+    if (not keySearch.contextvalue) or (not keySearch.keyvalue) or ("]" in keySearch.contextvalue) or (":" in keySearch.keyvalue):
+        return None
+
+    tagFilter = keySearch.keyvalue
+    if keySearch.contextvalue != "CONTEXTLESS":
+        tagFilter = "[" + keySearch.contextvalue + "]" + tagFilter
+    if (tier == VALUE_MATCH_LITERAL) and (len(literal) > 0):
+        tagFilter += ":" + literal
+    return "tag=" + urllib.parse.quote(tagFilter, safe="[]:")
+
+def getUsableCacheState(apiEndpoint, queryString):
+    "Returns the state of the cached query - fresh or stale - if we can answer it from the cache without going to the API. None otherwise"
+    cacheEntry = getCacheBackend().lookup(apiEndpoint, queryString)
+    if (cacheEntry is None) or (cacheEntry.negative is not None):
+        return None
+    cacheState = getCacheEntryState(cacheEntry, apiEndpoint, queryString)
+    if cacheState == CACHE_STATE_EXPIRED:
+        return None
+    return cacheState
+
+def isCachedQueryUsable(apiEndpoint, queryString):
+    "Returns True if we can answer that query from the cache without going to the API"
+    return getUsableCacheState(apiEndpoint, queryString) is not None
+
+def recordServedFromCache(apiEndpoint, queryString, cacheState):
+    "For queries we answer from what we persisted next to the cache: does what queryDynatraceAPI does when it serves from the cache"
+    "- counts the hit, refreshes a stale entry in the background and prefetches the follow-ups"
+    getCacheBackend().recordAccess(apiEndpoint, queryString, True)
+    if cacheState == CACHE_STATE_STALE:
+        scheduleCacheRefresh(apiEndpoint, queryString)
+    if isPrefetchEnabled():
+        prefetchFollowUps(apiEndpoint, queryString)
+
+def getEntityQueryPlan(apiEndpoint, queryString, nameValue, projection=None):
+    "Decides what the API filters and what we filter. We push the filter down unless the unfiltered list is in the cache anyway"
+    "- then the entity index answers it without any API call. If we only need fields of the entities themselves we also ask the API to leave out the details"
+    plan = EntityQueryPlan(apiEndpoint, queryString, nameValue, projection)
+    serverFilter = getEntityServerFilter(nameValue)
+    if len(queryString) > 0:
+        plan.reason = "query string already given"
+    elif not operator.contains(ENTITY_PUSHDOWN_ENDPOINTS, apiEndpoint):
+        plan.reason = "endpoint doesnt support filters"
+    elif serverFilter is None:
+        plan.reason = "filter cant be expressed by the API"
+    elif isCachedQueryUsable(apiEndpoint, queryString):
+        plan.reason = "full list is cached"
+        return plan
+    else:
+        plan.serverFilter = serverFilter
+        plan.queryString = serverFilter
+
+    if (projection is not None) and projection.isLight() and operator.contains(ENTITY_PUSHDOWN_ENDPOINTS, apiEndpoint) and not isCachedQueryUsable(apiEndpoint, plan.queryString):
+        if len(plan.queryString) > 0:
+            plan.queryString += "&"
+        plan.queryString += ENTITY_LIGHT_PARAMETER
+    return plan
+
+# =========================================================
+# Entity Projection - most ent queries only need a few fields of every entity, e.g: entityId and the tags they filter on
+# We keep a projected copy of the cached list next to it, so as long as the list doesnt change we only load and hold those fields
+# =========================================================
+ENTITY_LIGHT_FIELDS = {"entityId", "displayName", "discoveredName", "customizedName", "firstSeenTimestamp", "lastSeenTimestamp", ENTITY_INDEX_TAGLIST} | set(ENTITY_INDEX_TAGFIELDS)
+
+global_entityProjections = {}
+global_entityProjectionsLock = threading.Lock()
+
+class EntityProjection:
+    "The fields of an entity a query needs: the fields by name - plus every object or list that contains one of the keys we search for"
+    "That way jsonFindValuesByKey returns exactly the same on the projected list as on the full list"
+    def __init__(self, fields, searchKeys):
+        self.fields = sorted(set(fields))                        # top level fields we keep, e.g: entityId, tags
+        self.searchKeys = sorted(set(searchKeys))                # keys we search for - we keep them and every field that has them somewhere inside
+        self.name = "projection-" + hashlib.sha1(json.dumps([self.fields, self.searchKeys]).encode("utf-8")).hexdigest()[:12]
+
+    def toString(self):
+        return ",".join(self.fields)
+
+    def isLight(self):
+        "True if we only need fields the API returns without details"
+        return ENTITY_LIGHT_FIELDS.issuperset(self.fields)
+
+    def apply(self, entityList):
+        "Returns the projected entities of entityList - a list or any other iterable - one at a time"
+        fields = set(self.fields)
+        searchKeys = set(self.searchKeys)
+        for entity in entityList:
+            yield {fieldName : value for fieldName, value in entity.items() if (fieldName in fields) or (fieldName in searchKeys) or jsonContainsKey(value, searchKeys)}
+
+def jsonContainsKey(jsonContent, keys):
+    "Returns True if any object in jsonContent has one of the keys"
+    if type(jsonContent) is dict:
+        for key, value in jsonContent.items():
+            if (key in keys) or jsonContainsKey(value, keys):
+                return True
+    elif type(jsonContent) is list:
+        for item in jsonContent:
+            if jsonContainsKey(item, keys):
+                return True
+    return False
+
+def getEntityProjection(nameValue, resultTag, fields=None):
+    "Returns the projection an ent query needs - or None if it needs the full entities, e.g: for result tag * without any fields"
+    if resultTag == "*":
+        if fields is None:
+            return None
+        resultFields = fields
+    else:
+        resultFields = resultTag.split(",")
+
+    # the names of the fields we filter on - and the key value, the search also looks at lists with that name
+    keySearch = KeySearch(nameValue.name if nameValue is not None else "displayName")
+    filterFields = [keySearch.keylistname, keySearch.valuekeyname]
+    if keySearch.contextvalue is not None:
+        filterFields.append(keySearch.contextkeyname)
+    if keySearch.keyvalue is not None:
+        filterFields.append(keySearch.keykeyname)
+    filterFields = [filterField for filterField in filterFields if filterField is not None]
+    searchKeys = filterFields + ([keySearch.keyvalue] if keySearch.keyvalue is not None else [])
+    return EntityProjection(resultFields + filterFields, searchKeys)
+
+def getEntityProjectionFilename(apiEndpoint, queryString, projection):
+    return getCacheIndexFilename(apiEndpoint, queryString, projection.name)
+
+def queryEntitiesProjected(apiEndpoint, queryString, projection):
+    "Same as queryDynatraceAPI for an entity list - but only returns the fields of the projection"
+    "As long as the cached list doesnt change we only load its projected copy. Otherwise we query the full list and project it again"
+    cacheState = getUsableCacheState(apiEndpoint, queryString)
+    if cacheState is not None:
+        projectedList = loadEntityProjection(apiEndpoint, queryString, projection, getCacheEntryVersion(apiEndpoint, queryString))
+        if projectedList is not None:
+            recordServedFromCache(apiEndpoint, queryString, cacheState)
+            return projectedList
+
+    entityLines = lookupEntityLines(apiEndpoint, queryString)
+    if entityLines is not None:
+        # a list stored line by line gets projected entity by entity - we never load all of it
+        version = entityLines[1]["version"]
+        projectedList = getEntityModelList(projection.apply(streamCachedEntities(entityLines[0])))
+    else:
+        entityList = queryDynatraceAPI(True, apiEndpoint, queryString, "")
+        version = getCacheEntryVersion(apiEndpoint, queryString)
+        if version is None or type(entityList) is not list or not all(type(entity) is dict for entity in entityList):
+            return entityList
+        projectedList = getEntityModelList(projection.apply(entityList))
+
+    with global_entityProjectionsLock:
+        global_entityProjections[(config["tenanthost"], apiEndpoint, queryString, version, projection.name)] = projectedList
+
+    # we write the entities one by one - a compact list never gets expanded all at once
+    projectionHeader = json.dumps({"version" : version, "fields" : projection.fields, "searchKeys" : projection.searchKeys})
+    writeFileAtomically(getEntityProjectionFilename(apiEndpoint, queryString, projection), projectionHeader[:-1] + ", \"entities\": [" + ", ".join([json.dumps(entity) for entity in projectedList]) + "]}")
+    return projectedList
+
+def loadEntityProjection(apiEndpoint, queryString, projection, version):
+    "Returns the projected copy of that version of the cached list - or None if we dont have it"
+    projectionKey = (config["tenanthost"], apiEndpoint, queryString, version, projection.name)
+    with global_entityProjectionsLock:
+        projectedList = getAttributeOrNone(global_entityProjections, projectionKey)
+        if projectedList is not None:
+            return projectedList
+
+        projectionFilename = getEntityProjectionFilename(apiEndpoint, queryString, projection)
+        if (version is None) or not os.path.isfile(projectionFilename):
+            return None
+        try:
+            with open(projectionFilename) as json_data:
+                persistedProjection = json.load(json_data)
+        except ValueError:
+            return None
+        if getAttributeOrNone(persistedProjection, "version") != version:
+            return None
+
+        projectedList = getEntityModelList(persistedProjection["entities"])
+        global_entityProjections[projectionKey] = projectedList
+        return projectedList
+
+# =========================================================
+# Entity Lines - with cacheencoding ndjson the file cache stores entity lists with one entity per line - framed as JSON array, so it is still
+# valid JSON for everything else that reads the cache - plus an index of the byte offset of every entityId. ent then filters the list line by line
+# and looks single entities up by their offset instead of loading the whole list
+# =========================================================
+global_entityLineIndexes = {}
+global_entityLineIndexesLock = threading.Lock()
+
+def encodeCacheContent(cacheBackend, apiEndpoint, jsonContent):
+    "Returns (jsonText, entityLines) we store in the cache. entityLines is None - unless we store an entity list line by line:"
+    "then it has the entityId of every line and whether entityIds are only plain strings on the top level of the entities"
+    if (getConfigValue("cacheencoding") != CACHE_ENCODING_NDJSON) or (cacheBackend.name != CACHE_BACKEND_FILE) or not apiEndpoint.startswith(API_ENDPOINT_ENTITY):
+        return (json.dumps(jsonContent), None)
+    if (type(jsonContent) is not list) or not all(type(entity) is dict for entity in jsonContent):
+        return (json.dumps(jsonContent), None)
+
+    entityIds = []
+    plainEntityIds = True
+    for entity in jsonContent:
+        entityId = getAttributeOrNone(entity, "entityId")
+        if (entityId is not None) and (type(entityId) is not str):
+            plainEntityIds = False
+        if plainEntityIds and any(jsonContainsKey(value, {"entityId"}) for value in entity.values()):
+            plainEntityIds = False
+        entityIds.append(entityId if type(entityId) is str else None)
+
+    # json.dumps never writes a line break within an entity
+    jsonText = "[\n" + ",\n".join([json.dumps(entity) for entity in jsonContent]) + "\n]"
+    return (jsonText, {"entityIds" : entityIds, "plainEntityIds" : plainEntityIds})
+
+def getEntityLineIndexFilename(apiEndpoint, queryString):
+    return getCacheIndexFilename(apiEndpoint, queryString, "lines")
+
+def getEntityLine(line):
+    "Returns the JSON of the entity in that line of a list stored line by line - or None for the first and last line"
+    line = line.rstrip(b"\r\n")
+    if line.endswith(b","):
+        line = line[:-1]
+    if (line == b"[") or (line == b"]") or (len(line) == 0):
+        return None
+    return line
+
+def writeEntityLineIndex(cacheBackend, apiEndpoint, queryString, entityLines):
+    "Persists the byte offset and length of every entity line of the list we just stored - we read them from the file, so line breaks of the OS dont matter"
+    entryFile = cacheBackend.findEntryFile(apiEndpoint, queryString)
+    version = getCacheEntryVersion(apiEndpoint, queryString)
+    if (entryFile is None) or (version is None):
+        return
+
+    offsets = {}
+    entityIds = entityLines["entityIds"]
+    entityPosition = 0
+    offset = 0
+    with open(entryFile[0], "rb") as entityFile:
+        for line in entityFile:
+            entityLine = getEntityLine(line)
+            if entityLine is not None:
+                if (entityPosition < len(entityIds)) and (entityIds[entityPosition] is not None):
+                    offsets.setdefault(entityIds[entityPosition], []).append([offset, len(entityLine)])
+                entityPosition += 1
+            offset += len(line)
+
+    # another process might have replaced the list while we read it
+    if (entityPosition != len(entityIds)) or (getCacheEntryVersion(apiEndpoint, queryString) != version):
+        return
+    writeCacheIndexFile(getEntityLineIndexFilename(apiEndpoint, queryString), {"version" : version, "entities" : entityPosition, "plainEntityIds" : entityLines["plainEntityIds"], "offsets" : offsets})
+
+def loadEntityLineIndex(apiEndpoint, queryString, version):
+    "Returns the line index of that version of the cached list - or None if it isnt stored line by line"
+    lineIndexKey = (config["tenanthost"], apiEndpoint, queryString, version)
+    with global_entityLineIndexesLock:
+        lineIndex = getAttributeOrNone(global_entityLineIndexes, lineIndexKey)
+        if lineIndex is not None:
+            return lineIndex
+
+        lineIndexFilename = getEntityLineIndexFilename(apiEndpoint, queryString)
+        if (version is None) or not os.path.isfile(lineIndexFilename):
+            return None
+        try:
+            with open(lineIndexFilename) as json_data:
+                lineIndex = json.load(json_data)
+        except ValueError:
+            return None
+        if getAttributeOrNone(lineIndex, "version") != version:
+            return None
+
+        global_entityLineIndexes[lineIndexKey] = lineIndex
+        return lineIndex
+
+def lookupEntityLines(apiEndpoint, queryString):
+    "Returns (filename, line index) in case we can answer that query from a list the file cache stored line by line - None otherwise"
+    cacheBackend = getCacheBackend()
+    if cacheBackend.name != CACHE_BACKEND_FILE:
+        return None
+    cacheState = getUsableCacheState(apiEndpoint, queryString)
+    if cacheState is None:
+        return None
+    entryFile = cacheBackend.findEntryFile(apiEndpoint, queryString)
+    lineIndex = loadEntityLineIndex(apiEndpoint, queryString, getCacheEntryVersion(apiEndpoint, queryString))
+    if (entryFile is None) or (lineIndex is None):
+        return None
+
+    recordServedFromCache(apiEndpoint, queryString, cacheState)
+    return (entryFile[0], lineIndex)
+
+def streamCachedEntities(filename):
+    "Yields the entities of a list stored line by line - we only have one of them in memory at a time"
+    with open(filename, "rb") as entityFile:
+        for line in entityFile:
+            entityLine = getEntityLine(line)
+            if entityLine is not None:
+                yield json.loads(entityLine)
+
+def readCachedEntities(filename, lineIndex, entityIds):
+    "Returns the entities with those entityIds of a list stored line by line - in list order. We seek right to their lines"
+    positions = []
+    for entityId in entityIds:
+        positions.extend(getAttributeOrDefault(lineIndex["offsets"], entityId, []))
+
+    entities = []
+    with open(filename, "rb") as entityFile:
+        for offset, length in sorted(positions):
+            entityFile.seek(offset)
+            entities.append(json.loads(entityFile.read(length)))
+    return entities
+
+def getEntityIdLookup(nameValue):
+    "Returns the entityIds in case the filter only matches entities by their exact entityId, e.g: entityId=SERVICE-1234$ - None otherwise"
+    if (nameValue is None) or (nameValue.value is None):
+        return None
+    keySearch = KeySearch(nameValue.name)
+    if (keySearch.keylistname is not None) or (keySearch.contextvalue is not None) or (keySearch.keyvalue is not None) or (keySearch.valuekeyname != "entityId"):
+        return None
+    tier, literal = getValueMatchTier(nameValue.value)
+    if tier != VALUE_MATCH_LITERAL:
+        return None
+    # just like re, $ also matches right before a trailing newline
+    return [literal, literal + "\n"]
+
+# =========================================================
+# Smartscape Graph - the relationships of all entities in the cached entity lists of all entity types as adjacency arrays per relationship,
+# e.g: fromRelationships:calls. Persisted in the cache and rebuilt whenever one of the lists changes. Traversals run locally instead of one entity query per hop
+# =========================================================
+SMARTSCAPE_GRAPH_ENDPOINTS = [API_ENDPOINT_APPLICATIONS, API_ENDPOINT_SERVICES, API_ENDPOINT_PROCESS_GROUPS, API_ENDPOINT_HOSTS, API_ENDPOINT_PROCESSES]
+SMARTSCAPE_RELATIONSHIP_LISTS = ["fromRelationships", "toRelationships"]
+SMARTSCAPE_GRAPH_PROJECTION = EntityProjection(["entityId"] + SMARTSCAPE_RELATIONSHIP_LISTS, [])
+SMARTSCAPE_TRAVERSAL_PATTERN = re.compile(r"^smartscape/(\w+):(\w+|\*)(?:\*(\d+))?$")
+
+global_smartscapeGraphs = {}
+global_smartscapeGraphsLock = threading.Lock()
+
+class SmartscapeGraph:
+    "The entities of all entity lists as nodes and their relationships as adjacency arrays: for a relationship, e.g: fromRelationships:calls,"
+    "node n points to the nodes targets[offsets[n]:offsets[n+1]]. Relationship targets that arent in any of the lists become nodes without type"
+    def __init__(self, versions):
+        self.versions = versions                # cache entry version of every entity list the graph was built from
+        self.entityIds = []                     # entityId of every node
+        self.entityTypes = array.array("b")     # index of the endpoint in SMARTSCAPE_GRAPH_ENDPOINTS the node comes from - -1 if it isnt in any list
+        self.positions = {}                     # entityId -> node
+        self.relationships = {}                 # relationship, e.g: fromRelationships:calls -> (offsets, targets)
+
+    def getNode(self, entityId):
+        "Returns the node of that entityId - adds a node without type if we dont know it yet"
+        position = self.positions.get(entityId)
+        if position is None:
+            position = len(self.entityIds)
+            self.positions[entityId] = position
+            self.entityIds.append(entityId)
+            self.entityTypes.append(-1)
+        return position
+
+    def build(self, entityLists):
+        "Builds the graph from the entity lists - endpoint -> list of entities"
+        # 1: every entity becomes a node of the type of its list
+        for apiEndpoint, entityList in entityLists.items():
+            for entity in entityList:
+                entityId = getAttributeOrNone(entity, "entityId")
+                if type(entityId) is str:
+                    position = self.getNode(entityId)
+                    if self.entityTypes[position] < 0:
+                        self.entityTypes[position] = operator.indexOf(SMARTSCAPE_GRAPH_ENDPOINTS, apiEndpoint)
+
+        # 2: the relationships of every entity - in case an entity is in more than one list the first one wins
+        adjacencyLists = {}
+        builtNodes = set()
+        for apiEndpoint, entityList in entityLists.items():
+            for entity in entityList:
+                entityId = getAttributeOrNone(entity, "entityId")
+                if (type(entityId) is not str) or (entityId in builtNodes):
+                    continue
+                builtNodes.add(entityId)
+                position = self.positions[entityId]
+                for relationshipList in SMARTSCAPE_RELATIONSHIP_LISTS:
+                    relationships = getAttributeOrNone(entity, relationshipList)
+                    if type(relationships) is not dict:
+                        continue
+                    for relationshipName, targets in relationships.items():
+                        if type(targets) is list:
+                            adjacencyList = adjacencyLists.setdefault(relationshipList + ":" + relationshipName, {}).setdefault(position, [])
+                            adjacencyList.extend([self.getNode(target) for target in targets if type(target) is str])
+
+        # 3: now that we know all nodes we turn the adjacency lists into arrays
+        for relationship, adjacencyList in adjacencyLists.items():
+            offsets = array.array("I")
+            targets = array.array("I")
+            for position in range(len(self.entityIds)):
+                offsets.append(len(targets))
+                targets.extend(adjacencyList.get(position, []))
+            offsets.append(len(targets))
+            self.relationships[relationship] = (offsets, targets)
+        return self
+
+    def toJson(self):
+        return {"version" : self.versions, "entityIds" : self.entityIds, "entityTypes" : self.entityTypes.tolist(),
+                "relationships" : {relationship : [offsets.tolist(), targets.tolist()] for relationship, (offsets, targets) in self.relationships.items()}}
+
+    def fromJson(self, jsonContent):
+        self.entityIds = jsonContent["entityIds"]
+        self.entityTypes = array.array("b", jsonContent["entityTypes"])
+        self.positions = {entityId : position for position, entityId in enumerate(self.entityIds)}
+        self.relationships = {relationship : (array.array("I", adjacency[0]), array.array("I", adjacency[1])) for relationship, adjacency in jsonContent["relationships"].items()}
+        return self
+
+    def getRelationships(self, relationshipList, relationshipName):
+        "Returns the relationships we have for e.g: fromRelationships and calls - relationshipName * stands for all relationships of that list"
+        if relationshipName == "*":
+            return [relationship for relationship in sorted(self.relationships) if relationship.startswith(relationshipList + ":")]
+        relationship = relationshipList + ":" + relationshipName
+        return [relationship] if relationship in self.relationships else []
+
+    def getTargets(self, position, relationship):
+        offsets, targets = self.relationships[relationship]
+        return targets[offsets[position]:offsets[position + 1]]
+
+    def countRelationships(self, entityId, relationshipList, relationshipName):
+        "Returns the number of entities in e.g: fromRelationships/calls of that entity - None if the entity isnt in any of the entity lists"
+        position = self.positions.get(entityId)
+        if (position is None) or (self.entityTypes[position] < 0):
+            return None
+        return sum([len(self.getTargets(position, relationship)) for relationship in self.getRelationships(relationshipList, relationshipName)])
+
+    def traverse(self, entityIds, relationshipList, relationshipName, maxHops):
+        "Returns the entityIds of all entities we reach from entityIds within maxHops hops along the relationship - breadth first, without the entities we start from"
+        relationships = self.getRelationships(relationshipList, relationshipName)
+        frontier = [self.positions[entityId] for entityId in entityIds if entityId in self.positions]
+        visited = set(frontier)
+        reached = []
+        for hop in range(maxHops):
+            nextFrontier = []
+            for position in frontier:
+                for relationship in relationships:
+                    for target in self.getTargets(position, relationship):
+                        if target not in visited:
+                            visited.add(target)
+                            nextFrontier.append(target)
+            reached.extend(nextFrontier)
+            frontier = nextFrontier
+        return reached
+
+def getSmartscapeGraphFilename():
+    return getCacheIndexFilename(API_ENDPOINT_ENTITY, "", "smartscape")
+
+def isSmartscapeGraphCached():
+    "Returns True if we can build the smartscape graph from the cache - without downloading any of its entity lists"
+    return all([isCachedQueryUsable(apiEndpoint, "") for apiEndpoint in SMARTSCAPE_GRAPH_ENDPOINTS])
+
+def getSmartscapeGraph():
+    "Returns the smartscape graph of the tenant. The entity lists are queried through queryEntitiesProjected so the regular cache policy applies"
+    "The graph is persisted in the cache and only rebuilt when one of the lists changes. Lists we cant query are left out of the graph"
+    cacheStates = {apiEndpoint : getUsableCacheState(apiEndpoint, "") for apiEndpoint in SMARTSCAPE_GRAPH_ENDPOINTS}
+
+    # lets first refresh all expired lists concurrently - we only keep the relationships of the entities
+    expiredEndpoints = [apiEndpoint for apiEndpoint in SMARTSCAPE_GRAPH_ENDPOINTS if cacheStates[apiEndpoint] is None]
+    expiredResults = runConcurrently([(queryEntitiesProjected, (apiEndpoint, "", SMARTSCAPE_GRAPH_PROJECTION)) for apiEndpoint in expiredEndpoints], True)
+    failedEndpoints = []
+    for apiEndpoint, expiredResult in zip(expiredEndpoints, expiredResults):
+        if isinstance(expiredResult, Exception) or not isEntityList(expiredResult):
+            debugLog("Smartscape graph without " + apiEndpoint + ": " + str(expiredResult))
+            failedEndpoints.append(apiEndpoint)
+
+    versions = {apiEndpoint : None if operator.contains(failedEndpoints, apiEndpoint) else getCacheEntryVersion(apiEndpoint, "") for apiEndpoint in SMARTSCAPE_GRAPH_ENDPOINTS}
+    graphKey = (config["tenanthost"], json.dumps(versions, sort_keys=True))
+
+    with global_smartscapeGraphsLock:
+        graph = getAttributeOrNone(global_smartscapeGraphs, graphKey)
+        if graph is not None:
+            return graph
+
+        graphFilename = getSmartscapeGraphFilename()
+        if os.path.isfile(graphFilename):
+            try:
+                with open(graphFilename) as json_data:
+                    persistedGraph = json.load(json_data)
+                if getAttributeOrNone(persistedGraph, "version") == versions:
+                    graph = SmartscapeGraph(versions).fromJson(persistedGraph)
+            except (ValueError, KeyError):
+                graph = None
+
+        if graph is not None:
+            # we answer from the cached lists without loading them
+            for apiEndpoint, cacheState in cacheStates.items():
+                if cacheState is not None:
+                    recordServedFromCache(apiEndpoint, "", cacheState)
+        else:
+            entityLists = {}
+            for apiEndpoint in SMARTSCAPE_GRAPH_ENDPOINTS:
+                if versions[apiEndpoint] is not None:
+                    entityLists[apiEndpoint] = queryEntitiesProjected(apiEndpoint, "", SMARTSCAPE_GRAPH_PROJECTION)
+            debugLog("Building smartscape graph for " + str(sum([len(entityList) for entityList in entityLists.values()])) + " entities")
+            graph = SmartscapeGraph(versions).build(entityLists)
+            writeCacheIndexFile(graphFilename, graph.toJson())
+
+        global_smartscapeGraphs[graphKey] = graph
+        return graph
+
+def parseSmartscapeTraversal(nameValue):
+    "Returns (relationship list, relationship name, hops, entityIds) for a traversal like smartscape/fromRelationships:calls*3=APPLICATION-1234,APPLICATION-5678"
+    "- None if the filter isnt a traversal"
+    if (nameValue is None) or (nameValue.value is None) or not nameValue.name.startswith("smartscape/"):
+        return None
+    traversalMatch = SMARTSCAPE_TRAVERSAL_PATTERN.match(nameValue.name)
+    if (traversalMatch is None) or not operator.contains(SMARTSCAPE_RELATIONSHIP_LISTS, traversalMatch.group(1)):
+        raise Exception("Error", "Smartscape traversal " + nameValue.name + " not supported. Use smartscape/fromRelationships:RELATIONSHIP*HOPS=ENTITYID or smartscape/toRelationships:RELATIONSHIP*HOPS=ENTITYID")
+    hops = 1
+    if traversalMatch.group(3) is not None:
+        hops = int(traversalMatch.group(3))
+    return (traversalMatch.group(1), traversalMatch.group(2), hops, nameValue.value.split(","))
+
+def traverseSmartscape(apiEndpoint, traversal, resultTag, fields=None):
+    "Returns resultTag of all entities of the endpoint's type we reach along the traversal - see parseSmartscapeTraversal"
+    graph = getSmartscapeGraph()
+    entityType = operator.indexOf(SMARTSCAPE_GRAPH_ENDPOINTS, apiEndpoint)
+    reachedEntityIds = [graph.entityIds[position] for position in graph.traverse(traversal[3], traversal[0], traversal[1], traversal[2]) if graph.entityTypes[position] == entityType]
+    if resultTag == "entityId":
+        return reachedEntityIds
+
+    # for anything else we look the reached entities up in their list - by entityId
+    projection = getEntityProjection(NameValue("entityId", ""), resultTag, fields)
+    if projection is None:
+        entityList = queryDynatraceAPI(True, apiEndpoint, "", "")
+    else:
+        entityList = queryEntitiesProjected(apiEndpoint, "", projection)
+    reachedEntities = dict.fromkeys(reachedEntityIds)
+    for entity in entityList:
+        entityId = getAttributeOrNone(entity, "entityId")
+        if (entityId in reachedEntities) and (reachedEntities[entityId] is None):
+            reachedEntities[entityId] = entity
+    return [getAttributeFromFirstMatch(resultTag, [entity, None]) for entity in reachedEntities.values() if entity is not None]
+
 def matchEntityName(entityName, listOfEntities):
     if(listOfEntities is None):
         return True
@@ -482,6 +3445,104 @@ def filterDataPointsForEntities(jsonDataPoints, entities):
             result[entityDataPoint]["dataPoints"] = jsonDataPoints[entityDataPoint]
     return result
 
+# =========================================================
+# Timeseries Entity Push-Down - ts query for specific entities asks the API only for their series (entity=) instead of the series of every entity
+# Long lists of entities are split into chunks we query concurrently. The entities are sorted, so the same set always ends up in the same cache entries
+# =========================================================
+TIMESERIES_ENTITY_CHUNK = 50          # entity= parameters per timeseries query - keeps the URLs short
+
+def getTimeseriesEntityQueryStrings(queryString, entities):
+    "Returns the query strings that only ask for the series of those entities - one per chunk. Returns [queryString] if we dont push the entities down:"
+    "no entities given or the series of all entities are in the cache anyway"
+    if (entities is None) or (len(entities) == 0):
+        return [queryString]
+    if isCachedQueryUsable(API_ENDPOINT_TIMESERIES, queryString):
+        debugLog("Timeseries query plan - series of all entities are cached: " + queryString)
+        return [queryString]
+
+    entityIds = sorted(set(entities))
+    entityQueryStrings = []
+    for chunkStart in range(0, len(entityIds), TIMESERIES_ENTITY_CHUNK):
+        entityQueryStrings.append(queryString + "".join(["&entity=" + urllib.parse.quote(entityId, safe="") for entityId in entityIds[chunkStart:chunkStart + TIMESERIES_ENTITY_CHUNK]]))
+    debugLog("Timeseries query plan - " + str(len(entityIds)) + " entities in " + str(len(entityQueryStrings)) + " queries: " + queryString)
+    return entityQueryStrings
+
+def mergeTimeseriesResults(jsonContents):
+    "Merges the responses of the chunks of a timeseries query into one response - without changing the responses themselves, they might be memoized"
+    mergedContent = dict(jsonContents[0])
+    mergedResult = None
+    for jsonContent in jsonContents:
+        jsonContentResult = getAttributeOrNone(jsonContent, "result")
+        if not jsonContentResult:
+            continue
+        if mergedResult is None:
+            mergedResult = dict(jsonContentResult)
+            mergedResult["dataPoints"] = {}
+            mergedResult["entities"] = {}
+        mergedResult["dataPoints"].update(getAttributeOrDefault(jsonContentResult, "dataPoints", {}))
+        mergedResult["entities"].update(getAttributeOrDefault(jsonContentResult, "entities", {}))
+    mergedContent["result"] = mergedResult
+    return mergedContent
+
+def queryTimeseriesForEntities(queryString, entities):
+    "Same as queryDynatraceAPI for a timeseries query - but only transfers the series of the entities, see getTimeseriesEntityQueryStrings"
+    entityQueryStrings = getTimeseriesEntityQueryStrings(queryString, entities)
+    if len(entityQueryStrings) == 1:
+        return queryDynatraceAPI(True, API_ENDPOINT_TIMESERIES, entityQueryStrings[0], "")
+    jsonContents = runConcurrently([(queryDynatraceAPI, (True, API_ENDPOINT_TIMESERIES, entityQueryString, "")) for entityQueryString in entityQueryStrings])
+    return mergeTimeseriesResults(jsonContents)
+
+# =========================================================
+# Timeseries Totals - with queryMode total the API returns a single aggregate per entity over the whole timeframe instead of every data point
+# If the API doesnt support it for a timeseries we reduce the series to totals ourselves
+# =========================================================
+TIMESERIES_QUERYMODE_SERIES = "series"
+TIMESERIES_QUERYMODE_TOTAL = "total"
+TIMESERIES_QUERYMODES = [TIMESERIES_QUERYMODE_SERIES, TIMESERIES_QUERYMODE_TOTAL]
+
+# how we reduce the data points of an entity to its total per aggregation type. Other aggregation types, e.g: percentile, get averaged
+TIMESERIES_TOTAL_REDUCERS = {
+    "avg" : lambda values: sum(values) / len(values),
+    "sum" : sum,
+    "count" : sum,
+    "min" : min,
+    "max" : max
+}
+
+# monspec reduces the series of all matched entities to the average of all their data points. For a single entity and these aggregation types
+# the total of the timeframe is that average as well. With more entities the average of their totals would no longer weight them by their data points
+MONSPEC_TOTAL_AGGREGATIONS = ["avg"]
+
+def reduceTimeseriesToTotals(jsonContent, aggregation):
+    "Returns the timeseries result with the data points of every entity reduced to one [timestamp, total] - just like queryMode total"
+    "Returns jsonContent itself if it already has at most one data point per entity"
+    jsonContentResult = getAttributeOrNone(jsonContent, "result")
+    if (not jsonContentResult) or all(len(dataPoints) <= 1 for dataPoints in jsonContentResult["dataPoints"].values()):
+        return jsonContent
+
+    reducer = getAttributeOrDefault(TIMESERIES_TOTAL_REDUCERS, aggregation, TIMESERIES_TOTAL_REDUCERS["avg"])
+    totals = {}
+    for entity, dataPoints in jsonContentResult["dataPoints"].items():
+        values = [dataPoint[1] for dataPoint in dataPoints if dataPoint[1] is not None]
+        totals[entity] = [[dataPoints[-1][0], reducer(values) if len(values) > 0 else None]] if len(dataPoints) > 0 else []
+
+    reducedContent = dict(jsonContent)
+    reducedContent["result"] = dict(jsonContentResult)
+    reducedContent["result"]["dataPoints"] = totals
+    return reducedContent
+
+def queryTimeseriesTotals(queryString, entities, aggregation):
+    "Same as queryTimeseriesForEntities - but asks the API for the total of every entity over the timeframe (queryMode=total)"
+    "In case the API rejects (4xx) or ignores queryMode for that timeseries we query the series and reduce them ourselves. Any other error is raised"
+    try:
+        jsonContent = queryTimeseriesForEntities(queryString + "&queryMode=" + TIMESERIES_QUERYMODE_TOTAL, entities)
+    except DynatraceAPIError as err:
+        if not (400 <= err.statusCode < 500):
+            raise err
+        debugLog("queryMode " + TIMESERIES_QUERYMODE_TOTAL + " failed for " + queryString + " - reducing the series: " + str(err))
+        jsonContent = queryTimeseriesForEntities(queryString, entities)
+    return reduceTimeseriesToTotals(jsonContent, aggregation)
+
 def handleException(e):
     "Handles Exceptions. Prints them to console and exits the program"
     errorObject = {}
@@ -680,21 +3741,29 @@ def calculateAverageOnAllDataPoints(timeseriesResultList):
         totalAvg = totalSum / totalEntries;
     return totalAvg
 
+def getMonspecTimeseriesQuery(perfsignature, timespan, timeshift, foundEntities):
+    "Returns the timeseries of the perfsignature as ts query expects it - where it gives the same result we only ask for the total, see MONSPEC_TOTAL_AGGREGATIONS"
+    aggregate = perfsignature[MONSPEC_PERFSIGNATURE_AGGREGATE]
+    timeseriesForQuery = perfsignature[MONSPEC_PERFSIGNATURE_TIMESERIES] + "[" + aggregate + "%" + timespan + ":" + timeshift
+    if operator.contains(MONSPEC_TOTAL_AGGREGATIONS, aggregate.lower()) and (foundEntities is not None) and (len(foundEntities) == 1):
+        timeseriesForQuery += "%" + TIMESERIES_QUERYMODE_TOTAL
+    return timeseriesForQuery + "]"
+
 def queryEntitiesForMonspecEnvironment(monspec, entitydefname, environmentdefname):
     "Queries the list of entities that match the monspec tag specification for the passed enviornment"
     "Returns: list of entitiyId's"
     return queryEntitiesForMonspecEnvironmentEx(monspec, entitydefname, environmentdefname, "entityId")
     
-def queryEntitiesForMonspecEnvironmentEx(monspec, entitydefname, environmentdefname, returnedFieldList):
+def queryEntitiesForMonspecEnvironmentEx(monspec, entitydefname, environmentdefname, returnedFieldList, fields=None):
     "Queries the list of entities that match the monspec tag specification for the passed enviornment"
-    "Allows you to specify which fields you want to have returned, e.g: \"entityId\" or \"entityId, displayName\" or \"*\""
+    "Allows you to specify which fields you want to have returned, e.g: \"entityId\" or \"entityId, displayName\" or \"*\" - for * fields limits the entity objects to those fields"
 
     # lets get the tags from the environment definition
     entityType = monspec[entitydefname]["etype"]
     tagsForQuery = monspec[entitydefname]["environments"][environmentdefname]["tags"]
 
     # lets get the entity IDs that match the tags
-    foundEntities = doEntity(False, ["dtcli", "ent", monspecConvertEntityType(entityType), tagsForQuery, returnedFieldList], False)
+    foundEntities = doEntity(False, ["dtcli", "ent", monspecConvertEntityType(entityType), tagsForQuery, returnedFieldList], False, fields)
     return foundEntities    
 
 def pullMonspecMetrics(monspec, entitydefname, environmentdefname, timespan, timeshift, resultfield, datahandling):
@@ -704,17 +3773,31 @@ def pullMonspecMetrics(monspec, entitydefname, environmentdefname, timespan, tim
 
     foundEntities = queryEntitiesForMonspecEnvironment(monspec, entitydefname, environmentdefname)
 
-    # now lets iterate through all the perfsignatures
+    # lets first pull the timeseries of all perfsignatures concurrently. Errors are handled per perfsignature further down
     perfSignatureDefinition = monspec[entitydefname][MONSPEC_PERFSIGNATURE]
+    timeseriesPerfsignatures = []
+    timeseriesQueries = []
+    if datahandling != MONSPEC_DATAHANDLING_DEMODATA:
+        for perfsignature in perfSignatureDefinition:
+            timeseries = getAttributeOrNone(perfsignature, MONSPEC_PERFSIGNATURE_TIMESERIES)
+            if(timeseries is not None) :
+                timeseriesForQuery = getMonspecTimeseriesQuery(perfsignature, timespan, timeshift, foundEntities)
+                timeseriesPerfsignatures.append(perfsignature)
+                timeseriesQueries.append((doTimeseries, (False, ["dtcli", "ts", "query", timeseriesForQuery, arrayToStringList(foundEntities)], False)))
+    # two perfsignatures might be defined exactly the same - so we map the results by the perfsignature object, not by its content
+    timeseriesResults = dict(zip([id(perfsignature) for perfsignature in timeseriesPerfsignatures], runConcurrently(timeseriesQueries, True)))
+
+    # now lets iterate through all the perfsignatures
     for perfsignature in perfSignatureDefinition:
         timeseries = getAttributeOrNone(perfsignature, MONSPEC_PERFSIGNATURE_TIMESERIES)
         if(timeseries is not None) : 
             if datahandling == MONSPEC_DATAHANDLING_DEMODATA:
                 perfsignature[resultfield] = 10
             else:
-                timeseriesForQuery = perfsignature[MONSPEC_PERFSIGNATURE_TIMESERIES] + "[" + perfsignature[MONSPEC_PERFSIGNATURE_AGGREGATE] + "%" + timespan + ":" + timeshift + "]"
                 try :
-                    perfsignature[resultfield] = doTimeseries(False, ["dtcli", "ts", "query", timeseriesForQuery, arrayToStringList(foundEntities)], False)
+                    perfsignature[resultfield] = timeseriesResults[id(perfsignature)]
+                    if isinstance(perfsignature[resultfield], Exception):
+                        raise perfsignature[resultfield]
                     perfsignature[resultfield] = calculateAverageOnAllDataPoints(perfsignature[resultfield])
                 except Exception as err:
                     if datahandling == MONSPEC_DATAHANDLING_NORMAL:
@@ -727,11 +3810,27 @@ def pullMonspecMetrics(monspec, entitydefname, environmentdefname, timespan, tim
             if datahandling == MONSPEC_DATAHANDLING_DEMODATA:
                 perfsignature[resultfield] = 1
             else:
-                # to evaluate the smartscape metrics we query the information from the SmartScape API for all matched enttities
+                # to evaluate the smartscape metrics we count the relationships of all matched entities in the smartscape graph
+                # - but only if all its lists are cached. Downloading the whole topology costs more than querying the matched entities
+                smartscapeMetricDefinition = smartscape.split(":")
+                perfsignature[resultfield] = None
+                if (len(smartscapeMetricDefinition) > 1) and isSmartscapeGraphCached():
+                    try:
+                        smartscapeGraph = getSmartscapeGraph()
+                        smartscapeCounts = [smartscapeGraph.countRelationships(entityId, smartscapeMetricDefinition[0], smartscapeMetricDefinition[1]) for entityId in foundEntities]
+                        if None not in smartscapeCounts:
+                            perfsignature[resultfield] = sum(smartscapeCounts)
+                    except Exception as err:
+                        debugLog("Smartscape graph failed for " + smartscape + ": " + str(err))
+                if perfsignature[resultfield] is not None:
+                    continue
+
+                # no graph or it doesnt know all matched entities - so we query the information from the SmartScape API for all of them
                 perfsignature[resultfield] = 0
 
                 try:
-                    allMatchedEntities = queryEntitiesForMonspecEnvironmentEx(monspec, entitydefname, environmentdefname, "*")
+                    # we only need the relationship list we count, e.g: fromRelationships
+                    allMatchedEntities = queryEntitiesForMonspecEnvironmentEx(monspec, entitydefname, environmentdefname, "*", [smartscape.split(":")[0]])
                 except Exception as err:
                     if datahandling == MONSPEC_DATAHANDLING_NORMAL:
                         raise err
@@ -1067,8 +4166,28 @@ def main():
             doMonspec(doHelp, sys.argv, True)
         elif command == "link":
             doLink(doHelp, sys.argv, True)
+        elif command == "cache":
+            doCache(doHelp, sys.argv, True)
+        elif command == "snapshot":
+            doSnapshot(doHelp, sys.argv, True)
         else :
             doUsage(sys.argv)
+
+        # stale cache entries we served are refreshed and follow-ups prefetched before we exit
+        waitForCacheRefreshes()
+        waitForPrefetches()
+
+        if global_httpSession is not None:
+            debugLog("HTTP connection pool - " + httpConnectionStatisticsAsStr())
+        debugLog("Response memo - " + responseMemoStatisticsAsStr())
+        if global_cacheRefreshStatistics["scheduled"] > 0:
+            debugLog("Background cache refresh - " + cacheRefreshStatisticsAsStr())
+        if global_prefetchStatistics["scheduled"] > 0 or global_prefetchStatistics["overbudget"] > 0:
+            debugLog("Prefetch - " + prefetchStatisticsAsStr())
+        debugLog("Conditional requests - " + revalidationStatisticsAsStr())
+        debugLog("Negative cache - " + negativeCacheStatisticsAsStr())
+        if global_entitySyncStatistics["incremental"] > 0 or global_entitySyncStatistics["full"] > 0:
+            debugLog("Entity sync - " + entitySyncStatisticsAsStr())
     except Exception as e:
         handleException(e)
     exit
@@ -1091,19 +4210,21 @@ def doUsage(args):
     print("Usage: Dynatrace Command Line Interface")
     print("=========================================")
     print("dtcli <command> <options>")
-    print("commands: ent=entities, ts=timerseries, prob=problems, evt=events, dql=Dynatrace Query Language, dqlr=DQL Reporting, tag=tagging, monspec=Monitoring as Code, config")
+    print("commands: ent=entities, ts=timerseries, prob=problems, evt=events, dql=Dynatrace Query Language, dqlr=DQL Reporting, tag=tagging, monspec=Monitoring as Code, cache, snapshot, config")
     print("=========================================")
     print("To configure access token and Dynatrace REST Endpoint use command 'config'")
     print("For more information on a command use: dtcli help <command>")
 
-def doEntity(doHelp, args, doPrint):
+def doEntity(doHelp, args, doPrint, fields=None):
     "Allows you to query information about entities"
+    "fields: in case of result tag * only these fields - and those we filter on - of the entities are returned"
     if doHelp:
         if(doPrint):
             print("dtcli ent <type> <query> <resulttags|*>")
             print("type: app | srv | pg | host | tags")
             print("query: there are different options to query, e.g: by name, wildcards, ...")
             print("query via tag: there are two ways for tag. Either tag=[CONTEXT]KEY:VALUE or tags/CONTEXT:KEY=VALUE")
+            print("query via smartscape: smartscape/fromRelationships|toRelationships:RELATIONSHIP|*[*HOPS]=ENTITYID[,ENTITYID...] returns the entities within HOPS (default 1) hops")
             print("Examples:")
             print("===================")
             print("dtcli ent app .*easyTravel.*")
@@ -1117,6 +4238,8 @@ def doEntity(doHelp, args, doPrint):
             print("dtcli ent srv tag=DeploymentGroup:Staging&tag=ServiceType:Frontend")
             print("dtcli ent app .*easyTravel.* displayName")
             print("dtcli ent srv {tagdef} entityId")
+            print("dtcli ent srv smartscape/fromRelationships:calls*3=APPLICATION-F5E7AEA0AB971DB1 displayName")
+            print("dtcli ent host smartscape/toRelationships:*=PROCESS_GROUP-715E87B8A0A02DB7")
     else:
         entityTypes = ["app","srv","pg","host","pgi"]
         entityEndpoints = [API_ENDPOINT_APPLICATIONS, API_ENDPOINT_SERVICES, API_ENDPOINT_PROCESS_GROUPS, API_ENDPOINT_HOSTS, API_ENDPOINT_PROCESSES]
@@ -1154,18 +4277,61 @@ def doEntity(doHelp, args, doPrint):
                     queryString = args[3]
                     args[3] = None
 
-            # execute our query - potentially with a queryString that contains ?tag=
-            jsonContent = queryDynatraceAPI(True, apiEndpoint, queryString, "")
             resultTag = "entityId"
-
-            # see if there is any other filter specified
+            nameValue = None
             if len(args) > 3:
                 nameValue = parseNameValue(args[3], "displayName", "")
                 if(len(args) > 4):
                     resultTag = args[4]
-                elements = jsonFindValuesByKey(jsonContent, nameValue.name, nameValue.value, resultTag)
+
+            # a traversal like smartscape/fromRelationships:calls*3=APPLICATION-1234 is answered from the smartscape graph
+            traversal = parseSmartscapeTraversal(nameValue)
+            if traversal is not None:
+                elements = traverseSmartscape(apiEndpoint, traversal, resultTag, fields)
+                if(doPrint):
+                    print(elements)
+                return elements
+
+            # lets have the API do as much of the filtering as it can. We still apply the full filter to what it returns
+            projection = getEntityProjection(nameValue, resultTag, fields)
+            queryPlan = getEntityQueryPlan(apiEndpoint, queryString, nameValue, projection)
+            queryString = queryPlan.queryString
+            debugLog("Entity query plan - " + queryPlan.toString())
+
+            if nameValue is not None:
+                filterName = nameValue.name
+                filterValue = nameValue.value
             else:
-                elements = jsonFindValuesByKey(jsonContent, "displayName", None, resultTag)
+                filterName = "displayName"
+                filterValue = None
+
+            # a list the cache stored line by line doesnt have to be loaded: we seek right to the entities we look for by id - or filter it line by line
+            entityIds = getEntityIdLookup(nameValue)
+            entityLines = None
+            if (entityIds is not None) or (projection is None):
+                entityLines = lookupEntityLines(apiEndpoint, queryString)
+
+            if (entityLines is not None) and (entityIds is not None) and entityLines[1]["plainEntityIds"]:
+                elements = jsonFindValuesByKey(readCachedEntities(entityLines[0], entityLines[1], entityIds), filterName, filterValue, resultTag)
+            elif entityLines is not None:
+                elements = streamFindValuesByKey(streamCachedEntities(entityLines[0]), filterName, filterValue, resultTag)
+            else:
+                # execute our query - potentially with a queryString that contains ?tag= or ?entity=. We only keep the fields we need
+                if projection is None:
+                    jsonContent = queryDynatraceAPI(True, apiEndpoint, queryString, "")
+                else:
+                    jsonContent = queryEntitiesProjected(apiEndpoint, queryString, projection)
+
+                # if there is a filter lets try to answer it from the entity index. Only if that doesnt work we have to scan the whole list
+                elements = None
+                if nameValue is not None:
+                    entityIndex = getEntityIndex(apiEndpoint, queryString, jsonContent, projection)
+                    if entityIndex is not None:
+                        elements = entityIndex.findValuesByKey(filterName, filterValue, resultTag)
+                if elements is None and isinstance(jsonContent, CompactEntityList):
+                    elements = streamFindValuesByKey(jsonContent, filterName, filterValue, resultTag)
+                elif elements is None:
+                    elements = jsonFindValuesByKey(jsonContent, filterName, filterValue, resultTag)
 
             if(doPrint):
                 print(elements)
@@ -1180,7 +4346,7 @@ def doTimeseries(doHelp, args, doPrint):
             print("dtcli ts <action> <options>")
             print("action: list | query | push")
             print("options for list: [*name*] [return key]")
-            print("options for query: [tsid1,tsid2,...] ([entid1,entid2,...])")
+            print("options for query: [tsid1,tsid2,...] ([entid1,entid2,...]) - tsid[aggregation%timeframe%total] returns one total per entity over the timeframe")
             print("options for push: TODO")
             print("Examples:")
             print("===================")
@@ -1200,6 +4366,7 @@ def doTimeseries(doHelp, args, doPrint):
             print("dtcli ts query com.dynatrace.builtin:appmethod.useractionsperminute[count%2hour] APPMETHOD-ENTITY")
             print("dtcli ts query com.dynatrace.builtin:appmethod.useractionsperminute[count%120:60] APPMETHOD-ENTITY")
             print("dtcli ts query com.dynatrace.builtin:appmethod.useractionsperminute[count%custDeployEvent] APPMETHOD-ENTITY,APPMETHOD-ENTITY2")
+            print("dtcli ts query com.dynatrace.builtin:service.responsetime[avg%hour%total] SERVICE-ENTITY")
     else:
         actionTypes = ["list","query","push","describe","queryent"]
         action = None
@@ -1213,7 +4380,7 @@ def doTimeseries(doHelp, args, doPrint):
             # lets check our special token params
             doCheckTempConfigParams(args, 5)
 
-            jsonContent = queryDynatraceAPI(True, API_ENDPOINT_TIMESERIES, "", "")
+            catalog = getTimeseriesCatalog()
             returnKey = "timeseriesId"
             matchValue = None
             matchKeyName = "displayName"
@@ -1224,7 +4391,10 @@ def doTimeseries(doHelp, args, doPrint):
                 matchValue = nameValue.value
                 matchKeyName = nameValue.name
 
-            elements = jsonFindValuesByKey(jsonContent, matchKeyName, matchValue, returnKey)
+            # lets try to answer it from the catalog index. Only if that doesnt work we have to walk through the whole list
+            elements = catalog.findValuesByKey(matchKeyName, matchValue, returnKey)
+            if elements is None:
+                elements = jsonFindValuesByKey(catalog.timeseriesList, matchKeyName, matchValue, returnKey)
             print(elements)
         elif action == 1 or action == 4: # query or queryent
             # lets check our special token params
@@ -1233,12 +4403,13 @@ def doTimeseries(doHelp, args, doPrint):
             # build the query string for the timeseries id
             entities = None
             if(len(args) > 4):
-                entities = args[4].split(",")
+                entities = [entity for entity in args[4].split(",") if len(entity) > 0]
             if(len(args) > 3):
                 timeseriesId = args[3]
                 aggregation = "avg"
                 timeframe = "hour"
                 percentile = None
+                queryMode = TIMESERIES_QUERYMODE_SERIES
 
                 # "Allowed strings are: justtimeseries, timeseries[aggregagtion],, timeseries[aggregation%timeframe], timeseries[aggregation%timeframe1:timeframe2]"
                 # For aggregation we allow avg,min,max, ... as well as pXX where this means Percentile XX
@@ -1255,7 +4426,13 @@ def doTimeseries(doHelp, args, doPrint):
                             percentile = aggregation[1:]
                             aggregation = "percentile";
                     if(len(configParts[2]) > 0):
-                        timeframe = configParts[2]
+                        timeframeParts = configParts[2].partition("%")
+                        if(len(timeframeParts[0]) > 0):
+                            timeframe = timeframeParts[0]
+                        if(len(timeframeParts[2]) > 0):
+                            queryMode = timeframeParts[2]
+                            if not operator.contains(TIMESERIES_QUERYMODES, queryMode):
+                                raise Exception("Error", "queryMode " + queryMode + " not supported. Use " + " or ".join(TIMESERIES_QUERYMODES))
 
                 # check what the timeframe parameter is
                 timeframedef = TimeframeDef(timeframe)
@@ -1275,7 +4452,18 @@ def doTimeseries(doHelp, args, doPrint):
                 aggregationQueryString = "&aggregationType=" + aggregation.lower();
                 if (percentile is not None) :
                     aggregationQueryString += "&percentile=" + percentile;
-                jsonContent = queryDynatraceAPI(True, API_ENDPOINT_TIMESERIES, "timeseriesId=" + timeseriesId + timeframedef.queryString + aggregationQueryString, "")
+                queryString = "timeseriesId=" + timeseriesId + timeframedef.queryString + aggregationQueryString
+                if (action == 1) and (entities is not None) and (len(entities) == 0):
+                    # we were asked for no entity at all, e.g: by a monspec environment without matching entities - nothing to ask the API for
+                    if doPrint:
+                        print({})
+                    return {}
+                if queryMode == TIMESERIES_QUERYMODE_TOTAL:
+                    jsonContent = queryTimeseriesTotals(queryString, entities if action == 1 else None, aggregation.lower())
+                elif action == 1: # query - only for the entities we need
+                    jsonContent = queryTimeseriesForEntities(queryString, entities)
+                else:
+                    jsonContent = queryDynatraceAPI(True, API_ENDPOINT_TIMESERIES, queryString, "")
 
                 # We got our jsonContent - now we need to return the data for all Entities or the specific entities that got passed to us
                 jsonContentResult = jsonContent["result"]
@@ -1314,12 +4502,11 @@ def doTimeseries(doHelp, args, doPrint):
                 if(timeseriesId.find(":") <= 0):
                     timeseriesId = "com.dynatrace.builtin:" + timeseriesId
 
-                jsonContent = queryDynatraceAPI(True, API_ENDPOINT_TIMESERIES, "", "")
-                for timeseries in jsonContent:
-                    if(timeseries["timeseriesId"] == timeseriesId):
-                        if doPrint:
-                            print(timeseries)
-                        return timeseries
+                timeseries = getTimeseriesCatalog().describe(timeseriesId)
+                if timeseries is not None:
+                    if doPrint:
+                        print(timeseries)
+                    return timeseries
             else:
                 doTimeseries(True, args, doPrint)
         else:
@@ -1343,7 +4530,21 @@ def doConfig(doHelp, args):
         print("apitoken <dynatracetoken>")
         print("tenanthost <yourdynatraceserver.domain>")
         print("cacheupdate -1 (only use cache), 0 (=never use cache), X (=update cache in X Minutes)")
+        print("cachestale <seconds after cacheupdate a cached query is still used while it gets refreshed in the background>, 0 (=refresh right away)")
+        print("cachenegative <seconds API errors (4xx) of a query are remembered>, 0 (=turned off)")
+        print("cachepolicy <regex on endpoint?querystring>=<-1|0|seconds|resolution>: TTL for matching queries instead of cacheupdate - even instead of 0. <regex>= removes the policy")
+        print("prefetch 1 (=learn and prefetch likely follow-up queries in the background) or 0, prefetchconcurrency <number of prefetch API calls in flight>, prefetchbytes <bytes prefetched per run>")
+        print("timealign <seconds relative timeframes in minutes are rounded down to, so repeated or warmed queries hit the cache - e.g: 60 together with cache warm>, 0 (=no rounding)")
         print("cachedir <yourlocalcachedirectory>")
+        print("cachebackend file (=one JSON file per query) or sqlite (=single SQLite file in cachedir), cachecompress 1 (=zlib compress sqlite entries) or 0")
+        print("cacheencoding json (=one JSON document per query) or ndjson (=file cache stores entity lists with one entity per line, so they can be filtered line by line)")
+        print("cachesize <bytes of cached queries per tenant before the least recently used get evicted>, 0 (=no limit)")
+        print("poolsize <number of pooled HTTP connections>, keepalive 1 (=reuse connections) or 0")
+        print("connecttimeout <seconds>, readtimeout <seconds>: hard timeouts for every call to the Dynatrace API")
+        print("concurrency <number of API calls in flight at the same time>, 1 (=strictly serial)")
+        print("memocache <bytes of API responses kept in memory while running a command>, 0 (=turned off)")
+        print("entitysync <seconds between full downloads of an entity list - in between only entities seen since the last sync are fetched and merged>, 0 (=always full download)")
+        print("entitymodel dict (=keep entity lists as JSON objects) or compact (=slotted records with shared strings, much less memory for large tenants)")
         print("revert: will revert to local cache setting")
         print("Examples")
         print("==============")
@@ -1351,8 +4552,11 @@ def doConfig(doHelp, args):
         print("==============")
         print("Current Dynatrace Tenant: " + config["tenanthost"])
         print("Current API Token: xxxxxxxxxx")
-        print("Current Cacheupdate: " + str(config["cacheupdate"]))
+        print("Current Cacheupdate: " + str(config["cacheupdate"]) + ", cachestale " + str(getConfigValue("cachestale")))
         print("Current cachedir: " + getAttributeOrDefault(config, "cachedir", ""))
+        print("Current cachepolicy: " + json.dumps(getConfigValue("cachepolicy")))
+        print("Current cachebackend: " + str(getConfigValue("cachebackend")) + ", cacheencoding " + str(getConfigValue("cacheencoding")) + ", cachesize " + str(getConfigValue("cachesize")))
+        print("Current HTTP pool: poolsize " + str(getConfigValue("poolsize")) + ", keepalive " + str(getConfigValue("keepalive")) + ", connecttimeout " + str(getConfigValue("connecttimeout")) + ", readtimeout " + str(getConfigValue("readtimeout")) + ", concurrency " + str(getConfigValue("concurrency")))
     else:
         # global config
         i = 2
@@ -1367,8 +4571,38 @@ def doConfig(doHelp, args):
                 config["cacheupdate"] = int(configValue)
             elif configName == "cachedir":
                 config["cachedir"] = configValue
+            elif configName == "cachebackend":
+                if configValue != CACHE_BACKEND_FILE and configValue != CACHE_BACKEND_SQLITE:
+                    raise Exception("Error", "Cache backend '" + configValue + "' not supported. Use " + CACHE_BACKEND_FILE + " or " + CACHE_BACKEND_SQLITE)
+                config["cachebackend"] = configValue
+            elif configName == "cachepolicy":
+                cachePolicy = dict(getConfigValue("cachepolicy"))
+                policyPattern, separator, policyTtl = configValue.rpartition("=")
+                if separator == "" or policyPattern == "":
+                    raise Exception("Error", "cachepolicy needs to be <regex>=<ttl>, e.g: /api/v1/entity/infrastructure/process-groups=3600")
+                if policyTtl == "":
+                    cachePolicy.pop(policyPattern, None)
+                elif policyTtl == CACHE_TTL_RESOLUTION:
+                    cachePolicy[policyPattern] = policyTtl
+                else:
+                    cachePolicy[policyPattern] = int(policyTtl)
+                config["cachepolicy"] = cachePolicy
+            elif configName == "cachecompress":
+                config["cachecompress"] = int(configValue)
+            elif configName == "entitymodel":
+                if configValue != ENTITY_MODEL_DICT and configValue != ENTITY_MODEL_COMPACT:
+                    raise Exception("Error", "Entity model '" + configValue + "' not supported. Use " + ENTITY_MODEL_DICT + " or " + ENTITY_MODEL_COMPACT)
+                config["entitymodel"] = configValue
+            elif configName == "cacheencoding":
+                if configValue != CACHE_ENCODING_JSON and configValue != CACHE_ENCODING_NDJSON:
+                    raise Exception("Error", "Cache encoding '" + configValue + "' not supported. Use " + CACHE_ENCODING_JSON + " or " + CACHE_ENCODING_NDJSON)
+                config["cacheencoding"] = configValue
             elif configName == "debug":
                 config["debug"] = int(configValue)
+            elif configName == "poolsize" or configName == "keepalive" or configName == "concurrency" or configName == "memocache" or configName == "cachesize" or configName == "cachestale" or configName == "cachenegative" or configName == "timealign" or configName == "prefetch" or configName == "prefetchconcurrency" or configName == "prefetchbytes" or configName == "entitysync":
+                config[configName] = int(configValue)
+            elif configName == "connecttimeout" or configName == "readtimeout":
+                config[configName] = float(configValue)
             else:
                 print("Configuration element '" + configName + "' not valid")
                 doConfig(True, args)
@@ -1386,7 +4620,243 @@ def doCheckTempConfigParams(args, argIndex):
     if(len(args) > argIndex+2):
         config["cacheupdate"] = int(args[argIndex+2])
     if(len(args) > argIndex+3):
-        config["cachedir"] = int(args[argIndex+3])
+        config["cachedir"] = args[argIndex+3]
+
+def getMonspecWarmEnvironments(monspec, timeshift):
+    "Returns the list of (entitydefname, environmentdefname, timeshift) a pipeline will pull for that monspec: every environment with the passed timeshift plus source & compare of every comparison with their configured shift"
+    warmEnvironments = []
+    for entitydefname in monspec:
+        for environmentdefname in monspec[entitydefname]["environments"]:
+            warmEnvironments.append((entitydefname, environmentdefname, timeshift))
+        comparisons = getAttributeOrNone(monspec[entitydefname], "comparisons")
+        if comparisons is not None:
+            for compareDef in comparisons:
+                warmEnvironments.append((entitydefname, compareDef[MONSPEC_PERFSIGNATURE_SOURCE], str(compareDef["shiftsourcetimeframe"])))
+                warmEnvironments.append((entitydefname, compareDef[MONSPEC_PERFSIGNATURE_COMPARE], str(compareDef["shiftcomparetimeframe"])))
+
+    # lets remove duplicates but keep the order
+    return list(collections.OrderedDict.fromkeys(warmEnvironments))
+
+def warmCacheForMonspec(monspecfile, timespan, timeshift):
+    "Prefetches every API request that pull, pullcompare and the smartscape metrics of the monspec would make into the cache"
+    "Returns: (number of warmed queries, list of failed queries)"
+
+    # parsing the monspec with metadata already queries the timeseries definitions
+    monspec = parseMonspec(monspecfile, True)
+    warmEnvironments = getMonspecWarmEnvironments(monspec, timeshift)
+
+    # 1: lets query the entities of all environments concurrently
+    entityEnvironments = list(collections.OrderedDict.fromkeys([(warmEnvironment[0], warmEnvironment[1]) for warmEnvironment in warmEnvironments]))
+    entityQueries = [(queryEntitiesForMonspecEnvironment, (monspec, entityEnvironment[0], entityEnvironment[1])) for entityEnvironment in entityEnvironments]
+    entityResults = runConcurrently(entityQueries, True)
+
+    warmed = len(entityQueries)
+    failed = []
+    foundEntitiesPerEnvironment = {}
+    for entityEnvironment, entityResult in zip(entityEnvironments, entityResults):
+        if isinstance(entityResult, Exception) or entityResult is None:
+            failed.append(entityEnvironment[0] + "/" + entityEnvironment[1] + ": " + str(entityResult))
+        else:
+            foundEntitiesPerEnvironment[entityEnvironment] = entityResult
+
+    # the smartscape metrics count the relationships of those entities in the smartscape graph
+    smartscapeEntityDefs = [entityDefName for entityDefName in collections.OrderedDict.fromkeys([warmEnvironment[0] for warmEnvironment in warmEnvironments])
+                            if any(getAttributeOrNone(perfsignature, MONSPEC_PERFSIGNATURE_SMARTSCAPE) is not None for perfsignature in monspec[entityDefName][MONSPEC_PERFSIGNATURE])]
+    if len(smartscapeEntityDefs) > 0:
+        warmed += 1
+        try:
+            getSmartscapeGraph()
+        except Exception as err:
+            failed.append("smartscape graph: " + str(err))
+
+    # 2: now we build exactly the timeseries queries pullMonspecMetrics would execute and run them all concurrently
+    timeseriesQueryNames = []
+    timeseriesQueries = []
+    for warmEnvironment in warmEnvironments:
+        foundEntities = getAttributeOrNone(foundEntitiesPerEnvironment, (warmEnvironment[0], warmEnvironment[1]))
+        if foundEntities is None:
+            continue
+        for perfsignature in monspec[warmEnvironment[0]][MONSPEC_PERFSIGNATURE]:
+            timeseries = getAttributeOrNone(perfsignature, MONSPEC_PERFSIGNATURE_TIMESERIES)
+            if(timeseries is not None) :
+                timeseriesForQuery = getMonspecTimeseriesQuery(perfsignature, timespan, warmEnvironment[2], foundEntities)
+                timeseriesQueryNames.append(warmEnvironment[0] + "/" + warmEnvironment[1] + ": " + timeseriesForQuery)
+                timeseriesQueries.append((doTimeseries, (False, ["dtcli", "ts", "query", timeseriesForQuery, arrayToStringList(foundEntities)], False)))
+
+    warmed += len(timeseriesQueries)
+    for queryName, timeseriesResult in zip(timeseriesQueryNames, runConcurrently(timeseriesQueries, True)):
+        if isinstance(timeseriesResult, Exception):
+            failed.append(queryName + ": " + str(timeseriesResult))
+
+    return warmed, failed
+
+def warmCacheForDQLFile(dqlfile):
+    "Prefetches the API requests of every DQL query in that file into the cache. One query per line, e.g: host .*demo.* host.cpu.system[max%hour]"
+    "Empty lines and lines starting with # are ignored. The leading dtcli dql is optional"
+    "Returns: (number of warmed queries, list of failed queries)"
+    dqlQueries = []
+    with open(dqlfile) as dqlLines:
+        for dqlLine in dqlLines:
+            dqlLine = dqlLine.strip()
+            if len(dqlLine) == 0 or dqlLine.startswith("#"):
+                continue
+            dqlArgs = shlex.split(dqlLine)
+            if len(dqlArgs) > 0 and dqlArgs[0] == "dtcli":
+                dqlArgs = dqlArgs[1:]
+            if len(dqlArgs) > 0 and dqlArgs[0] == "dql":
+                dqlArgs = dqlArgs[1:]
+            dqlQueries.append((dqlLine, ["dtcli", "dql"] + dqlArgs))
+
+    failed = []
+    dqlResults = runConcurrently([(doDQL, (False, dqlQuery[1], False)) for dqlQuery in dqlQueries], True)
+    for dqlQuery, dqlResult in zip(dqlQueries, dqlResults):
+        if isinstance(dqlResult, Exception):
+            failed.append(dqlQuery[0] + ": " + str(dqlResult))
+
+    return len(dqlQueries), failed
+
+def doCache(doHelp, args, doPrint):
+    "Allows you to manage the local cache of API responses"
+    if doHelp:
+        if(doPrint):
+            print("dtcli cache <action> <options>")
+            print("action: migrate | expire | stats | prune | warm")
+            print("options for migrate: [sourcedir] [tenanthost] - imports a file cache directory with the old layout, e.g: smpljson, into the configured cachebackend")
+            print("options for expire: <seconds> - removes all cached queries of the current tenant that are older than that. Cache directories with the old layout are left alone")
+            print("options for stats: [all] - entries, bytes, hit/miss ratio, largest endpoints and - with prefetch - prefetch hit ratio of the current tenant or of all tenants in the cache")
+            print("options for prune: [bytes] - removes the least recently used queries of the current tenant until it is within bytes. Default is cachesize")
+            print("options for warm: monspec <monspecfile> [timespan] [timeshift] | dql <dqlfile> - prefetches every query of a monspec pull/pullcompare or of a file with one DQL query per line concurrently into the cache. Default timespan is 60, timeshift 0")
+            print("Examples:")
+            print("===================")
+            print("dtcli config cachebackend sqlite")
+            print("dtcli cache migrate")
+            print("dtcli cache migrate smpljson")
+            print("dtcli cache migrate /olddtclicache/abc12345_live_dynatrace_com abc12345.live.dynatrace.com")
+            print("dtcli cache expire 86400")
+            print("dtcli cache stats")
+            print("dtcli cache stats all")
+            print("dtcli cache prune 104857600")
+            print("dtcli cache warm monspec monspec/monspec.json")
+            print("dtcli cache warm monspec monspec/monspec.json 60 0")
+            print("dtcli cache warm dql pipeline.dql")
+    else:
+        actionTypes = ["migrate", "expire", "stats", "prune", "warm"]
+        if (len(args) <= 2) or not operator.contains(actionTypes, args[2]):
+            # Didnt provide the correct parameters - show help!
+            doCache(True, args, doPrint)
+            return None
+
+        action = args[2]
+        cacheBackend = getCacheBackend()
+        result = {"cachebackend" : cacheBackend.name}
+        if action == "migrate":
+            # default is the file cache directory of the current tenant - and the tenant is the name of the directory
+            sourceDirectory = getCacheDirectory() + getCacheTenant()
+            if len(args) > 3:
+                sourceDirectory = args[3]
+            tenant = os.path.basename(os.path.normpath(sourceDirectory))
+            if len(args) > 4:
+                tenant = args[4].replace("https://","").replace(".", "_")
+            if not os.path.isdir(sourceDirectory):
+                raise Exception("Error", "Cache directory " + sourceDirectory + " doesnt exist")
+
+            result["tenant"] = tenant
+            result["migrated"] = cacheBackend.migrate(tenant, sourceDirectory)
+        elif action == "expire":
+            if len(args) <= 3 or not isNumeric(args[3]):
+                doCache(True, args, doPrint)
+                return None
+            result["tenant"] = getCacheTenant()
+            result["expired"] = cacheBackend.removeExpired(getCacheTenant(), time.time() - int(args[3]))
+        elif action == "stats":
+            tenants = [getCacheTenant()]
+            if len(args) > 3 and args[3] == "all":
+                tenants = cacheBackend.getTenants()
+            result["tenants"] = [cacheBackend.getStatistics(tenant) for tenant in tenants]
+            for tenantStatistics in result["tenants"]:
+                prefetchStatistics = getPrefetchStatistics(tenantStatistics["tenant"])
+                if prefetchStatistics is not None:
+                    tenantStatistics.update(prefetchStatistics)
+        elif action == "prune":
+            maxBytes = int(getConfigValue("cachesize"))
+            if len(args) > 3:
+                if not isNumeric(args[3]):
+                    doCache(True, args, doPrint)
+                    return None
+                maxBytes = int(args[3])
+            result["tenant"] = getCacheTenant()
+            result["pruned"] = cacheBackend.prune(getCacheTenant(), maxBytes)
+            result["bytes"] = cacheBackend.getTotalBytes(getCacheTenant())
+        elif action == "warm":
+            if len(args) <= 4 or not operator.contains(["monspec", "dql"], args[3]):
+                doCache(True, args, doPrint)
+                return None
+            if not os.path.isfile(args[4]):
+                raise Exception("Error", "File " + args[4] + " doesnt exist")
+
+            result["tenant"] = getCacheTenant()
+            if args[3] == "monspec":
+                timespan = "60"
+                timeshift = "0"
+                if len(args) > 5:
+                    timespan = args[5]
+                if len(args) > 6:
+                    timeshift = args[6]
+                warmed, failed = warmCacheForMonspec(args[4], timespan, timeshift)
+            else:
+                warmed, failed = warmCacheForDQLFile(args[4])
+            result["warmed"] = warmed
+            result["failed"] = failed
+
+        if doPrint:
+            print(result)
+        return result
+
+    return None
+
+def doSnapshot(doHelp, args, doPrint):
+    "Allows you to export the cached queries of a tenant into a single snapshot archive and to import such an archive for offline use"
+    if doHelp:
+        if(doPrint):
+            print("dtcli snapshot <action> <options>")
+            print("action: export | import")
+            print("options for export: <snapshotfile> [tenanthost] - packs all cached queries of the current tenant or of tenanthost into one compressed, indexed archive")
+            print("options for import: <snapshotfile> [tenanthost] - installs the archive as <cachedir>/<tenant>.dtsnap. Queries are read straight from it without unpacking. Default tenant is the one it was exported from")
+            print("Examples:")
+            print("===================")
+            print("dtcli snapshot export abc12345.dtsnap")
+            print("dtcli snapshot export smpljson.dtsnap smpljson")
+            print("dtcli snapshot import abc12345.dtsnap")
+            print("dtcli snapshot import abc12345.dtsnap smpljson")
+            print("dtcli config tenanthost abc12345.live.dynatrace.com cacheupdate -1")
+    else:
+        actionTypes = ["export", "import"]
+        if (len(args) <= 3) or not operator.contains(actionTypes, args[2]):
+            # Didnt provide the correct parameters - show help!
+            doSnapshot(True, args, doPrint)
+            return None
+
+        action = args[2]
+        tenant = None
+        if len(args) > 4:
+            tenant = args[4].replace("https://","").replace(".", "_")
+
+        result = {"snapshot" : args[3]}
+        if action == "export":
+            if tenant is None:
+                tenant = getCacheTenant()
+            result["tenant"] = tenant
+            result["exported"] = exportCacheSnapshot(args[3], tenant)
+        elif action == "import":
+            if not os.path.isfile(args[3]):
+                raise Exception("Error", "Snapshot " + args[3] + " doesnt exist")
+            result["tenant"], result["imported"] = importCacheSnapshot(args[3], tenant)
+
+        if doPrint:
+            print(result)
+        return result
+
+    return None
 
 def doDQLReport(doHelp, args, doPrint):
     "Simliar to DQL but DQLR will generate an HTML Report for eachi timeseries"
@@ -1435,12 +4905,12 @@ def doDQLReport(doHelp, args, doPrint):
             # now we simply take the data points and put them into our highchart object
             seriesEntryForReport = { "name" : entityDisplayName, "data" : []}
             for dataPoint in dataPoints:
-                # lets do some conversion from timestamp to actual time and replace None with null
+                # lets do some conversion from timestamp to actual time and replace None with null. NOTE: we must not change the data points we got from the query
                 dt = datetime.datetime.fromtimestamp(dataPoint[0]/1000)
-                dataPoint[0] = str(dt)
-                if dataPoint[1] is None:
-                    dataPoint[1] = "NULL"
-                seriesEntryForReport["data"].append(dataPoint)
+                dataPointValue = dataPoint[1]
+                if dataPointValue is None:
+                    dataPointValue = "NULL"
+                seriesEntryForReport["data"].append([str(dt), dataPointValue])
 
             seriesListForReport.append(seriesEntryForReport)
             allSeriesForReport[timeseriesName] = seriesListForReport
@@ -1519,11 +4989,15 @@ def doDQL(doHelp, args, doPrint):
             allTimeseries = args[4].split(",")
             appMethodEntityMatch = re.compile(args[3])
             resultTimeseries = []
+            timeseriesQueries = []
             for timeseries in allTimeseries:
                 beginBracket = timeseries.find("[")
                 if(timeseries.find(":", None, beginBracket) <= 0):
                     timeseries = "com.dynatrace.builtin:" + timeseries
-                resultTimeseriesForEntity = doTimeseries(False, ["dtcli", "ts", "query", timeseries], False)
+                timeseriesQueries.append((doTimeseries, (False, ["dtcli", "ts", "query", timeseries], False)))
+
+            # lets query all timeseries concurrently
+            for resultTimeseriesForEntity in runConcurrently(timeseriesQueries):
                 for timeseriesEntry in resultTimeseriesForEntity:
                     if appMethodEntityMatch.match(resultTimeseriesForEntity[timeseriesEntry]["entityDisplayName"]):
                         resultTimeseries.append({ timeseriesEntry : resultTimeseriesForEntity[timeseriesEntry]})
@@ -1538,15 +5012,43 @@ def doDQL(doHelp, args, doPrint):
             if(resultEntities is None):
                 if doPrint:
                     print("No entities returned for that query")
-            else:
+            elif len(resultEntities) > 0:
+                # lets build our query plan: the timeseries API returns the data points of all entities in a single call
+                # so we query every distinct timeseries[aggr%timeframe] exactly once for all matched entities and fan the result out per entity
+                allTimeseries = []
+                distinctTimeseries = []
+                for timeseries in args[4].split(","):
+                    if(timeseries.find(":") <= 0):
+                        timeseries = "com.dynatrace.builtin:" + timeseries
+                    allTimeseries.append(timeseries)
+                    if not operator.contains(distinctTimeseries, timeseries):
+                        distinctTimeseries.append(timeseries)
+
+                debugLog("DQL plan: " + str(len(distinctTimeseries)) + " timeseries queries for " + str(len(resultEntities)) + " entities: " + str(distinctTimeseries))
+
+                # dtcli ts query com.dynatrace.builtin:appmethod.useractionsperminute[count%hour] APP-ENTITY1,APP-ENTITY2
+                timeseriesQueries = []
+                for timeseries in distinctTimeseries:
+                    timeseriesQueries.append((doTimeseries, (False, ["dtcli", "ts", "query", timeseries, arrayToStringList(resultEntities)], False)))
+                timeseriesResults = runConcurrently(timeseriesQueries)
+
+                # now we fan out the results in the same order and format as querying each entity and timeseries individually
+                handedOutResults = set()
                 for entity in resultEntities:
-                    # dtcli ts query com.dynatrace.builtin:appmethod.useractionsperminute[count%hour] APP-ENTITY
-                    allTimeseries = args[4].split(",")
                     for timeseries in allTimeseries:
-                        beginBracket = timeseries.find("[")
-                        if(timeseries.find(":") <= 0):
-                            timeseries = "com.dynatrace.builtin:" + timeseries
-                        resultTimeseriesForEntity = doTimeseries(False, ["dtcli", "ts", "query", timeseries, entity], False)
+                        timeseriesResult = timeseriesResults[operator.indexOf(distinctTimeseries, timeseries)]
+                        if timeseriesResult is None:
+                            resultTimeseries.append(None)
+                            continue
+
+                        resultTimeseriesForEntity = {}
+                        if entity in timeseriesResult:
+                            # every entry in our result has to be its own object, e.g: doDQLReport changes the data points
+                            if (entity, timeseries) in handedOutResults:
+                                resultTimeseriesForEntity[entity] = copy.deepcopy(timeseriesResult[entity])
+                            else:
+                                resultTimeseriesForEntity[entity] = timeseriesResult[entity]
+                                handedOutResults.add((entity, timeseries))
                         resultTimeseries.append(resultTimeseriesForEntity)
 
             if doPrint:
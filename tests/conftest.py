@@ -0,0 +1,106 @@
+# shared fixtures: a freshly loaded dtcli with its cache in a temp directory and a fake Dynatrace tenant instead of the real API
+import os
+import sys
+import json
+import importlib
+import urllib.parse
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_TENANT = "abc12345.live.dynatrace.com"
+SMPLJSON_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smpljson")
+
+class FakeResponse:
+    "Just enough of requests.Response for dtcli"
+    def __init__(self, statusCode, body=None, headers=None):
+        self.status_code = statusCode
+        self.ok = statusCode < 400
+        self.text = body if isinstance(body, str) else ("" if body is None else json.dumps(body))
+        self.content = self.text.encode("utf-8")
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+
+class FakeTenant:
+    "Stands in for sendDynatraceAPIRequest: answers from routes and records every request"
+    "routes: <endpoint> or <endpoint>?<querystring> -> FakeResponse, body or function(httpMethod, apiEndpoint, queryString, headers) returning either"
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+
+    def send(self, httpMethod, apiEndpoint, queryString, postBody, additionalHeaders=None):
+        self.requests.append((httpMethod, apiEndpoint, queryString, dict(additionalHeaders or {})))
+        route = self.routes.get(apiEndpoint + "?" + queryString, self.routes.get(apiEndpoint))
+        if callable(route):
+            route = route(httpMethod, apiEndpoint, queryString, additionalHeaders or {})
+        if route is None:
+            return FakeResponse(404, {"error" : {"code" : 404, "message" : "not found " + apiEndpoint}})
+        if isinstance(route, FakeResponse):
+            return route
+        return FakeResponse(200, route)
+
+    def queries(self, apiEndpoint=None):
+        "Returns the query strings of all requests - of that endpoint only if given"
+        return [request[2] for request in self.requests if apiEndpoint is None or request[1] == apiEndpoint]
+
+@pytest.fixture
+def dtcli(tmp_path, monkeypatch):
+    "dtcli reloaded - so no state leaks from other tests - talking to our fake tenant with its cache in tmp_path"
+    import dtcli as dtcliModule
+    dtcliModule = importlib.reload(dtcliModule)
+    dtcliModule.dtconfigfilename = str(tmp_path / "dtconfig.json")
+    dtcliModule.config.update({"tenanthost" : TEST_TENANT, "apitoken" : "testtoken", "cacheupdate" : 0, "cachedir" : str(tmp_path / "cache"), "debug" : 0})
+    fakeTenant = FakeTenant()
+    fakeTenant.originalSend = dtcliModule.sendDynatraceAPIRequest
+    monkeypatch.setattr(dtcliModule, "sendDynatraceAPIRequest", fakeTenant.send)
+    dtcliModule.fakeTenant = fakeTenant
+    yield dtcliModule
+    dtcliModule.waitForCacheRefreshes()
+    dtcliModule.flushCacheBackends()
+
+@pytest.fixture
+def fakeTenant(dtcli):
+    return dtcli.fakeTenant
+
+def makeEntity(entityId, displayName, tags=None, **properties):
+    "Returns an entity like the v1 entity API does"
+    entity = {"entityId" : entityId, "displayName" : displayName, "discoveredName" : displayName, "firstSeenTimestamp" : 1500000000000, "lastSeenTimestamp" : 1500000600000,
+              "tags" : tags or [], "fromRelationships" : {}, "toRelationships" : {}}
+    entity.update(properties)
+    return entity
+
+def makeTag(key, value=None, context="CONTEXTLESS"):
+    tag = {"context" : context, "key" : key}
+    if value is not None:
+        tag["value"] = value
+    return tag
+
+def makeTimeseriesResult(timeseriesId, dataPoints, aggregationType="AVG", resolution=60000):
+    "Returns a v1 timeseries query response. dataPoints: entityId -> [[timestamp, value], ...]"
+    return {"result" : {"timeseriesId" : timeseriesId, "dataPoints" : dataPoints, "entities" : {entityId : entityId + " name" for entityId in dataPoints},
+                        "unit" : "MicroSecond (us)", "aggregationType" : aggregationType, "resolutionInMillisUTC" : resolution}}
+
+def makeTimeseriesRoute(dataPointsByTimeseries, rejectTotals=False):
+    "Returns a route for the timeseries endpoint that - like the API - only returns the series of the entity= parameters, if any"
+    "dataPointsByTimeseries: timeseriesId -> entityId -> data points. With queryMode=total every entity gets one data point with the average"
+    def route(httpMethod, apiEndpoint, queryString, headers):
+        parameters = urllib.parse.parse_qs(queryString)
+        dataPoints = dataPointsByTimeseries[parameters["timeseriesId"][0]]
+        if "entity" in parameters:
+            dataPoints = {entityId : dataPoints[entityId] for entityId in parameters["entity"] if entityId in dataPoints}
+        if parameters.get("queryMode") == ["total"]:
+            if rejectTotals:
+                return FakeResponse(400, {"error" : {"code" : 400, "message" : "queryMode total not supported"}})
+            dataPoints = {entityId : [[points[-1][0], sum([point[1] for point in points]) / len(points)]] for entityId, points in dataPoints.items()}
+        return makeTimeseriesResult(parameters["timeseriesId"][0], dataPoints)
+    return route
+
+def getSampleEntities():
+    "Returns the services of our smpljson demo data plus a few hosts with tags, lists and relationships"
+    with open(os.path.join(SMPLJSON_DIRECTORY, "_api_v1_entity_services.json"), encoding="latin-1") as servicesFile:
+        entities = json.load(servicesFile)
+    return entities + [
+        makeEntity("HOST-1", "et-demo-1", [makeTag("Name", "et-demo-1", "AWS"), makeTag("Environment", "Staging")], osType="LINUX", ipAddresses=["10.0.0.1"]),
+        makeEntity("HOST-2", "et-demo-2", [makeTag("Name", "et-demo-2", "AWS"), makeTag("Environment", "Production")], osType="WINDOWS", ipAddresses=["10.0.0.2", "192.168.0.2"]),
+        makeEntity("HOST-3", "db", [makeTag("Name", "db", "Azure")], osType="LINUX", fromRelationships={"isProcessOf" : ["PROCESS_GROUP_INSTANCE-1"]})]
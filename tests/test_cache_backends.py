@@ -0,0 +1,73 @@
+# user-006: pluggable cache backends - the file cache and a single SQLite file behave the same
+import os
+import sqlite3
+
+import pytest
+
+from conftest import SMPLJSON_DIRECTORY
+
+@pytest.fixture(params=["file", "sqlite"])
+def backend(request, dtcli):
+    dtcli.config["cachebackend"] = request.param
+    return request.param
+
+def queryHostsTwice(dtcli):
+    first = dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "includeDetails=true", "")
+    dtcli.clearResponseMemo()
+    second = dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "includeDetails=true", "")
+    return first, second
+
+def test_cached_response_is_served_without_api_call(dtcli, fakeTenant, backend):
+    dtcli.config["cacheupdate"] = -1
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1", "displayName" : "web1"}]
+    first, second = queryHostsTwice(dtcli)
+    assert second == first
+    assert len(fakeTenant.requests) == 1
+    assert dtcli.getCacheBackend().name == backend
+
+    statistics = dtcli.doCache(False, ["dtcli", "cache", "stats"], False)["tenants"][0]
+    assert (statistics["entries"], statistics["hits"], statistics["misses"]) == (1, 1, 1)
+    assert statistics["largestendpoints"][0]["endpoint"] == dtcli.API_ENDPOINT_HOSTS
+
+def test_cacheupdate_zero_always_asks_the_api(dtcli, fakeTenant, backend):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    queryHostsTwice(dtcli)
+    assert len(fakeTenant.requests) == 2
+
+def test_migrate_old_layout(dtcli, fakeTenant, backend):
+    dtcli.config.update({"tenanthost" : "smpljson", "cacheupdate" : -1})
+    result = dtcli.doCache(False, ["dtcli", "cache", "migrate", SMPLJSON_DIRECTORY], False)
+    assert result["tenant"] == "smpljson"
+    assert result["migrated"] == len(dtcli.listCacheFiles(SMPLJSON_DIRECTORY))
+
+    hosts = dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert hosts == dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").getContent()
+    assert len(hosts) > 0
+    assert fakeTenant.requests == []
+
+@pytest.mark.parametrize("cachecompress", [0, 1])
+def test_sqlite_compression(dtcli, fakeTenant, cachecompress):
+    dtcli.config.update({"cachebackend" : "sqlite", "cachecompress" : cachecompress})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-" + str(index)} for index in range(50)]
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+
+    row = dtcli.getCacheBackend().getConnection().execute("SELECT compressed, bytes, LENGTH(content) FROM cache").fetchone()
+    assert row[0] == cachecompress
+    assert (row[2] < row[1]) == (cachecompress == 1)
+
+def test_sqlite_upgrades_cache_files_of_older_versions(dtcli):
+    dtcli.config["cachebackend"] = "sqlite"
+    os.makedirs(dtcli.getCacheDirectory())
+    connection = sqlite3.connect(dtcli.getCacheDirectory() + dtcli.CACHE_SQLITE_FILENAME)
+    connection.execute("CREATE TABLE cache (tenant TEXT NOT NULL, cachekey TEXT NOT NULL, endpoint TEXT, storedat REAL NOT NULL, bytes INTEGER NOT NULL, compressed INTEGER NOT NULL, content BLOB, PRIMARY KEY (tenant, cachekey))")
+    connection.commit()
+    connection.close()
+
+    columns = [column[1] for column in dtcli.getCacheBackend().getConnection().execute("PRAGMA table_info(cache)").fetchall()]
+    assert all(column in columns for column in ["lastaccess", "etag", "lastmodified", "validatedat", "resolution", "negative"])
+
+def test_unknown_backend(dtcli):
+    dtcli.config["cachebackend"] = "redis"
+    with pytest.raises(Exception) as e:
+        dtcli.getCacheBackend()
+    assert "redis" in e.value.args[1]
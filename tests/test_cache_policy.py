@@ -0,0 +1,57 @@
+# user-011: cachepolicy - TTL per endpoint and query string instead of cacheupdate
+import time
+
+import pytest
+
+from conftest import makeTimeseriesResult
+
+def getState(dtcli, age, apiEndpoint, queryString, resolution=None):
+    cacheEntry = dtcli.CacheEntry(time.time() - age, 10, lambda: [], None, resolution)
+    return dtcli.getCacheEntryState(cacheEntry, apiEndpoint, queryString)
+
+def test_policy_is_shipped_empty(dtcli):
+    assert dtcli.configDefaults["cachepolicy"] == {}
+
+def test_cacheupdate_zero_without_policy_never_uses_the_cache(dtcli):
+    assert getState(dtcli, 1, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x", 60000) == dtcli.CACHE_STATE_EXPIRED
+
+@pytest.mark.parametrize("age,queryString,state", [
+    (100, "", "fresh"),                                      # first pattern: the metadata list is kept for an hour
+    (4000, "", "expired"),
+    (100, "timeseriesId=x&relativeTime=hour", "expired"),    # second pattern: 60 seconds
+    (30, "timeseriesId=x&relativeTime=hour", "fresh")])
+def test_first_matching_pattern_wins(dtcli, age, queryString, state):
+    dtcli.config.update({"cacheupdate" : 3600, "cachepolicy" : {"^/api/v1/timeseries\\?$" : 3600, "^/api/v1/timeseries\\?.*relativeTime" : 60, "^/api/v1/timeseries" : -1}})
+    assert getState(dtcli, age, dtcli.API_ENDPOINT_TIMESERIES, queryString) == state
+
+def test_policy_overrides_cacheupdate_zero(dtcli):
+    dtcli.config.update({"cacheupdate" : 0, "cachepolicy" : {"^/api/v1/entity/" : 300}})
+    assert getState(dtcli, 100, dtcli.API_ENDPOINT_HOSTS, "") == dtcli.CACHE_STATE_FRESH
+    assert getState(dtcli, 100, dtcli.API_ENDPOINT_TIMESERIES, "") == dtcli.CACHE_STATE_EXPIRED
+
+def test_cacheupdate_minus_one_wins_over_the_policy(dtcli):
+    dtcli.config.update({"cacheupdate" : -1, "cachepolicy" : {".*" : 0}})
+    assert getState(dtcli, 100000, dtcli.API_ENDPOINT_HOSTS, "") == dtcli.CACHE_STATE_FRESH
+
+@pytest.mark.parametrize("age,resolution,state", [(30, 60000, "fresh"), (90, 60000, "expired"), (90, 3600000, "fresh"), (90, None, "fresh"), (200, None, "expired")])
+def test_resolution_ttl(dtcli, age, resolution, state):
+    # without a resolution - e.g: not a timeseries result - cacheupdate applies
+    dtcli.config.update({"cacheupdate" : 120, "cachepolicy" : {"^/api/v1/timeseries\\?" : "resolution"}})
+    assert getState(dtcli, age, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x", resolution) == state
+
+def test_resolution_is_stored_with_timeseries_results(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesResult("x", {"HOST-1" : [[1000, 1.0]]}, resolution=300000)
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x", "")
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x&queryMode=total", "")
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x").resolution == 300000
+    # a total covers the whole timeframe - its resolution says nothing about how long it stays current
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x&queryMode=total").resolution is None
+
+def test_policy_decides_whether_the_api_is_called(dtcli, fakeTenant):
+    dtcli.config.update({"memocache" : 0, "cachepolicy" : {"^/api/v1/entity/" : 300}})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    fakeTenant.routes[dtcli.API_ENDPOINT_EVENTS] = {"events" : [{"eventId" : 1}]}
+    for i in range(2):
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_EVENTS, "", "")
+    assert [request[1] for request in fakeTenant.requests] == [dtcli.API_ENDPOINT_HOSTS, dtcli.API_ENDPOINT_EVENTS, dtcli.API_ENDPOINT_EVENTS]
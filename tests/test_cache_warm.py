@@ -0,0 +1,95 @@
+# user-013: cache warm prefetches every query of a monspec pull or of a DQL file
+import json
+import datetime
+
+import pytest
+
+from conftest import FakeResponse, makeEntity, makeTag, makeTimeseriesRoute
+
+RESPONSETIME = "com.dynatrace.builtin:service.responsetime"
+REQUESTS = "com.dynatrace.builtin:service.requestspermin"
+
+MONSPEC = {
+    "MyService" : {
+        "etype" : "SERVICE",
+        "environments" : {
+            "Staging" : {"tags" : [{"context" : "CONTEXTLESS", "key" : "DeploymentGroup", "value" : "Staging"}]},
+            "Production" : {"tags" : [{"context" : "CONTEXTLESS", "key" : "DeploymentGroup", "value" : "Production"}]}
+        },
+        "comparisons" : [{"name" : "StagingToProductionYesterday", "source" : "Staging", "compare" : "Production", "scalefactorperc" : {"default" : 10}, "shiftsourcetimeframe" : 0, "shiftcomparetimeframe" : 86400}],
+        "perfsignature" : [
+            {"timeseries" : RESPONSETIME, "aggregate" : "avg"},
+            {"timeseries" : REQUESTS, "aggregate" : "count"}
+        ]
+    }
+}
+
+@pytest.fixture
+def tenant(dtcli, fakeTenant):
+    "A tenant with one staging and two production services"
+    # as the README recommends for warming: the warmed and the real queries of the same minute match
+    dtcli.config["timealign"] = 60
+    dtcli.config["cachepolicy"] = {".*" : 3600}
+    dtcli.config["memocache"] = 0
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES + "?"] = [
+        {"timeseriesId" : RESPONSETIME, "displayName" : "Response time", "detailedSource" : "Services", "unit" : "MicroSecond (us)"},
+        {"timeseriesId" : REQUESTS, "displayName" : "Requests", "detailedSource" : "Services", "unit" : "PerMinute (count/min)"}]
+    fakeTenant.routes[dtcli.API_ENDPOINT_SERVICES] = [
+        makeEntity("SERVICE-1", "staging", [makeTag("DeploymentGroup", "Staging")]),
+        makeEntity("SERVICE-2", "production1", [makeTag("DeploymentGroup", "Production")]),
+        makeEntity("SERVICE-3", "production2", [makeTag("DeploymentGroup", "Production")])]
+    dataPoints = {"SERVICE-1" : [[1000, 1.0]], "SERVICE-2" : [[1000, 2.0]], "SERVICE-3" : [[1000, 3.0]]}
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesRoute({RESPONSETIME : dataPoints, REQUESTS : dataPoints})
+    return fakeTenant
+
+def test_warm_environments_include_the_comparison_shifts(dtcli):
+    assert dtcli.getMonspecWarmEnvironments(MONSPEC, "0") == [("MyService", "Staging", "0"), ("MyService", "Production", "0"), ("MyService", "Production", "86400")]
+
+def test_warm_monspec_fills_the_cache_for_pull(dtcli, tenant, tmp_path):
+    monspecfile = tmp_path / "monspec.json"
+    monspecfile.write_text(json.dumps(MONSPEC))
+
+    result = dtcli.doCache(False, ["dtcli", "cache", "warm", "monspec", str(monspecfile), "60", "0"], False)
+    assert result["failed"] == []
+    # 2 entity queries and 2 timeseries for each of the 3 environment/timeshift combinations
+    assert result["warmed"] == 2 + 6
+
+    tenant.requests.clear()
+    monspec = dtcli.parseMonspec(str(monspecfile), True)
+    dtcli.pullMonspecMetrics(monspec, "MyService", "Production", "60", "86400", "result", dtcli.MONSPEC_DATAHANDLING_NORMAL)
+    dtcli.pullMonspecMetrics(monspec, "MyService", "Staging", "60", "0", "result", dtcli.MONSPEC_DATAHANDLING_NORMAL)
+    assert tenant.requests == []
+
+def test_warm_dql_file(dtcli, tenant, tmp_path):
+    dqlfile = tmp_path / "pipeline.dql"
+    dqlfile.write_text("# our pipeline\n\ndtcli dql srv tags/DeploymentGroup=Production service.responsetime[avg%hour]\nsrv staging service.requestspermin[count%hour]\nsrv staging service.unknown[avg%hour]\n")
+    tenant.routes[dtcli.API_ENDPOINT_TIMESERIES + "?timeseriesId=com.dynatrace.builtin:service.unknown&relativeTime=hour&aggregationType=avg&entity=SERVICE-1"] = FakeResponse(400, {"error" : {"code" : 400, "message" : "unknown timeseries"}})
+
+    result = dtcli.doCache(False, ["dtcli", "cache", "warm", "dql", str(dqlfile)], False)
+    assert result["warmed"] == 3
+    assert len(result["failed"]) == 1 and result["failed"][0].startswith("srv staging service.unknown[avg%hour]: ")
+
+    tenant.requests.clear()
+    dtcli.doDQL(False, ["dtcli", "dql", "srv", "tags/DeploymentGroup=Production", "service.responsetime[avg%hour]"], False)
+    assert tenant.requests == []
+
+def test_warm_needs_an_existing_file(dtcli):
+    with pytest.raises(Exception) as e:
+        dtcli.doCache(False, ["dtcli", "cache", "warm", "dql", "doesntexist.dql"], False)
+    assert "doesntexist.dql" in e.value.args[1]
+
+class FixedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fromtimestamp(1500000059, tz)
+
+def test_timealign_is_off_by_default(dtcli):
+    assert dtcli.config["timealign"] == 0
+
+@pytest.mark.parametrize("timealign,now", [(0, 1500000059), (60, 1500000000)])
+def test_relative_timeframes_and_the_webui_use_the_same_aligned_now(dtcli, monkeypatch, timealign, now):
+    monkeypatch.setattr(dtcli.datetime, "datetime", FixedDatetime)
+    dtcli.config["timealign"] = timealign
+    timeframe = dtcli.TimeframeDef("60")
+    assert timeframe.timestamp == [1000 * (now - 3600)]
+    assert timeframe.getNowAsStringForWebUI() == str(1000 * now)
@@ -0,0 +1,61 @@
+# user-021: with entitymodel compact entity lists are kept as slotted records with shared strings
+import array
+import copy
+
+import pytest
+
+from conftest import getSampleEntities
+
+def test_compact_list_expands_to_the_same_entities(dtcli):
+    entities = getSampleEntities()
+    compactList = dtcli.CompactEntityList(copy.deepcopy(entities))
+    assert len(compactList) == len(entities)
+    assert list(compactList) == entities
+    assert compactList[-1] == entities[-1]
+    assert compactList.stringIndexes is None
+
+def test_strings_and_objects_are_shared(dtcli):
+    tag = {"context" : "CONTEXTLESS", "key" : "Environment", "value" : "Staging"}
+    compactList = dtcli.CompactEntityList([
+        {"entityId" : "HOST-1", "tags" : [dict(tag)], "fromRelationships" : {"isProcessOf" : ["PGI-1", "PGI-2"]}},
+        {"entityId" : "HOST-2", "tags" : [dict(tag)], "fromRelationships" : {"isProcessOf" : ["PGI-2"]}}])
+    first, second = compactList.entities
+    assert first.keys is second.keys
+    assert first.values[1][0] is second.values[1][0]
+    assert type(first.values[2].values[0]) is array.array
+    assert compactList.strings.count("PGI-2") == 1
+
+def test_lists_keep_their_types(dtcli):
+    entities = [{"entityId" : "HOST-1", "empty" : [], "numbers" : [1, 2], "mixed" : ["a", 1], "nested" : [["a"]], "none" : None, "flag" : True}]
+    assert list(dtcli.CompactEntityList(copy.deepcopy(entities))) == entities
+
+def test_entity_model_list(dtcli):
+    entities = getSampleEntities()
+    assert type(dtcli.getEntityModelList(iter(entities))) is list
+    dtcli.config["entitymodel"] = dtcli.ENTITY_MODEL_COMPACT
+    compactList = dtcli.getEntityModelList(iter(entities))
+    assert isinstance(compactList, dtcli.CompactEntityList)
+    assert dtcli.isEntityList(compactList)
+    assert dtcli.isEntityList(entities)
+    assert not dtcli.isEntityList({"entityId" : "HOST-1"})
+
+@pytest.mark.parametrize("args", [
+    ["et-demo.*"],
+    ["tags/AWS:Name=et-demo.*", "displayName"],
+    ["osType=WINDOWS", "ipAddresses"],
+    ["db", "*"]])
+def test_ent_returns_the_same_with_both_models(dtcli, fakeTenant, args):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = getSampleEntities()[-3:]
+    dtcli.config["cacheupdate"] = -1
+    dictResult = dtcli.doEntity(False, ["dtcli", "ent", "host"] + args, False)
+
+    dtcli.config["entitymodel"] = dtcli.ENTITY_MODEL_COMPACT
+    dtcli.global_entityProjections.clear()
+    dtcli.global_entityIndexes.clear()
+    dtcli.clearResponseMemo()
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host"] + args, False) == dictResult
+
+def test_config_rejects_unknown_model(dtcli):
+    with pytest.raises(Exception) as error:
+        dtcli.doConfig(False, ["dtcli", "config", "entitymodel", "tree"])
+    assert "not supported" in error.value.args[1]
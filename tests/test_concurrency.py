@@ -0,0 +1,67 @@
+# user-002: concurrent query engine - results in order of the calls, bounded concurrency, monspec results per perfsignature
+import time
+import threading
+
+import pytest
+
+def test_results_keep_the_order_of_the_calls(dtcli):
+    dtcli.config["concurrency"] = 4
+    delays = [0.05, 0.0, 0.03, 0.01]
+    results = dtcli.runConcurrently([(lambda index, delay: time.sleep(delay) or index, (index, delay)) for index, delay in enumerate(delays)])
+    assert results == [0, 1, 2, 3]
+
+def test_calls_in_flight_stay_within_concurrency(dtcli):
+    dtcli.config["concurrency"] = 2
+    lock = threading.Lock()
+    inFlight = [0, 0]
+
+    def call():
+        with lock:
+            inFlight[0] += 1
+            inFlight[1] = max(inFlight[1], inFlight[0])
+        time.sleep(0.02)
+        with lock:
+            inFlight[0] -= 1
+
+    dtcli.runConcurrently([(call, ()) for i in range(8)])
+    assert inFlight[1] == 2
+
+def failing(message):
+    raise Exception("Error", message)
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_first_exception_in_call_order_is_raised(dtcli, concurrency):
+    dtcli.config["concurrency"] = concurrency
+    with pytest.raises(Exception) as e:
+        dtcli.runConcurrently([(str, (1,)), (failing, ("first",)), (failing, ("second",))])
+    assert e.value.args == ("Error", "first")
+
+def test_exceptions_can_be_returned_as_results(dtcli):
+    dtcli.config["concurrency"] = 4
+    results = dtcli.runConcurrently([(str, (1,)), (failing, ("first",))], True)
+    assert results[0] == "1"
+    assert results[1].args == ("Error", "first")
+
+def test_nested_calls_run_serially_on_the_query_threads(dtcli):
+    dtcli.config["concurrency"] = 2
+    nested = lambda index: dtcli.runConcurrently([(str, (index,)), (str, (index + 1,))])
+    assert dtcli.runConcurrently([(nested, (0,)), (nested, (10,))]) == [["0", "1"], ["10", "11"]]
+
+def test_concurrent_queries_go_through_the_fake_tenant(dtcli, fakeTenant):
+    dtcli.config["concurrency"] = 4
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = lambda httpMethod, apiEndpoint, queryString, headers: {"query" : queryString}
+    queries = [(dtcli.HTTP_GET, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=m" + str(index), None) for index in range(6)]
+    results = dtcli.queryDynatraceAPIConcurrently(queries)
+    assert [result["query"] for result in results] == ["timeseriesId=m" + str(index) for index in range(6)]
+    assert sorted(fakeTenant.queries()) == sorted([query[2] for query in queries])
+
+def test_identical_perfsignatures_get_their_own_results(dtcli, monkeypatch):
+    dtcli.config["concurrency"] = 1
+    monkeypatch.setattr(dtcli, "queryEntitiesForMonspecEnvironment", lambda monspec, entitydefname, environmentdefname: ["SERVICE-1"])
+    values = iter([10, 20])
+    monkeypatch.setattr(dtcli, "doTimeseries", lambda doHelp, args, doPrint: {"SERVICE-1" : {"dataPoints" : [[0, next(values)]]}})
+
+    perfsignature = {"timeseries" : "com.dynatrace.builtin:service.responsetime", "aggregate" : "avg"}
+    monspec = {"MyService" : {"perfsignature" : [dict(perfsignature), dict(perfsignature)]}}
+    results = dtcli.pullMonspecMetrics(monspec, "MyService", "Staging", "60", "0", "result", dtcli.MONSPEC_DATAHANDLING_NORMAL)
+    assert [result["result"] for result in results] == [10, 20]
@@ -0,0 +1,32 @@
+# user-003: DQL fetches every distinct timeseries once for all matched entities
+from conftest import makeEntity, makeTimeseriesRoute
+
+def test_one_timeseries_call_per_distinct_metric(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [makeEntity("HOST-1", "web1"), makeEntity("HOST-2", "web2"), makeEntity("HOST-3", "db1")]
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesRoute({
+        "com.dynatrace.builtin:host.cpu.system" : {"HOST-1" : [[1000, 1.0]], "HOST-2" : [[1000, 2.0]], "HOST-3" : [[1000, 3.0]]},
+        "com.dynatrace.builtin:host.cpu.user" : {"HOST-1" : [[1000, 10.0]], "HOST-2" : [[1000, 20.0]], "HOST-3" : [[1000, 30.0]]}})
+
+    result = dtcli.doDQL(False, ["dtcli", "dql", "host", "web.*", "host.cpu.system[max%hour],host.cpu.user[avg%hour],host.cpu.system[max%hour]"], False)
+
+    timeseriesQueries = fakeTenant.queries(dtcli.API_ENDPOINT_TIMESERIES)
+    assert len(timeseriesQueries) == 2
+    assert all("entity=HOST-1&entity=HOST-2" in query and "HOST-3" not in query for query in timeseriesQueries)
+
+    # same order and format as one query per entity and metric
+    assert [list(entry.keys()) for entry in result] == [["HOST-1"]] * 3 + [["HOST-2"]] * 3
+    assert [entry[entityId]["dataPoints"][0][1] for entry in result for entityId in entry] == [1.0, 10.0, 1.0, 2.0, 20.0, 2.0]
+    assert result[0]["HOST-1"]["timeseriesId"] == "com.dynatrace.builtin:host.cpu.system"
+
+def test_repeated_metrics_get_their_own_copy(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [makeEntity("HOST-1", "web1")]
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesRoute({"com.dynatrace.builtin:host.cpu.system" : {"HOST-1" : [[1000, 1.0]]}})
+
+    result = dtcli.doDQL(False, ["dtcli", "dql", "host", "web.*", "host.cpu.system[max%hour],host.cpu.system[max%hour]"], False)
+    result[0]["HOST-1"]["dataPoints"][0][1] = 99
+    assert result[1]["HOST-1"]["dataPoints"][0][1] == 1.0
+
+def test_no_matching_entities_means_no_timeseries_calls(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [makeEntity("HOST-3", "db1")]
+    assert dtcli.doDQL(False, ["dtcli", "dql", "host", "web.*", "host.cpu.system[max%hour]"], False) == []
+    assert fakeTenant.queries(dtcli.API_ENDPOINT_TIMESERIES) == []
@@ -0,0 +1,70 @@
+# user-017: inverted index over entity tags and properties answers filters like the scan does
+import json
+
+import pytest
+
+from conftest import getSampleEntities, makeEntity, makeTag
+
+@pytest.mark.parametrize("key,matchValue,returnKey", [
+    ("displayName", ".*Service.*", "entityId"),
+    ("displayName", "/$", "entityId"),
+    ("displayName", "et-demo", "entityId"),
+    ("displayName", "et-demo-[12]", "entityId,displayName"),
+    ("agentTechnologyType", "JAVA", "*"),
+    ("serviceTechnologyTypes", "Java", "entityId"),
+    ("ipAddresses", "192\\.168\\..*", "entityId"),
+    ("tags/AWS:Name", "et-demo.*", "entityId"),
+    ("tags/CONTEXTLESS:Environment", "Staging$", "entityId"),
+    ("tags/context#AWS:key#Name", ".*", "entityId"),
+    ("tags/?key", "A1", "entityId"),
+    ("tags/?key", "Service", "key"),
+    ("tags/?context", "AWS", "entityId")])
+def test_index_answers_like_the_scan(dtcli, key, matchValue, returnKey):
+    entities = getSampleEntities()
+    entityIndex = dtcli.EntityIndex(entities, "v1").build()
+    assert entityIndex.findValuesByKey(key, matchValue, returnKey) == dtcli.jsonFindValuesByKey(entities, key, matchValue, returnKey)
+
+@pytest.mark.parametrize("key,matchValue", [
+    ("displayName", None),               # no filter at all
+    ("runsOn", ".*"),                    # below the entities - in fromRelationships
+    ("firstSeenTimestamp", "15.*"),      # not a string
+    ("tags/Name", ".*"),                 # a key without context has no key field name
+    ("tags/CONTEXTLESS:name#Name", ".*"), # tags with other field names
+    ("fromRelationships/isProcessOf", ".*")])
+def test_searches_the_index_cant_answer_return_none(dtcli, key, matchValue):
+    assert dtcli.EntityIndex(getSampleEntities(), "v1").build().findValuesByKey(key, matchValue, "entityId") is None
+
+def test_invalid_regex_raises_like_the_scan(dtcli):
+    with pytest.raises(Exception) as e:
+        dtcli.EntityIndex([], "v1").build().findValuesByKey("displayName", "[", "entityId")
+    assert e.value.args[0] == "Regex Error"
+
+def test_index_is_persisted_until_the_list_changes(dtcli, fakeTenant, monkeypatch):
+    dtcli.config["cacheupdate"] = -1
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", json.dumps(getSampleEntities()[-3:]))
+    builds = []
+    build = dtcli.EntityIndex.build
+    monkeypatch.setattr(dtcli.EntityIndex, "build", lambda self: builds.append(self) or build(self))
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "tags/AWS:Name=et-demo.*"], False) == ["HOST-1", "HOST-2"]
+    assert len(builds) == 1
+
+    # a new run loads the persisted index instead of building it
+    dtcli.global_entityIndexes.clear()
+    dtcli.global_entityProjections.clear()
+    dtcli.clearResponseMemo()
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "tags/AWS:Name=et-demo-2$"], False) == ["HOST-2"]
+    assert len(builds) == 1
+
+    # the cached list changed - so does the index
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", json.dumps([makeEntity("HOST-4", "web", [makeTag("Name", "et-demo-4", "AWS")])]))
+    dtcli.clearResponseMemo()
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "tags/AWS:Name=et-demo.*"], False) == ["HOST-4"]
+    assert len(builds) == 2
+    assert fakeTenant.requests == []
+
+def test_prefix_and_literal_lookups(dtcli):
+    indexedValues = dtcli.IndexedValues({"et-demo-1" : [0], "et-demo-2" : [1], "et-demo" : [2], "db" : [3], "db\n" : [4]})
+    assert sorted(indexedValues.findPositions("et-demo")) == [0, 1, 2]
+    assert indexedValues.findPositions("et-demo$") == [2]
+    assert indexedValues.findPositions("db$") == [3, 4]
+    assert sorted(indexedValues.findPositions(".*-[12]")) == [0, 1]
@@ -0,0 +1,76 @@
+# user-020: with cacheencoding ndjson entity lists are stored line by line and filtered without loading them
+import json
+
+import pytest
+
+from conftest import getSampleEntities
+
+@pytest.fixture
+def hosts(dtcli, fakeTenant):
+    dtcli.config["cacheupdate"] = -1
+    dtcli.config["cacheencoding"] = dtcli.CACHE_ENCODING_NDJSON
+    hosts = getSampleEntities()[-3:]
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = hosts
+    return hosts
+
+def test_list_is_stored_line_by_line_and_still_valid_json(dtcli, hosts):
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", ".*", "*"], False) == hosts
+    filename = dtcli.getCacheBackend().findEntryFile(dtcli.API_ENDPOINT_HOSTS, "")[0]
+    with open(filename) as entityFile:
+        lines = entityFile.read().splitlines()
+    assert len(lines) == len(hosts) + 2
+    with open(filename) as entityFile:
+        assert json.load(entityFile) == hosts
+
+    entityLines = dtcli.lookupEntityLines(dtcli.API_ENDPOINT_HOSTS, "")
+    assert entityLines[0] == filename
+    assert entityLines[1]["entities"] == 3
+    assert entityLines[1]["plainEntityIds"]
+    assert sorted(entityLines[1]["offsets"].keys()) == ["HOST-1", "HOST-2", "HOST-3"]
+
+def test_entities_are_read_by_their_offsets(dtcli, hosts):
+    dtcli.doEntity(False, ["dtcli", "ent", "host", ".*", "*"], False)
+    filename, lineIndex = dtcli.lookupEntityLines(dtcli.API_ENDPOINT_HOSTS, "")
+    assert dtcli.readCachedEntities(filename, lineIndex, ["HOST-3", "HOST-1", "HOST-9"]) == [hosts[0], hosts[2]]
+
+def test_lookup_by_entity_id_seeks_instead_of_scanning(dtcli, fakeTenant, hosts, monkeypatch):
+    dtcli.doEntity(False, ["dtcli", "ent", "host", ".*", "*"], False)
+    dtcli.clearResponseMemo()
+    fakeTenant.requests.clear()
+    monkeypatch.setattr(dtcli, "streamCachedEntities", lambda filename: pytest.fail("list scanned"))
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "entityId=HOST-2$", "displayName"], False) == ["et-demo-2"]
+    assert fakeTenant.requests == []
+
+def test_other_filters_stream_the_lines(dtcli, fakeTenant, hosts):
+    dtcli.doEntity(False, ["dtcli", "ent", "host", ".*", "*"], False)
+    dtcli.clearResponseMemo()
+    fakeTenant.requests.clear()
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "osType=WINDOWS"], False) == ["HOST-2"]
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "et-demo.*", "*"], False) == hosts[:2]
+    assert fakeTenant.requests == []
+
+def test_nested_entity_ids_are_not_plain(dtcli):
+    cacheBackend = dtcli.getCacheBackend()
+    dtcli.config["cacheencoding"] = dtcli.CACHE_ENCODING_NDJSON
+    jsonText, entityLines = dtcli.encodeCacheContent(cacheBackend, dtcli.API_ENDPOINT_HOSTS, [{"entityId" : "HOST-1", "runsOn" : {"entityId" : "HOST-2"}}])
+    assert json.loads(jsonText) == [{"entityId" : "HOST-1", "runsOn" : {"entityId" : "HOST-2"}}]
+    assert entityLines == {"entityIds" : ["HOST-1"], "plainEntityIds" : False}
+
+def test_only_entity_lists_of_the_file_cache_are_stored_line_by_line(dtcli):
+    cacheBackend = dtcli.getCacheBackend()
+    assert dtcli.encodeCacheContent(cacheBackend, dtcli.API_ENDPOINT_HOSTS, [{"entityId" : "HOST-1"}])[1] is None
+    dtcli.config["cacheencoding"] = dtcli.CACHE_ENCODING_NDJSON
+    assert dtcli.encodeCacheContent(cacheBackend, dtcli.API_ENDPOINT_TIMESERIES, [{"entityId" : "HOST-1"}])[1] is None
+    assert dtcli.encodeCacheContent(cacheBackend, dtcli.API_ENDPOINT_HOSTS, {"entityId" : "HOST-1"})[1] is None
+
+def test_no_line_index_without_ndjson(dtcli, fakeTenant):
+    dtcli.config["cacheupdate"] = -1
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = getSampleEntities()[-3:]
+    dtcli.doEntity(False, ["dtcli", "ent", "host", ".*", "*"], False)
+    assert dtcli.lookupEntityLines(dtcli.API_ENDPOINT_HOSTS, "") is None
+
+def test_replaced_list_invalidates_the_line_index(dtcli, hosts):
+    dtcli.doEntity(False, ["dtcli", "ent", "host", ".*", "*"], False)
+    dtcli.config["cacheencoding"] = dtcli.CACHE_ENCODING_JSON
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", json.dumps(hosts[:1]))
+    assert dtcli.lookupEntityLines(dtcli.API_ENDPOINT_HOSTS, "") is None
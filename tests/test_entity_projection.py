@@ -0,0 +1,55 @@
+# user-019: entity lists are projected to the fields a query needs - in memory and next to the cache
+import json
+
+import pytest
+
+from conftest import getSampleEntities
+
+@pytest.mark.parametrize("filterString,resultTag", [
+    ("displayName=et-demo.*", "entityId"),
+    ("tags/AWS:Name=et-demo.*", "displayName"),
+    ("tags/?key=A1", "entityId,displayName"),
+    ("runsOn=PROCESS_GROUP-.*", "entityId"),
+    ("serviceTechnologyTypes=Java", "discoveredName")])
+def test_projected_list_gives_the_same_result(dtcli, filterString, resultTag):
+    entities = getSampleEntities()
+    nameValue = dtcli.parseNameValue(filterString, "displayName", "")
+    projectedList = list(dtcli.getEntityProjection(nameValue, resultTag).apply(entities))
+    assert dtcli.jsonFindValuesByKey(projectedList, nameValue.name, nameValue.value, resultTag) == dtcli.jsonFindValuesByKey(entities, nameValue.name, nameValue.value, resultTag)
+
+def test_projection_keeps_only_the_fields_we_need(dtcli):
+    projection = dtcli.getEntityProjection(dtcli.parseNameValue("tags/AWS:Name=et-demo.*", "displayName", ""), "displayName")
+    assert projection.fields == ["context", "displayName", "key", "tags", "value"]
+    assert projection.isLight()
+    entity = next(projection.apply([getSampleEntities()[-1]]))
+    assert sorted(entity.keys()) == ["displayName", "tags"]
+
+def test_full_entities_need_no_projection(dtcli):
+    assert dtcli.getEntityProjection(None, "*") is None
+    projection = dtcli.getEntityProjection(dtcli.parseNameValue("et-demo.*", "displayName", ""), "*", ["entityId", "fromRelationships"])
+    assert projection.fields == ["displayName", "entityId", "fromRelationships"]
+    assert not projection.isLight()
+
+def test_requested_fields_of_full_entities(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = getSampleEntities()[-3:]
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "db", "*"], False, ["fromRelationships"]) == [{"displayName" : "db", "fromRelationships" : {"isProcessOf" : ["PROCESS_GROUP_INSTANCE-1"]}}]
+
+def test_projection_is_persisted_and_the_full_list_not_loaded_again(dtcli, fakeTenant, monkeypatch):
+    dtcli.config["cacheupdate"] = -1
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", json.dumps(getSampleEntities()[-3:]))
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "et-demo.*"], False) == ["HOST-1", "HOST-2"]
+
+    # a new run only reads the projected copy
+    dtcli.global_entityProjections.clear()
+    dtcli.clearResponseMemo()
+    monkeypatch.setattr(dtcli.FileCacheBackend, "loadContent", lambda self, filename: pytest.fail("full list loaded"))
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "db"], False) == ["HOST-3"]
+    assert fakeTenant.requests == []
+
+def test_projection_follows_changes_of_the_cached_list(dtcli):
+    dtcli.config["cacheupdate"] = -1
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", json.dumps(getSampleEntities()[-3:]))
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "db"], False) == ["HOST-3"]
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", json.dumps([{"entityId" : "HOST-9", "displayName" : "db"}]))
+    dtcli.clearResponseMemo()
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "db"], False) == ["HOST-9"]
@@ -0,0 +1,65 @@
+# user-018: entity filters the API can express are pushed down as tag= and entity= parameters
+import urllib.parse
+
+import pytest
+
+from conftest import makeEntity, makeTag
+
+HOSTS = [
+    makeEntity("HOST-1", "et-demo-1", [makeTag("Name", "et-demo-1", "AWS"), makeTag("Environment", "Staging")]),
+    makeEntity("HOST-2", "et-demo-2", [makeTag("Name", "et-demo-2", "AWS"), makeTag("Environment", "Production")])]
+
+def hostsRoute(httpMethod, apiEndpoint, queryString, headers):
+    "Filters like the v1 entity API - by tag=[CONTEXT]KEY[:VALUE] and entity=ID"
+    parameters = urllib.parse.parse_qs(queryString)
+    hosts = HOSTS
+    for tagFilter in parameters.get("tag", []):
+        context, key, value = "CONTEXTLESS", tagFilter, None
+        if key.startswith("["):
+            context, _, key = key[1:].partition("]")
+        if ":" in key:
+            key, _, value = key.partition(":")
+        hosts = [host for host in hosts if any(tag["context"] == context and tag["key"] == key and (value is None or tag.get("value") == value) for tag in host["tags"])]
+    if "entity" in parameters:
+        hosts = [host for host in hosts if host["entityId"] in parameters["entity"]]
+    return hosts
+
+@pytest.mark.parametrize("filterString,serverFilter", [
+    ("tags/AWS:Name=et-demo-1$", "tag=[AWS]Name:et-demo-1"),
+    ("tags/AWS:Name=et-demo.*", "tag=[AWS]Name"),
+    ("tags/CONTEXTLESS:Environment=Staging$", "tag=Environment:Staging"),
+    ("entityId=HOST-1$", "entity=HOST-1"),
+    ("entityId=HOST-.*", None),
+    ("displayName=et-demo.*", None),
+    ("tags/Name=.*", None),
+    ("tags/context#AWS:name#Name=x$", None)])
+def test_server_filter(dtcli, filterString, serverFilter):
+    assert dtcli.getEntityServerFilter(dtcli.parseNameValue(filterString, "displayName", "")) == serverFilter
+
+def test_filter_is_pushed_down_and_still_applied(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = hostsRoute
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "tags/AWS:Name=et-demo-2.*"], False) == ["HOST-2"]
+    assert fakeTenant.queries() == ["tag=[AWS]Name&includeDetails=false"]
+
+def test_nothing_is_pushed_down_if_the_full_list_is_cached(dtcli, fakeTenant):
+    dtcli.config["cacheupdate"] = 3600
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = hostsRoute
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+
+    plan = dtcli.getEntityQueryPlan(dtcli.API_ENDPOINT_HOSTS, "", dtcli.parseNameValue("tags/AWS:Name=et-demo-1$", "displayName", ""))
+    assert (plan.queryString, plan.reason) == ("", "full list is cached")
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "tags/AWS:Name=et-demo-1$"], False) == ["HOST-1"]
+    assert fakeTenant.queries() == [""]
+
+@pytest.mark.parametrize("apiEndpoint,queryString,filterString,reason", [
+    ("/api/v1/entity/infrastructure/processes", "", "tags/AWS:Name=x$", "endpoint doesnt support filters"),
+    ("/api/v1/entity/infrastructure/hosts", "tag=Environment", "tags/AWS:Name=x$", "query string already given"),
+    ("/api/v1/entity/infrastructure/hosts", "", "displayName=x", "filter cant be expressed by the API")])
+def test_plan_explains_why_nothing_is_pushed_down(dtcli, apiEndpoint, queryString, filterString, reason):
+    plan = dtcli.getEntityQueryPlan(apiEndpoint, queryString, dtcli.parseNameValue(filterString, "displayName", ""))
+    assert (plan.queryString, plan.serverFilter, plan.reason) == (queryString, None, reason)
+
+def test_full_entities_are_requested_with_details(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = hostsRoute
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "entityId=HOST-1$", "*"], False) == [HOSTS[0]]
+    assert fakeTenant.queries() == ["entity=HOST-1"]
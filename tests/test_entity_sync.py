@@ -0,0 +1,99 @@
+# user-022: with entitysync expired entity lists only fetch the entities seen since the last sync
+import copy
+import urllib.parse
+
+import pytest
+
+from conftest import FakeResponse, getSampleEntities
+
+def test_merge_updates_by_id_and_appends_new_entities(dtcli):
+    entityList = [{"entityId" : "HOST-1", "lastSeenTimestamp" : 10, "displayName" : "a"}, {"entityId" : "HOST-2", "lastSeenTimestamp" : 10, "displayName" : "b"}]
+    changedEntities = [{"entityId" : "HOST-2", "lastSeenTimestamp" : 20, "displayName" : "b2"}, {"entityId" : "HOST-3", "lastSeenTimestamp" : 20, "displayName" : "c"}, {"entityId" : "HOST-3", "lastSeenTimestamp" : 30, "displayName" : "c2"}]
+    assert dtcli.mergeEntityLists(entityList, changedEntities) == (2, 1)
+    assert [entity["displayName"] for entity in entityList] == ["a", "b2", "c2"]
+
+def test_merge_keeps_entities_seen_later(dtcli):
+    entityList = [{"entityId" : "HOST-1", "lastSeenTimestamp" : 20, "displayName" : "new"}]
+    assert dtcli.mergeEntityLists(entityList, [{"entityId" : "HOST-1", "lastSeenTimestamp" : 10, "displayName" : "old"}]) == (0, 0)
+    assert entityList[0]["displayName"] == "new"
+
+def test_merge_appends_entities_without_id(dtcli):
+    entityList = [{"entityId" : "HOST-1"}]
+    assert dtcli.mergeEntityLists(entityList, [{"displayName" : "x"}, {"displayName" : "x"}]) == (0, 2)
+    assert len(entityList) == 3
+
+def test_sync_only_for_entity_lists_without_time_window(dtcli):
+    assert not dtcli.isEntitySyncEnabled(dtcli.API_ENDPOINT_HOSTS, "")
+    dtcli.config["entitysync"] = 3600
+    assert dtcli.isEntitySyncEnabled(dtcli.API_ENDPOINT_HOSTS, "")
+    assert dtcli.isEntitySyncEnabled(dtcli.API_ENDPOINT_HOSTS, "tag=Environment")
+    assert not dtcli.isEntitySyncEnabled(dtcli.API_ENDPOINT_HOSTS, "relativeTime=hour")
+    assert not dtcli.isEntitySyncEnabled(dtcli.API_ENDPOINT_PROCESSES, "")
+    assert not dtcli.isEntitySyncEnabled(dtcli.API_ENDPOINT_TIMESERIES, "")
+
+@pytest.fixture
+def hostsRoute(dtcli, fakeTenant):
+    "Returns the full list - or the changed entities for a time window"
+    dtcli.config["entitysync"] = 3600
+    hosts = getSampleEntities()[-3:]
+    changed = copy.deepcopy(hosts[1])
+    changed["lastSeenTimestamp"] += 1000
+    changed["displayName"] = "et-demo-2-renamed"
+    route = {"full" : hosts, "changed" : [changed, {"entityId" : "HOST-4", "displayName" : "new", "lastSeenTimestamp" : 1500000700000}]}
+    def hostsRoute(httpMethod, apiEndpoint, queryString, headers):
+        if "startTimestamp" in queryString:
+            if callable(route["changed"]):
+                return route["changed"]()
+            return route["changed"]
+        return route["full"]
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = hostsRoute
+    return route
+
+def queryHosts(dtcli):
+    dtcli.clearResponseMemo()
+    return dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+
+def test_incremental_sync_merges_changed_entities(dtcli, fakeTenant, hostsRoute):
+    assert queryHosts(dtcli) == hostsRoute["full"]
+    entityList = queryHosts(dtcli)
+    assert [entity["displayName"] for entity in entityList] == ["et-demo-1", "et-demo-2-renamed", "db", "new"]
+
+    queryStrings = fakeTenant.queries(dtcli.API_ENDPOINT_HOSTS)
+    assert queryStrings[0] == ""
+    syncParameters = urllib.parse.parse_qs(queryStrings[1])
+    # the latest lastSeenTimestamp of the list minus the overlap
+    assert int(syncParameters["startTimestamp"][0]) == 1500000600000 - dtcli.ENTITY_SYNC_OVERLAP * 1000
+    assert "endTimestamp" in syncParameters
+
+    # the merged list is what we cache now
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").getContent() == entityList
+    assert dtcli.global_entitySyncStatistics == {"incremental" : 1, "full" : 1, "updated" : 1, "added" : 1}
+
+def test_full_sync_when_due(dtcli, fakeTenant, hostsRoute):
+    queryHosts(dtcli)
+    syncState = dtcli.loadEntitySyncState(dtcli.API_ENDPOINT_HOSTS, "")
+    dtcli.writeEntitySyncState(dtcli.API_ENDPOINT_HOSTS, "", syncState["syncedAt"], syncState["fullSyncAt"] - 3600)
+    assert queryHosts(dtcli) == hostsRoute["full"]
+    assert fakeTenant.queries(dtcli.API_ENDPOINT_HOSTS) == ["", ""]
+    assert dtcli.global_entitySyncStatistics["full"] == 2
+
+def raiseTimeout():
+    raise Exception("Error", "timed out")
+
+@pytest.mark.parametrize("changed", [
+    lambda: FakeResponse(500, {"error" : {"code" : 500}}),
+    lambda: FakeResponse(200, "no json"),
+    lambda: {"entityId" : "HOST-4"},
+    raiseTimeout])
+def test_failed_sync_downloads_the_full_list(dtcli, fakeTenant, hostsRoute, changed):
+    queryHosts(dtcli)
+    hostsRoute["changed"] = changed
+    assert queryHosts(dtcli) == hostsRoute["full"]
+    queryStrings = fakeTenant.queries(dtcli.API_ENDPOINT_HOSTS)
+    assert queryStrings[0] == "" and "startTimestamp" in queryStrings[1] and queryStrings[2] == ""
+    assert dtcli.global_entitySyncStatistics["incremental"] == 0
+
+def test_replaced_list_forgets_its_sync_state(dtcli, hostsRoute):
+    queryHosts(dtcli)
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", "[]")
+    assert dtcli.loadEntitySyncState(dtcli.API_ENDPOINT_HOSTS, "") is None
@@ -0,0 +1,77 @@
+# user-007: hash-sharded file cache within a byte budget - LRU eviction, expire and stats
+import os
+import time
+
+def storeHosts(dtcli, queryString, entityCount=20):
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, queryString, "[" + ",".join(["{\"entityId\" : \"HOST-" + str(index) + "\"}" for index in range(entityCount)]) + "]")
+
+def test_entries_are_sharded_by_key_hash(dtcli):
+    storeHosts(dtcli, "tag=web")
+    cacheKeyHash = dtcli.getCacheKeyHash(dtcli.getCacheKey(dtcli.API_ENDPOINT_HOSTS, "tag=web"))
+    tenantDirectory = os.path.join(dtcli.config["cachedir"], "abc12345_live_dynatrace_com")
+    assert os.path.isfile(os.path.join(tenantDirectory, cacheKeyHash[:2], cacheKeyHash + ".json"))
+    assert os.path.isfile(os.path.join(tenantDirectory, dtcli.CACHE_INDEX_FILENAME))
+
+def test_least_recently_used_entries_are_evicted(dtcli):
+    backend = dtcli.getCacheBackend()
+    for queryString in ["a=1", "a=2", "a=3"]:
+        storeHosts(dtcli, queryString)
+    entryBytes = backend.getTotalBytes("abc12345_live_dynatrace_com") // 3
+
+    # a=1 is the oldest entry - but we just used it
+    time.sleep(0.01)
+    backend.recordAccess(dtcli.API_ENDPOINT_HOSTS, "a=1", True)
+    dtcli.config["cachesize"] = entryBytes * 3
+    storeHosts(dtcli, "a=4")
+
+    assert backend.lookup(dtcli.API_ENDPOINT_HOSTS, "a=2") is None
+    assert [backend.lookup(dtcli.API_ENDPOINT_HOSTS, queryString) is not None for queryString in ["a=1", "a=3", "a=4"]] == [True, True, True]
+    assert backend.getTotalBytes("abc12345_live_dynatrace_com") <= dtcli.config["cachesize"]
+
+def test_prune_command(dtcli):
+    for queryString in ["a=1", "a=2", "a=3"]:
+        storeHosts(dtcli, queryString)
+    result = dtcli.doCache(False, ["dtcli", "cache", "prune", "0"], False)
+    assert (result["pruned"], result["bytes"]) == (3, 0)
+    assert os.listdir(os.path.join(dtcli.config["cachedir"], "abc12345_live_dynatrace_com")) != []
+
+def test_expire_removes_old_entries_only(dtcli):
+    backend = dtcli.getCacheBackend()
+    storeHosts(dtcli, "a=1")
+    backend.storeEx("abc12345_live_dynatrace_com", dtcli.getCacheKey(dtcli.API_ENDPOINT_HOSTS, "a=2"), dtcli.API_ENDPOINT_HOSTS, time.time() - 7200, "[]")
+
+    assert dtcli.doCache(False, ["dtcli", "cache", "expire", "3600"], False)["expired"] == 1
+    assert backend.lookup(dtcli.API_ENDPOINT_HOSTS, "a=1") is not None
+    assert backend.lookup(dtcli.API_ENDPOINT_HOSTS, "a=2") is None
+
+def test_expire_leaves_old_layout_directories_alone(dtcli):
+    # e.g: our smpljson demo data - only read and migrated, never removed
+    dtcli.config["tenanthost"] = "smpljson"
+    oldLayoutFilename = dtcli.getCacheFilename(dtcli.API_ENDPOINT_HOSTS, "")
+    os.makedirs(os.path.dirname(oldLayoutFilename))
+    with open(oldLayoutFilename, "w") as oldLayoutFile:
+        oldLayoutFile.write("[{\"entityId\" : \"HOST-1\"}]")
+    os.utime(oldLayoutFilename, (time.time() - 86400 * 365, time.time() - 86400 * 365))
+
+    assert dtcli.doCache(False, ["dtcli", "cache", "expire", "60"], False)["expired"] == 0
+    assert os.path.isfile(oldLayoutFilename)
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").getContent() == [{"entityId" : "HOST-1"}]
+
+def test_index_merges_what_other_processes_stored(dtcli):
+    # two backends on the same cachedir are like two dtcli processes sharing it
+    storeHosts(dtcli, "a=1")
+    otherProcess = dtcli.FileCacheBackend(dtcli.getCacheDirectory())
+    otherProcess.store(dtcli.API_ENDPOINT_HOSTS, "a=2", "[]")
+    storeHosts(dtcli, "a=3")
+    dtcli.flushCacheBackends()
+
+    assert dtcli.doCache(False, ["dtcli", "cache", "stats"], False)["tenants"][0]["entries"] == 3
+
+def test_stats_of_all_tenants(dtcli):
+    storeHosts(dtcli, "a=1")
+    dtcli.config["tenanthost"] = "xyz98765.live.dynatrace.com"
+    storeHosts(dtcli, "a=1")
+    storeHosts(dtcli, "a=2")
+
+    tenants = dtcli.doCache(False, ["dtcli", "cache", "stats", "all"], False)["tenants"]
+    assert [(tenant["tenant"], tenant["entries"]) for tenant in tenants] == [("abc12345_live_dynatrace_com", 1), ("xyz98765_live_dynatrace_com", 2)]
@@ -0,0 +1,57 @@
+# user-001: one pooled keep-alive session with hard timeouts for all API calls
+import pytest
+import requests
+
+from conftest import FakeResponse
+
+class FakeSession:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def request(self, method, url, headers=None, json=None, timeout=None):
+        self.calls.append({"method" : method, "url" : url, "headers" : headers, "json" : json, "timeout" : timeout})
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(200, {})
+
+def test_session_is_shared_and_pooled(dtcli):
+    dtcli.config["poolsize"] = 3
+    session = dtcli.getHttpSession()
+    assert dtcli.getHttpSession() is session
+    adapter = session.get_adapter("https://" + dtcli.config["tenanthost"])
+    assert adapter._pool_maxsize == 3
+    assert session.headers["Connection"] == "keep-alive"
+
+def test_keepalive_off_closes_connections(dtcli):
+    dtcli.config["keepalive"] = 0
+    assert dtcli.getHttpSession().headers["Connection"] == "close"
+
+def test_timeouts_come_from_config(dtcli):
+    dtcli.config.update({"connecttimeout" : 3, "readtimeout" : 30})
+    assert dtcli.getHttpTimeout() == (3.0, 30.0)
+
+def test_request_uses_session_timeout_and_headers(dtcli, fakeTenant, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(dtcli, "getHttpSession", lambda: session)
+    assert fakeTenant.originalSend(dtcli.HTTP_GET, dtcli.API_ENDPOINT_HOSTS, "tag=web", {"ignored" : True}, {"If-None-Match" : "\"1\""}).ok
+
+    call = session.calls[0]
+    assert call["url"] == "https://" + dtcli.config["tenanthost"] + dtcli.API_ENDPOINT_HOSTS + "?tag=web"
+    assert call["headers"] == {"Authorization" : "Api-Token testtoken", "If-None-Match" : "\"1\""}
+    assert call["json"] is None
+    assert call["timeout"] == dtcli.getHttpTimeout()
+
+def test_post_sends_body(dtcli, fakeTenant, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(dtcli, "getHttpSession", lambda: session)
+    fakeTenant.originalSend(dtcli.HTTP_POST, dtcli.API_ENDPOINT_EVENTS, "", {"eventType" : "CUSTOM_INFO"})
+    assert session.calls[0]["json"] == {"eventType" : "CUSTOM_INFO"}
+
+@pytest.mark.parametrize("error,message", [(requests.exceptions.ReadTimeout("read timed out"), "timed out"), (requests.exceptions.ConnectionError("refused"), "Cannot connect")])
+def test_network_errors_become_dtcli_errors(dtcli, fakeTenant, monkeypatch, error, message):
+    monkeypatch.setattr(dtcli, "getHttpSession", lambda: FakeSession(error))
+    with pytest.raises(Exception) as e:
+        fakeTenant.originalSend(dtcli.HTTP_GET, dtcli.API_ENDPOINT_HOSTS, "", None)
+    assert e.value.args[0] == "Error"
+    assert message in e.value.args[1]
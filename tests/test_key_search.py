@@ -0,0 +1,48 @@
+# user-016: compiled entity filters return exactly what the generic recursive JSON walk returns
+import pytest
+
+from conftest import getSampleEntities
+
+@pytest.mark.parametrize("key,matchValue,returnKey", [
+    ("displayName", ".*Service.*", "entityId"),
+    ("displayName", "/$", "entityId"),
+    ("displayName", "et-demo", "entityId"),
+    ("displayName", "et-demo.*", "displayName"),
+    ("displayName", "et-demo-[12]", "entityId,displayName"),
+    ("displayName", None, "entityId"),
+    ("agentTechnologyType", "JAVA", "*"),
+    ("serviceTechnologyTypes", "Java", "entityId"),
+    ("ipAddresses", "192\\.168\\..*", "entityId"),
+    ("runsOn", "PROCESS_GROUP-.*", "entityId"),
+    ("tags/AWS:Name", "et-demo.*", "entityId"),
+    ("tags/Name", ".*", "entityId"),
+    ("tags/Environment", "Staging$", "entityId"),
+    ("tags/context#AWS:key#Name", "et-demo-2", "entityId"),
+    ("tags/CONTEXTLESS:A1", None, "entityId"),
+    ("tags/?key", "A1", "entityId"),
+    ("osType", "WINDOWS", "unknownField")])
+def test_compiled_search_matches_the_recursive_walk(dtcli, key, matchValue, returnKey):
+    entities = getSampleEntities()
+    expected = dtcli.jsonFindValuesByKeyEx(entities, key, matchValue, returnKey, None, None)
+    assert dtcli.jsonFindValuesByKey(entities, key, matchValue, returnKey) == expected
+    assert dtcli.streamFindValuesByKey(iter(entities), key, matchValue, returnKey) == expected
+
+def test_non_string_values_raise_the_same_error(dtcli):
+    entities = getSampleEntities()
+    with pytest.raises(TypeError):
+        dtcli.jsonFindValuesByKeyEx(entities, "firstSeenTimestamp", "15.*", "entityId", None, None)
+    with pytest.raises(TypeError):
+        dtcli.jsonFindValuesByKey(entities, "firstSeenTimestamp", "15.*", "entityId")
+
+def test_invalid_regex(dtcli):
+    with pytest.raises(Exception) as e:
+        dtcli.jsonFindValuesByKey(getSampleEntities(), "displayName", "[", "entityId")
+    assert e.value.args[0] == "Regex Error"
+
+@pytest.mark.parametrize("matchValue,tier", [("et-demo-1$", ("literal", "et-demo-1")), ("et-demo", ("prefix", "et-demo")), ("et-demo.*", ("prefix", "et-demo")), (".*demo", ("regex", None)), ("et-demo-[12]", ("regex", None))])
+def test_value_match_tiers(dtcli, matchValue, tier):
+    assert dtcli.getValueMatchTier(matchValue) == tier
+
+def test_literal_matches_like_re(dtcli):
+    matcher = dtcli.compileValueMatcher("abc$")
+    assert [matcher(value) for value in ["abc", "abc\n", "abcd", "xabc"]] == [True, True, False, False]
@@ -0,0 +1,72 @@
+# user-012: API errors are remembered for cachenegative seconds
+import time
+
+import pytest
+
+from conftest import FakeResponse
+
+NOT_FOUND = FakeResponse(404, {"error" : {"code" : 404, "message" : "Entity not found"}})
+
+def getState(dtcli, age, negative):
+    cacheEntry = dtcli.CacheEntry(time.time() - age, 10, lambda: [], None, None, negative)
+    return dtcli.getCacheEntryState(cacheEntry, dtcli.API_ENDPOINT_HOSTS, "")
+
+@pytest.mark.parametrize("cacheupdate", [0, 3600])
+def test_negative_entries_expire_after_cachenegative(dtcli, cacheupdate):
+    dtcli.config.update({"cacheupdate" : cacheupdate, "cachenegative" : 60, "cachestale" : 3600})
+    assert getState(dtcli, 30, 404) == dtcli.CACHE_STATE_FRESH
+    assert getState(dtcli, 90, 404) == dtcli.CACHE_STATE_EXPIRED
+
+def test_cacheupdate_minus_one_only_uses_the_cache(dtcli):
+    dtcli.config.update({"cacheupdate" : -1, "cachenegative" : 60})
+    assert getState(dtcli, 90, 404) == dtcli.CACHE_STATE_FRESH
+
+def test_api_error_is_cached_and_raised_again(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS + "/HOST-X"] = NOT_FOUND
+    for i in range(2):
+        with pytest.raises(dtcli.DynatraceAPIError) as e:
+            dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS + "/HOST-X", "", "")
+        assert e.value.statusCode == 404
+        assert e.value.args == ("Error", "Dynatrace API returned an error: Entity not found")
+    assert len(fakeTenant.requests) == 1
+    assert dtcli.global_negativeCacheStatistics == {"hits" : 1, "stored" : 1}
+
+@pytest.mark.parametrize("cacheupdate,requests", [(0, 2), (-1, 1)])
+def test_empty_results_are_regular_entries(dtcli, fakeTenant, cacheupdate, requests):
+    dtcli.config.update({"cacheupdate" : cacheupdate, "memocache" : 0})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = []
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "tag=none", "") == []
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "tag=none", "") == []
+    assert len(fakeTenant.requests) == requests
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "tag=none").negative is None
+
+def test_empty_results_are_served_forever_with_cacheupdate_minus_one(dtcli, fakeTenant):
+    dtcli.config.update({"cacheupdate" : -1, "cachenegative" : 60})
+    dtcli.getCacheBackend().storeEx(dtcli.getCacheTenant(), dtcli.getCacheKey(dtcli.API_ENDPOINT_HOSTS, "tag=none"), dtcli.API_ENDPOINT_HOSTS, time.time() - 3600, "[]")
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "tag=none", "") == []
+    assert fakeTenant.requests == []
+
+@pytest.mark.parametrize("statusCode", [401, 403, 429, 500, 503])
+def test_auth_throttling_and_server_errors_are_not_cached(dtcli, fakeTenant, statusCode):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = FakeResponse(statusCode, {"error" : {"code" : statusCode, "message" : "nope"}})
+    for i in range(2):
+        with pytest.raises(dtcli.DynatraceAPIError):
+            dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert len(fakeTenant.requests) == 2
+
+def test_cachenegative_zero_turns_it_off(dtcli, fakeTenant):
+    dtcli.config.update({"cachenegative" : 0, "memocache" : 0})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS + "/HOST-X"] = NOT_FOUND
+    for i in range(2):
+        with pytest.raises(dtcli.DynatraceAPIError):
+            dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS + "/HOST-X", "", "")
+    assert len(fakeTenant.requests) == 2
+
+def test_stats_count_negative_entries(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS + "/HOST-X"] = NOT_FOUND
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    with pytest.raises(dtcli.DynatraceAPIError):
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS + "/HOST-X", "", "")
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    statistics = dtcli.doCache(False, ["dtcli", "cache", "stats"], False)["tenants"][0]
+    assert (statistics["entries"], statistics["negativeentries"]) == (2, 1)
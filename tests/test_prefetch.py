@@ -0,0 +1,71 @@
+# user-014: learn which query follows which and prefetch the follow-ups in the background
+import time
+
+import pytest
+
+@pytest.fixture
+def tenant(dtcli, fakeTenant):
+    dtcli.config.update({"prefetch" : 1, "cacheupdate" : 3600, "memocache" : 0})
+    fakeTenant.routes[dtcli.API_ENDPOINT_SERVICES] = [{"entityId" : "SERVICE-1"}]
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = lambda httpMethod, apiEndpoint, queryString, headers: {"result" : {"dataPoints" : {"SERVICE-1" : [[1000, 1.0]]}, "query" : queryString}}
+    return fakeTenant
+
+def learnSequence(dtcli, times):
+    for i in range(times):
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_SERVICES, "", "")
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x", "")
+    dtcli.waitForPrefetches()
+
+def removeFromCache(dtcli, apiEndpoint, queryString):
+    dtcli.getCacheBackend().removeEntry(dtcli.getCacheTenant(), dtcli.getCacheKeyHash(dtcli.getCacheKey(apiEndpoint, queryString)))
+
+def test_follow_up_is_prefetched_once_learned(dtcli, tenant):
+    learnSequence(dtcli, 2)
+    assert dtcli.getPrefetchModel(dtcli.getCacheTenant()).getFollowUps(dtcli.API_ENDPOINT_SERVICES + "?") == [dtcli.API_ENDPOINT_TIMESERIES + "?timeseriesId=x"]
+
+    removeFromCache(dtcli, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x")
+    tenant.requests.clear()
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_SERVICES, "", "")
+    dtcli.waitForPrefetches()
+    assert tenant.queries() == ["timeseriesId=x"]
+    assert dtcli.global_prefetchStatistics["prefetched"] == 1
+
+    # the follow-up itself now comes from the cache and counts as prefetch hit
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x", "")
+    assert len(tenant.requests) == 1
+    assert dtcli.getPrefetchStatistics(dtcli.getCacheTenant()) == {"prefetched" : 1, "prefetchhits" : 1, "prefetchhitratio" : 1.0}
+
+def test_a_single_occurrence_is_not_enough(dtcli, tenant):
+    learnSequence(dtcli, 1)
+    assert dtcli.getPrefetchModel(dtcli.getCacheTenant()).getFollowUps(dtcli.API_ENDPOINT_SERVICES + "?") == []
+
+def test_cached_follow_ups_are_skipped(dtcli, tenant):
+    # the third round prefetches the timeseries after the services - and the services after the timeseries
+    learnSequence(dtcli, 3)
+    assert dtcli.global_prefetchStatistics["skipped"] == 2
+    assert dtcli.global_prefetchStatistics["prefetched"] == 0
+
+def test_prefetch_stays_within_prefetchbytes(dtcli, tenant):
+    dtcli.config["prefetchbytes"] = 0
+    learnSequence(dtcli, 3)
+    assert dtcli.global_prefetchStatistics["overbudget"] == 2
+    assert dtcli.global_prefetchStatistics["scheduled"] == 0
+
+def test_learned_model_survives_the_run(dtcli, tenant):
+    learnSequence(dtcli, 2)
+    dtcli.flushPrefetchModels()
+    dtcli.global_prefetchModels.clear()
+    assert dtcli.getPrefetchModel(dtcli.getCacheTenant()).getFollowUps(dtcli.API_ENDPOINT_SERVICES + "?") == [dtcli.API_ENDPOINT_TIMESERIES + "?timeseriesId=x"]
+
+def test_timestamps_are_learned_relative_to_now(dtcli):
+    nowTimestamp = dtcli.getAlignedNowTimestamp() * 1000
+    template = dtcli.getPrefetchTemplate(dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x&startTimestamp=" + str(nowTimestamp - 3600000) + "&endTimestamp=" + str(nowTimestamp))
+    assert template == dtcli.API_ENDPOINT_TIMESERIES + "?timeseriesId=x&startTimestamp={now-3600000}&endTimestamp={now-0}"
+    assert dtcli.resolvePrefetchTemplate(template) == (dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x&startTimestamp=" + str(nowTimestamp - 3600000) + "&endTimestamp=" + str(nowTimestamp))
+
+    # timestamps long ago stay absolute
+    assert dtcli.getPrefetchTemplate(dtcli.API_ENDPOINT_TIMESERIES, "startTimestamp=1500000000000") == dtcli.API_ENDPOINT_TIMESERIES + "?startTimestamp=1500000000000"
+
+def test_no_prefetch_when_we_only_use_the_cache(dtcli):
+    dtcli.config.update({"prefetch" : 1, "cacheupdate" : -1})
+    assert not dtcli.isPrefetchEnabled()
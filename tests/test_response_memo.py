@@ -0,0 +1,48 @@
+# user-004: repeated identical reads within a run are served from the in-memory memo
+def test_repeated_get_is_served_from_memo(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    first = dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    second = dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert second is first
+    assert len(fakeTenant.requests) == 1
+    assert dtcli.global_responseMemoStatistics["hits"] == 1
+
+def test_memo_key_includes_the_tenant(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = []
+    dtcli.config["cachenegative"] = 0
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    dtcli.config["tenanthost"] = "other.live.dynatrace.com"
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert len(fakeTenant.requests) == 2
+
+def test_writes_clear_the_memo(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    fakeTenant.routes[dtcli.API_ENDPOINT_EVENTS] = {"storedEventIds" : [1]}
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    dtcli.queryDynatraceAPI(False, dtcli.API_ENDPOINT_EVENTS, "", {"eventType" : "CUSTOM_INFO"})
+    assert len(dtcli.global_responseMemo) == 0
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert [request[1] for request in fakeTenant.requests] == [dtcli.API_ENDPOINT_HOSTS, dtcli.API_ENDPOINT_EVENTS, dtcli.API_ENDPOINT_HOSTS]
+
+def test_memo_evicts_least_recently_used_within_its_bytes(dtcli):
+    dtcli.config["memocache"] = 100
+    a, b, c = [dtcli.getResponseMemoKey(dtcli.HTTP_GET, dtcli.API_ENDPOINT_HOSTS, queryString) for queryString in ["a", "b", "c"]]
+    dtcli.storeResponseMemo(a, {"a" : 1}, 40)
+    dtcli.storeResponseMemo(b, {"b" : 1}, 40)
+    dtcli.lookupResponseMemo(a)
+    dtcli.storeResponseMemo(c, {"c" : 1}, 40)
+    assert list(dtcli.global_responseMemo.keys()) == [a, c]
+    assert dtcli.global_responseMemoStatistics["bytes"] == 80
+
+def test_responses_larger_than_the_memo_are_not_kept(dtcli):
+    dtcli.config["memocache"] = 10
+    memoKey = dtcli.getResponseMemoKey(dtcli.HTTP_GET, dtcli.API_ENDPOINT_HOSTS, "")
+    dtcli.storeResponseMemo(memoKey, {"a" : 1}, 11)
+    assert dtcli.lookupResponseMemo(memoKey) is None
+
+def test_memo_turned_off(dtcli, fakeTenant):
+    dtcli.config["memocache"] = 0
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert len(fakeTenant.requests) == 2
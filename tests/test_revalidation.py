@@ -0,0 +1,65 @@
+# user-010: expired entries with ETag / Last-Modified are revalidated with a conditional request
+import time
+
+import pytest
+
+from conftest import FakeResponse
+
+LAST_MODIFIED = "Wed, 21 Oct 2026 07:28:00 GMT"
+
+class VersionedHosts:
+    "Returns the current hosts with their ETag - or 304 if the request already has that ETag"
+    def __init__(self):
+        self.version = 1
+
+    def __call__(self, httpMethod, apiEndpoint, queryString, headers):
+        etag = "\"v" + str(self.version) + "\""
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(304, "")
+        return FakeResponse(200, [{"entityId" : "HOST-" + str(self.version)}], {"ETag" : etag, "Last-Modified" : LAST_MODIFIED})
+
+@pytest.fixture(params=["file", "sqlite"])
+def versionedHosts(request, dtcli, fakeTenant):
+    dtcli.config.update({"cachebackend" : request.param, "memocache" : 0})
+    versionedHosts = VersionedHosts()
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = versionedHosts
+    return versionedHosts
+
+def test_not_modified_serves_the_cached_content(dtcli, fakeTenant, versionedHosts):
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    storedAt = dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").storedAt
+    time.sleep(0.01)
+
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "") == [{"entityId" : "HOST-1"}]
+    assert fakeTenant.requests[0][3] == {}
+    assert fakeTenant.requests[1][3] == {"If-None-Match" : "\"v1\"", "If-Modified-Since" : LAST_MODIFIED}
+    assert dtcli.global_revalidationStatistics == {"notmodified" : 1, "modified" : 0}
+
+    # the revalidated entry counts as stored right now
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").storedAt > storedAt
+
+def test_modified_replaces_content_and_validators(dtcli, fakeTenant, versionedHosts):
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    versionedHosts.version = 2
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "") == [{"entityId" : "HOST-2"}]
+    assert dtcli.global_revalidationStatistics == {"notmodified" : 0, "modified" : 1}
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").validators == {"etag" : "\"v2\"", "lastModified" : LAST_MODIFIED}
+
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert fakeTenant.requests[2][3]["If-None-Match"] == "\"v2\""
+    assert dtcli.global_revalidationStatistics["notmodified"] == 1
+
+def test_responses_without_validators_are_fetched_again(dtcli, fakeTenant):
+    dtcli.config["memocache"] = 0
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    assert [request[3] for request in fakeTenant.requests] == [{}, {}]
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").validators is None
+
+def test_conditional_headers(dtcli):
+    assert dtcli.getConditionalRequestHeaders(None) is None
+    assert dtcli.getConditionalRequestHeaders({"etag" : None, "lastModified" : None}) is None
+    assert dtcli.getConditionalRequestHeaders({"etag" : "\"v1\"", "lastModified" : None}) == {"If-None-Match" : "\"v1\""}
+    assert dtcli.getResponseValidators(FakeResponse(200, [])) is None
+    assert dtcli.getResponseValidators(FakeResponse(200, [], {"last-modified" : LAST_MODIFIED})) == {"lastModified" : LAST_MODIFIED}
@@ -0,0 +1,70 @@
+# user-008: atomic cache writes and one API call per query across threads and processes sharing a cachedir
+import os
+import time
+import threading
+
+import pytest
+
+def test_atomic_write(dtcli, tmp_path):
+    filename = str(tmp_path / "shard" / "entry.json")
+    dtcli.writeFileAtomically(filename, "[1]", 1500000000)
+    with open(filename) as cacheFile:
+        assert cacheFile.read() == "[1]"
+    assert os.path.getmtime(filename) == 1500000000
+
+def test_failed_write_keeps_the_old_file(dtcli, tmp_path):
+    filename = str(tmp_path / "entry.json")
+    dtcli.writeFileAtomically(filename, "[1]")
+    with pytest.raises(TypeError):
+        dtcli.writeFileAtomically(filename, None)
+    with open(filename) as cacheFile:
+        assert cacheFile.read() == "[1]"
+    assert os.listdir(str(tmp_path)) == ["entry.json"]
+
+def test_concurrent_identical_queries_call_the_api_once(dtcli, fakeTenant):
+    dtcli.config.update({"cacheupdate" : 60, "memocache" : 0})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = lambda httpMethod, apiEndpoint, queryString, headers: time.sleep(0.05) or [{"entityId" : "HOST-1"}]
+
+    results = [None] * 8
+    def query(index):
+        results[index] = dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    threads = [threading.Thread(target=query, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fakeTenant.requests) == 1
+    assert results == [[{"entityId" : "HOST-1"}]] * 8
+
+def test_waits_for_another_process_filling_the_same_entry(dtcli, fakeTenant):
+    dtcli.config["cacheupdate"] = 60
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "FROM-API"}]
+
+    # the other process holds the fill lock of that query while it asks the API
+    otherProcessLock = dtcli.CacheFileLock(dtcli.getCacheFillLockFilename(dtcli.API_ENDPOINT_HOSTS, ""))
+    otherProcessLock.acquire()
+    results = []
+    waitingQuery = threading.Thread(target=lambda: results.append(dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")))
+    waitingQuery.start()
+    time.sleep(0.1)
+    assert results == []
+
+    dtcli.FileCacheBackend(dtcli.getCacheDirectory()).store(dtcli.API_ENDPOINT_HOSTS, "", "[{\"entityId\" : \"FROM-OTHER-PROCESS\"}]")
+    otherProcessLock.release()
+    waitingQuery.join()
+
+    assert results == [[{"entityId" : "FROM-OTHER-PROCESS"}]]
+    assert fakeTenant.requests == []
+
+def test_distinct_queries_share_a_bounded_number_of_lock_files(dtcli, fakeTenant):
+    dtcli.config.update({"cacheupdate" : 60, "memocache" : 0})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1"}]
+    for index in range(300):
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "tag=" + str(index), "")
+
+    # one lock file per hash shard - not one per query
+    lockFilenames = [filename for directory, subdirectories, filenames in os.walk(dtcli.getCacheDirectory()) for filename in filenames if filename.endswith(".lock")]
+    assert set(lockFilenames) <= {dtcli.CACHE_FILL_LOCK_FILENAME, "cacheindex.lock"}
+    assert 0 < lockFilenames.count(dtcli.CACHE_FILL_LOCK_FILENAME) <= 256
+    assert len(fakeTenant.requests) == 300
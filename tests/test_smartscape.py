@@ -0,0 +1,111 @@
+# user-023: smartscape traversals are answered locally from a graph of all cached entity lists
+import pytest
+
+def makeNode(entityId, displayName, fromRelationships=None, toRelationships=None):
+    return {"entityId" : entityId, "displayName" : displayName, "fromRelationships" : fromRelationships or {}, "toRelationships" : toRelationships or {}}
+
+SMARTSCAPE_LISTS = {
+    "applications" : [makeNode("APPLICATION-1", "shop", {"calls" : ["SERVICE-1"]})],
+    "services" : [
+        makeNode("SERVICE-1", "frontend", {"calls" : ["SERVICE-2"], "runsOn" : ["PROCESS_GROUP-1"]}, {"calls" : ["APPLICATION-1"]}),
+        makeNode("SERVICE-2", "checkout", {"calls" : ["SERVICE-3", "SERVICE-9"]}, {"calls" : ["SERVICE-1"]}),
+        makeNode("SERVICE-3", "payment", {"calls" : ["SERVICE-1"]}, {"calls" : ["SERVICE-2"]})],
+    "processGroups" : [makeNode("PROCESS_GROUP-1", "tomcat", {"runsOn" : ["HOST-1"]})],
+    "hosts" : [makeNode("HOST-1", "host1")],
+    "processes" : []}
+
+@pytest.fixture
+def smartscape(dtcli, fakeTenant):
+    dtcli.config["cacheupdate"] = -1
+    endpoints = {"applications" : dtcli.API_ENDPOINT_APPLICATIONS, "services" : dtcli.API_ENDPOINT_SERVICES, "processGroups" : dtcli.API_ENDPOINT_PROCESS_GROUPS,
+                 "hosts" : dtcli.API_ENDPOINT_HOSTS, "processes" : dtcli.API_ENDPOINT_PROCESSES}
+    entityLists = {}
+    for listName, apiEndpoint in endpoints.items():
+        fakeTenant.routes[apiEndpoint] = SMARTSCAPE_LISTS[listName]
+        entityLists[apiEndpoint] = SMARTSCAPE_LISTS[listName]
+    return entityLists
+
+def test_build_and_count_relationships(dtcli, smartscape):
+    graph = dtcli.SmartscapeGraph({}).build(smartscape)
+    assert graph.countRelationships("SERVICE-2", "fromRelationships", "calls") == 2
+    assert graph.countRelationships("SERVICE-1", "fromRelationships", "*") == 2
+    assert graph.countRelationships("HOST-1", "fromRelationships", "calls") == 0
+    # SERVICE-9 is only a target - we dont know its type
+    assert graph.countRelationships("SERVICE-9", "fromRelationships", "calls") is None
+    assert graph.countRelationships("SERVICE-0", "fromRelationships", "calls") is None
+
+def test_graph_json_roundtrip(dtcli, smartscape):
+    graph = dtcli.SmartscapeGraph({}).build(smartscape)
+    loadedGraph = dtcli.SmartscapeGraph({}).fromJson(graph.toJson())
+    assert loadedGraph.entityIds == graph.entityIds
+    assert loadedGraph.traverse(["APPLICATION-1"], "fromRelationships", "calls", 3) == graph.traverse(["APPLICATION-1"], "fromRelationships", "calls", 3)
+
+@pytest.mark.parametrize("entityIds,relationshipList,relationshipName,maxHops,reached", [
+    (["APPLICATION-1"], "fromRelationships", "calls", 1, ["SERVICE-1"]),
+    (["APPLICATION-1"], "fromRelationships", "calls", 3, ["SERVICE-1", "SERVICE-2", "SERVICE-3", "SERVICE-9"]),
+    (["SERVICE-1"], "fromRelationships", "calls", 5, ["SERVICE-2", "SERVICE-3", "SERVICE-9"]),
+    (["SERVICE-1"], "fromRelationships", "*", 2, ["SERVICE-2", "PROCESS_GROUP-1", "SERVICE-3", "SERVICE-9", "HOST-1"]),
+    (["SERVICE-3"], "toRelationships", "calls", 2, ["SERVICE-2", "SERVICE-1"]),
+    (["SERVICE-1"], "fromRelationships", "monitors", 2, []),
+    (["SERVICE-0"], "fromRelationships", "calls", 2, [])])
+def test_traverse(dtcli, smartscape, entityIds, relationshipList, relationshipName, maxHops, reached):
+    graph = dtcli.SmartscapeGraph({}).build(smartscape)
+    assert [graph.entityIds[position] for position in graph.traverse(entityIds, relationshipList, relationshipName, maxHops)] == reached
+
+def test_parse_traversal(dtcli):
+    assert dtcli.parseSmartscapeTraversal(dtcli.parseNameValue("smartscape/fromRelationships:calls*3=APPLICATION-1,APPLICATION-2", "displayName", "")) == ("fromRelationships", "calls", 3, ["APPLICATION-1", "APPLICATION-2"])
+    assert dtcli.parseSmartscapeTraversal(dtcli.parseNameValue("smartscape/toRelationships:*=HOST-1", "displayName", "")) == ("toRelationships", "*", 1, ["HOST-1"])
+    assert dtcli.parseSmartscapeTraversal(dtcli.parseNameValue("fromRelationships/calls=SERVICE-1", "displayName", "")) is None
+    assert dtcli.parseSmartscapeTraversal(None) is None
+
+@pytest.mark.parametrize("filterString", ["smartscape/sideRelationships:calls=HOST-1", "smartscape/fromRelationships=HOST-1", "smartscape/fromRelationships:calls*x=HOST-1"])
+def test_parse_traversal_errors(dtcli, filterString):
+    with pytest.raises(Exception) as error:
+        dtcli.parseSmartscapeTraversal(dtcli.parseNameValue(filterString, "displayName", ""))
+    assert error.value.args[0] == "Error"
+
+def test_ent_traversal(dtcli, fakeTenant, smartscape):
+    assert dtcli.doEntity(False, ["dtcli", "ent", "srv", "smartscape/fromRelationships:calls*2=APPLICATION-1"], False) == ["SERVICE-1", "SERVICE-2"]
+    assert dtcli.doEntity(False, ["dtcli", "ent", "srv", "smartscape/fromRelationships:calls*3=APPLICATION-1", "displayName"], False) == ["frontend", "checkout", "payment"]
+    assert dtcli.doEntity(False, ["dtcli", "ent", "host", "smartscape/fromRelationships:*=SERVICE-1,PROCESS_GROUP-1"], False) == ["HOST-1"]
+    # every list is queried once
+    assert sorted(request[1] for request in fakeTenant.requests) == sorted(smartscape.keys())
+
+def test_graph_is_persisted_and_rebuilt_when_a_list_changes(dtcli, fakeTenant, smartscape):
+    graph = dtcli.getSmartscapeGraph()
+    dtcli.global_smartscapeGraphs.clear()
+    assert dtcli.getSmartscapeGraph().entityIds == graph.entityIds
+
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", '[{"entityId" : "HOST-2", "fromRelationships" : {}, "toRelationships" : {}}]')
+    dtcli.clearResponseMemo()
+    assert "HOST-2" in dtcli.getSmartscapeGraph().positions
+    assert dtcli.getSmartscapeGraph().countRelationships("HOST-1", "fromRelationships", "*") is None
+
+def test_lists_that_fail_are_left_out(dtcli, fakeTenant, smartscape):
+    del fakeTenant.routes[dtcli.API_ENDPOINT_PROCESSES]
+    graph = dtcli.getSmartscapeGraph()
+    assert graph.versions[dtcli.API_ENDPOINT_PROCESSES] is None
+    assert graph.countRelationships("SERVICE-2", "fromRelationships", "calls") == 2
+
+def pullSmartscapeMetric(dtcli):
+    monspec = {"MyService" : {"perfsignature" : [{"smartscape" : "fromRelationships:calls"}]}}
+    return dtcli.pullMonspecMetrics(monspec, "MyService", "Staging", "60", "0", "result", dtcli.MONSPEC_DATAHANDLING_NORMAL)[0]["result"]
+
+def test_monspec_only_uses_the_graph_when_all_lists_are_cached(dtcli, fakeTenant, smartscape, monkeypatch):
+    entityQueries = []
+    def queryEntities(monspec, entitydefname, environmentdefname, returnedFieldList, fields=None):
+        entityQueries.append(returnedFieldList)
+        return ["SERVICE-2"] if returnedFieldList == "entityId" else [SMARTSCAPE_LISTS["services"][1]]
+    monkeypatch.setattr(dtcli, "queryEntitiesForMonspecEnvironmentEx", queryEntities)
+
+    # nothing cached yet - we query the matched entities instead of downloading the whole topology
+    assert pullSmartscapeMetric(dtcli) == 2
+    assert entityQueries == ["entityId", "*"]
+    assert fakeTenant.requests == []
+
+    for apiEndpoint in smartscape:
+        dtcli.queryDynatraceAPI(True, apiEndpoint, "", "")
+    entityQueries.clear()
+    assert pullSmartscapeMetric(dtcli) == 2
+    assert entityQueries == ["entityId"]
+    assert len(fakeTenant.requests) == len(smartscape)
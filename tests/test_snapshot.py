@@ -0,0 +1,72 @@
+# user-015: snapshot archives of a tenant's cache for offline replay
+import os
+import shutil
+
+import pytest
+
+from conftest import SMPLJSON_DIRECTORY, FakeResponse, makeTimeseriesResult
+
+def fillCache(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-1", "displayName" : "wéb1"}]
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesResult("x", {"HOST-1" : [[1000, 1.0]]}, resolution=300000)
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS + "/HOST-X"] = FakeResponse(404, {"error" : {"code" : 404, "message" : "not found"}})
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x", "")
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = []
+    dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "tag=Nope", "")
+    with pytest.raises(dtcli.DynatraceAPIError):
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS + "/HOST-X", "", "")
+
+@pytest.mark.parametrize("cachebackend", ["file", "sqlite"])
+def test_export_and_replay_offline(dtcli, fakeTenant, tmp_path, cachebackend):
+    dtcli.config["cachebackend"] = cachebackend
+    fillCache(dtcli, fakeTenant)
+    snapshotfile = str(tmp_path / "tenant.dtsnap")
+    # API errors are not worth replaying - empty results are legitimate answers
+    assert dtcli.doSnapshot(False, ["dtcli", "snapshot", "export", snapshotfile], False)["exported"] == 3
+
+    # replay it as another tenant in an empty cachedir - without any API
+    dtcli.config.update({"cachedir" : str(tmp_path / "offline"), "tenanthost" : "replay", "cacheupdate" : -1})
+    dtcli.clearResponseMemo()
+    fakeTenant.routes.clear()
+    assert dtcli.doSnapshot(False, ["dtcli", "snapshot", "import", snapshotfile, "replay"], False) == {"snapshot" : snapshotfile, "tenant" : "replay", "imported" : 3}
+    assert os.path.isfile(str(tmp_path / "offline" / "replay.dtsnap"))
+
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "") == [{"entityId" : "HOST-1", "displayName" : "wéb1"}]
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "tag=Nope", "") == []
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_TIMESERIES, "timeseriesId=x").resolution == 300000
+    assert len(fakeTenant.requests) == 4
+
+def test_import_defaults_to_the_exported_tenant(dtcli, fakeTenant, tmp_path):
+    fillCache(dtcli, fakeTenant)
+    snapshotfile = str(tmp_path / "tenant.dtsnap")
+    dtcli.exportCacheSnapshot(snapshotfile, dtcli.getCacheTenant())
+    dtcli.config["cachedir"] = str(tmp_path / "offline")
+    assert dtcli.importCacheSnapshot(snapshotfile) == ("abc12345_live_dynatrace_com", 3)
+
+def test_cache_backend_wins_over_the_snapshot(dtcli, fakeTenant, tmp_path):
+    fillCache(dtcli, fakeTenant)
+    snapshotfile = str(tmp_path / "tenant.dtsnap")
+    dtcli.exportCacheSnapshot(snapshotfile, dtcli.getCacheTenant())
+    dtcli.importCacheSnapshot(snapshotfile)
+
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_HOSTS, "", "[{\"entityId\" : \"HOST-2\"}]")
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").getContent() == [{"entityId" : "HOST-2"}]
+
+def test_export_old_layout_directory(dtcli, tmp_path):
+    # e.g: our smpljson demo data
+    shutil.copytree(SMPLJSON_DIRECTORY, str(tmp_path / "cache" / "smpljson"))
+    dtcli.config["tenanthost"] = "smpljson"
+    snapshotfile = str(tmp_path / "smpljson.dtsnap")
+    assert dtcli.exportCacheSnapshot(snapshotfile, "smpljson") == len(dtcli.listCacheFiles(SMPLJSON_DIRECTORY))
+
+    snapshot = dtcli.CacheSnapshot(snapshotfile)
+    cacheKey = dtcli.getCacheKey(dtcli.API_ENDPOINT_HOSTS, "")
+    assert snapshot.lookup(cacheKey).getContent() == dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").getContent()
+
+def test_import_rejects_other_files(dtcli, tmp_path):
+    notASnapshot = tmp_path / "notasnapshot.dtsnap"
+    notASnapshot.write_bytes(b"{\"this is\" : \"json\"}")
+    with pytest.raises(Exception) as e:
+        dtcli.doSnapshot(False, ["dtcli", "snapshot", "import", str(notASnapshot)], False)
+    assert "is not a dtcli snapshot" in e.value.args[1]
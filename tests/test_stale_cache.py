@@ -0,0 +1,49 @@
+# user-009: stale-while-revalidate - entries past cacheupdate but within cachestale are served and refreshed in the background
+import time
+
+import pytest
+
+from conftest import FakeResponse
+
+def storeAgedHosts(dtcli, age, jsonText="[{\"entityId\" : \"HOST-OLD\"}]"):
+    dtcli.getCacheBackend().storeEx(dtcli.getCacheTenant(), dtcli.getCacheKey(dtcli.API_ENDPOINT_HOSTS, ""), dtcli.API_ENDPOINT_HOSTS, time.time() - age, jsonText)
+
+@pytest.mark.parametrize("age,cachestale,state", [(10, 30, "fresh"), (70, 30, "stale"), (100, 30, "expired"), (70, 0, "expired")])
+def test_entry_states(dtcli, age, cachestale, state):
+    dtcli.config.update({"cacheupdate" : 60, "cachestale" : cachestale})
+    cacheEntry = dtcli.CacheEntry(time.time() - age, 10, lambda: [])
+    assert dtcli.getCacheEntryState(cacheEntry, dtcli.API_ENDPOINT_HOSTS, "") == state
+
+def test_stale_entry_is_served_and_refreshed_in_the_background(dtcli, fakeTenant):
+    dtcli.config.update({"cacheupdate" : 60, "cachestale" : 600})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = [{"entityId" : "HOST-NEW"}]
+    storeAgedHosts(dtcli, 120)
+
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "") == [{"entityId" : "HOST-OLD"}]
+    dtcli.waitForCacheRefreshes()
+    assert len(fakeTenant.requests) == 1
+    assert dtcli.global_cacheRefreshStatistics["refreshed"] == 1
+
+    cacheEntry = dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "")
+    assert cacheEntry.getContent() == [{"entityId" : "HOST-NEW"}]
+    assert dtcli.getCacheEntryState(cacheEntry, dtcli.API_ENDPOINT_HOSTS, "") == dtcli.CACHE_STATE_FRESH
+
+def test_failed_refresh_keeps_the_stale_entry(dtcli, fakeTenant):
+    dtcli.config.update({"cacheupdate" : 60, "cachestale" : 600})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = FakeResponse(503, {"error" : {"code" : 503, "message" : "unavailable"}})
+    storeAgedHosts(dtcli, 120)
+
+    assert dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "") == [{"entityId" : "HOST-OLD"}]
+    dtcli.waitForCacheRefreshes()
+    assert dtcli.global_cacheRefreshStatistics["failed"] == 1
+    assert dtcli.getCacheBackend().lookup(dtcli.API_ENDPOINT_HOSTS, "").getContent() == [{"entityId" : "HOST-OLD"}]
+
+def test_refresh_is_only_scheduled_once(dtcli, fakeTenant):
+    dtcli.config.update({"cacheupdate" : 60, "cachestale" : 600, "memocache" : 0})
+    fakeTenant.routes[dtcli.API_ENDPOINT_HOSTS] = lambda httpMethod, apiEndpoint, queryString, headers: time.sleep(0.1) or [{"entityId" : "HOST-NEW"}]
+    storeAgedHosts(dtcli, 120)
+
+    for i in range(3):
+        dtcli.queryDynatraceAPI(True, dtcli.API_ENDPOINT_HOSTS, "", "")
+    dtcli.waitForCacheRefreshes()
+    assert len(fakeTenant.requests) == 1
@@ -0,0 +1,59 @@
+# user-005: indexed timeseries catalog gives the same answers as the full scan
+import pytest
+
+TIMESERIES_LIST = [
+    {"timeseriesId" : "com.dynatrace.builtin:service.responsetime", "displayName" : "Response time", "dimensions" : ["SERVICE"], "unit" : "MicroSecond (us)", "detailedSource" : "Services"},
+    {"timeseriesId" : "com.dynatrace.builtin:service.failurerate", "displayName" : "Failure rate", "dimensions" : ["SERVICE"], "unit" : "Percent (%)", "detailedSource" : "Services"},
+    {"timeseriesId" : "com.dynatrace.builtin:host.cpu.system", "displayName" : "CPU system", "dimensions" : ["HOST"], "unit" : "Percent (%)", "detailedSource" : "Infrastructure"},
+    {"timeseriesId" : "com.dynatrace.builtin:appmethod.useractionduration", "displayName" : "User action duration", "dimensions" : ["APPLICATION_METHOD", "APPLICATION"], "unit" : "MicroSecond (us)"},
+    {"timeseriesId" : "custom:jmx.tomcat.jdbc.pool:Active", "displayName" : "Active connections", "dimensions" : [], "unit" : "Count (count)"}
+]
+
+@pytest.fixture
+def catalog(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = TIMESERIES_LIST
+    return dtcli.getTimeseriesCatalog()
+
+@pytest.mark.parametrize("key,matchValue,returnKey", [
+    ("displayName", ".*response.*", "timeseriesId"),
+    ("displayName", ".*rate", "timeseriesId"),
+    ("displayName", "CPU.*", "displayName"),
+    ("timeseriesId", "com\\.dynatrace\\.builtin:service\\..*", "timeseriesId"),
+    ("timeseriesId", ".*(cpu|pool).*", "timeseriesId"),
+    ("dimensions", "APPLICATION.*", "timeseriesId"),
+    ("unit", "Percent.*", "timeseriesId"),
+    ("displayName", "nothing matches this", "timeseriesId")])
+def test_index_search_matches_the_full_scan(dtcli, catalog, key, matchValue, returnKey):
+    assert catalog.findValuesByKey(key, matchValue, returnKey) == dtcli.jsonFindValuesByKey(TIMESERIES_LIST, key, matchValue, returnKey)
+
+def test_describe_by_timeseries_id(catalog):
+    assert catalog.describe("com.dynatrace.builtin:host.cpu.system")["displayName"] == "CPU system"
+    assert catalog.describe("com.dynatrace.builtin:unknown") is None
+
+def test_searches_the_index_cant_answer_return_none(catalog):
+    assert catalog.findValuesByKey("tags/AWS:Name", ".*", "timeseriesId") is None
+    assert catalog.findValuesByKey("aggregationTypes", ".*", "timeseriesId") is None
+    assert catalog.findValuesByKey("displayName", None, "timeseriesId") is None
+
+def test_catalog_is_persisted_and_reused(dtcli, fakeTenant, monkeypatch):
+    dtcli.config["cacheupdate"] = -1
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = TIMESERIES_LIST
+    catalog = dtcli.getTimeseriesCatalog()
+    assert dtcli.getTimeseriesCatalog() is catalog
+
+    # a new run only loads the persisted index
+    dtcli.global_timeseriesCatalogs.clear()
+    dtcli.clearResponseMemo()
+    monkeypatch.setattr(dtcli.TimeseriesCatalog, "build", lambda self: pytest.fail("catalog rebuilt although the cached list didnt change"))
+    assert dtcli.getTimeseriesCatalog().byTimeseriesId == catalog.byTimeseriesId
+    assert len(fakeTenant.requests) == 1
+
+@pytest.mark.parametrize("pattern,literals", [
+    (".*response.*", ["response"]),
+    ("com\\.dynatrace\\..*", ["com.dynatrace."]),
+    ("ab.*cde[0-9]+fgh", ["cde", "fgh"]),
+    ("service.responsetime?", ["service", "responsetim"]),
+    ("(cpu|pool)", None),
+    ("a|b", None)])
+def test_required_literals_of_regex(dtcli, pattern, literals):
+    assert dtcli.getRegexRequiredLiterals(pattern) == literals
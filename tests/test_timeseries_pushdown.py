@@ -0,0 +1,69 @@
+# user-024: ts query only asks the API for the series of the entities it needs - in chunks it merges again
+import urllib.parse
+
+import pytest
+
+from conftest import makeTimeseriesResult, makeTimeseriesRoute
+
+TIMESERIES_ID = "com.dynatrace.builtin:service.responsetime"
+QUERY_STRING = "timeseriesId=" + TIMESERIES_ID + "&relativeTime=hour&aggregationType=avg"
+
+def getEntityParameters(queryString):
+    return urllib.parse.parse_qs(queryString).get("entity", [])
+
+def test_entities_are_sorted_and_quoted(dtcli):
+    assert dtcli.getTimeseriesEntityQueryStrings(QUERY_STRING, ["SERVICE-2", "SERVICE-1", "SERVICE-2", "a b&c"]) == [QUERY_STRING + "&entity=SERVICE-1&entity=SERVICE-2&entity=a%20b%26c"]
+
+def test_long_lists_are_chunked(dtcli):
+    entityIds = ["SERVICE-" + str(number).zfill(3) for number in range(120)]
+    entityQueryStrings = dtcli.getTimeseriesEntityQueryStrings(QUERY_STRING, list(reversed(entityIds)))
+    assert len(entityQueryStrings) == 3
+    assert [len(getEntityParameters(entityQueryString)) for entityQueryString in entityQueryStrings] == [50, 50, 20]
+    assert sum([getEntityParameters(entityQueryString) for entityQueryString in entityQueryStrings], []) == entityIds
+
+def test_no_push_down_without_entities_or_when_cached(dtcli):
+    assert dtcli.getTimeseriesEntityQueryStrings(QUERY_STRING, None) == [QUERY_STRING]
+    assert dtcli.getTimeseriesEntityQueryStrings(QUERY_STRING, []) == [QUERY_STRING]
+    dtcli.config["cacheupdate"] = -1
+    dtcli.getCacheBackend().store(dtcli.API_ENDPOINT_TIMESERIES, QUERY_STRING, "{}")
+    assert dtcli.getTimeseriesEntityQueryStrings(QUERY_STRING, ["SERVICE-1"]) == [QUERY_STRING]
+
+def test_merge_chunk_results(dtcli):
+    first = makeTimeseriesResult(TIMESERIES_ID, {"SERVICE-1" : [[1, 1.0]]})
+    second = makeTimeseriesResult(TIMESERIES_ID, {"SERVICE-2" : [[1, 2.0]]})
+    merged = dtcli.mergeTimeseriesResults([first, {"result" : None}, second])
+    assert merged["result"]["dataPoints"] == {"SERVICE-1" : [[1, 1.0]], "SERVICE-2" : [[1, 2.0]]}
+    assert merged["result"]["entities"] == {"SERVICE-1" : "SERVICE-1 name", "SERVICE-2" : "SERVICE-2 name"}
+    assert merged["result"]["unit"] == first["result"]["unit"]
+    # the chunk responses might be memoized - they stay as they were
+    assert first == makeTimeseriesResult(TIMESERIES_ID, {"SERVICE-1" : [[1, 1.0]]})
+    assert dtcli.mergeTimeseriesResults([{"result" : None}]) == {"result" : None}
+
+@pytest.fixture
+def timeseriesRoute(dtcli, fakeTenant):
+    dataPoints = {"SERVICE-" + str(number).zfill(3) : [[1000, float(number)]] for number in range(120)}
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesRoute({TIMESERIES_ID : dataPoints})
+    return dataPoints
+
+def test_query_chunks_and_merges(dtcli, fakeTenant, timeseriesRoute):
+    entityIds = sorted(timeseriesRoute.keys())[5:115]
+    result = dtcli.doTimeseries(False, ["dtcli", "ts", "query", TIMESERIES_ID + "[avg%hour]", ",".join(entityIds)], False)
+    assert sorted(result.keys()) == entityIds
+    assert result["SERVICE-007"]["dataPoints"] == [[1000, 7.0]]
+    assert result["SERVICE-007"]["entityDisplayName"] == "SERVICE-007 name"
+    # the chunks are queried concurrently - in any order
+    assert sorted([len(getEntityParameters(queryString)) for queryString in fakeTenant.queries(dtcli.API_ENDPOINT_TIMESERIES)]) == [10, 50, 50]
+
+def test_empty_entity_ids_are_dropped(dtcli, fakeTenant, timeseriesRoute):
+    result = dtcli.doTimeseries(False, ["dtcli", "ts", "query", TIMESERIES_ID + "[avg%hour]", "SERVICE-001,,SERVICE-002,"], False)
+    assert sorted(result.keys()) == ["SERVICE-001", "SERVICE-002"]
+    assert getEntityParameters(fakeTenant.queries(dtcli.API_ENDPOINT_TIMESERIES)[0]) == ["SERVICE-001", "SERVICE-002"]
+
+def test_no_entities_no_api_call(dtcli, fakeTenant, timeseriesRoute):
+    assert dtcli.doTimeseries(False, ["dtcli", "ts", "query", TIMESERIES_ID + "[avg%hour]", ","], False) == {}
+    assert fakeTenant.requests == []
+
+def test_queryent_asks_for_all_entities(dtcli, fakeTenant, timeseriesRoute):
+    entities = dtcli.doTimeseries(False, ["dtcli", "ts", "queryent", TIMESERIES_ID + "[avg%hour]"], False)
+    assert len(entities) == 120
+    assert getEntityParameters(fakeTenant.queries(dtcli.API_ENDPOINT_TIMESERIES)[0]) == []
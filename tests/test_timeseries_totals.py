@@ -0,0 +1,86 @@
+# user-025: ts query [aggregation%timeframe%total] returns one total per entity - from the API or reduced by us
+import urllib.parse
+
+import pytest
+
+from conftest import FakeResponse, makeTimeseriesResult, makeTimeseriesRoute
+
+TIMESERIES_ID = "com.dynatrace.builtin:service.responsetime"
+DATA_POINTS = {"SERVICE-1" : [[1000, 1.0], [2000, None], [3000, 5.0]], "SERVICE-2" : [[1000, 2.0], [2000, 4.0]]}
+
+@pytest.mark.parametrize("aggregation,totals", [
+    ("avg", {"SERVICE-1" : [[3000, 3.0]], "SERVICE-2" : [[2000, 3.0]]}),
+    ("sum", {"SERVICE-1" : [[3000, 6.0]], "SERVICE-2" : [[2000, 6.0]]}),
+    ("count", {"SERVICE-1" : [[3000, 6.0]], "SERVICE-2" : [[2000, 6.0]]}),
+    ("min", {"SERVICE-1" : [[3000, 1.0]], "SERVICE-2" : [[2000, 2.0]]}),
+    ("max", {"SERVICE-1" : [[3000, 5.0]], "SERVICE-2" : [[2000, 4.0]]}),
+    ("percentile", {"SERVICE-1" : [[3000, 3.0]], "SERVICE-2" : [[2000, 3.0]]})])
+def test_reduce_per_aggregation(dtcli, aggregation, totals):
+    jsonContent = makeTimeseriesResult(TIMESERIES_ID, DATA_POINTS)
+    reducedContent = dtcli.reduceTimeseriesToTotals(jsonContent, aggregation)
+    assert reducedContent["result"]["dataPoints"] == totals
+    assert reducedContent["result"]["unit"] == jsonContent["result"]["unit"]
+    assert jsonContent["result"]["dataPoints"] == DATA_POINTS
+
+def test_reduce_without_values(dtcli):
+    reducedContent = dtcli.reduceTimeseriesToTotals(makeTimeseriesResult(TIMESERIES_ID, {"SERVICE-1" : [[1000, None], [2000, None]], "SERVICE-2" : []}), "avg")
+    assert reducedContent["result"]["dataPoints"] == {"SERVICE-1" : [[2000, None]], "SERVICE-2" : []}
+
+def test_reduce_leaves_totals_alone(dtcli):
+    jsonContent = makeTimeseriesResult(TIMESERIES_ID, {"SERVICE-1" : [[1000, 1.0]], "SERVICE-2" : []})
+    assert dtcli.reduceTimeseriesToTotals(jsonContent, "sum") is jsonContent
+    assert dtcli.reduceTimeseriesToTotals({"result" : None}, "sum") == {"result" : None}
+
+def getQueryModes(fakeTenant, dtcli):
+    return [urllib.parse.parse_qs(queryString).get("queryMode", ["series"])[0] for queryString in fakeTenant.queries(dtcli.API_ENDPOINT_TIMESERIES)]
+
+def test_total_from_the_api(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesRoute({TIMESERIES_ID : DATA_POINTS})
+    result = dtcli.doTimeseries(False, ["dtcli", "ts", "query", TIMESERIES_ID + "[avg%hour%total]", "SERVICE-2"], False)
+    assert result["SERVICE-2"]["dataPoints"] == [[2000, 3.0]]
+    assert getQueryModes(fakeTenant, dtcli) == ["total"]
+
+def test_rejected_total_falls_back_to_the_series(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = makeTimeseriesRoute({TIMESERIES_ID : DATA_POINTS}, rejectTotals=True)
+    result = dtcli.doTimeseries(False, ["dtcli", "ts", "query", TIMESERIES_ID + "[max%hour%total]", "SERVICE-1,SERVICE-2"], False)
+    assert result["SERVICE-1"]["dataPoints"] == [[3000, 5.0]]
+    assert result["SERVICE-2"]["dataPoints"] == [[2000, 4.0]]
+    assert getQueryModes(fakeTenant, dtcli) == ["total", "series"]
+
+def test_ignored_total_gets_reduced(dtcli, fakeTenant):
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = lambda httpMethod, apiEndpoint, queryString, headers: makeTimeseriesResult(TIMESERIES_ID, DATA_POINTS)
+    result = dtcli.queryTimeseriesTotals("timeseriesId=" + TIMESERIES_ID + "&relativeTime=hour&aggregationType=sum", None, "sum")
+    assert result["result"]["dataPoints"] == {"SERVICE-1" : [[3000, 6.0]], "SERVICE-2" : [[2000, 6.0]]}
+    assert getQueryModes(fakeTenant, dtcli) == ["total"]
+
+def raiseTimeout(httpMethod, apiEndpoint, queryString, headers):
+    raise Exception("Error", "timed out")
+
+@pytest.mark.parametrize("route", [
+    lambda httpMethod, apiEndpoint, queryString, headers: FakeResponse(500, {"error" : {"code" : 500, "message" : "internal error"}}),
+    lambda httpMethod, apiEndpoint, queryString, headers: FakeResponse(503, {"error" : {"code" : 503, "message" : "unavailable"}}),
+    raiseTimeout])
+def test_other_errors_are_raised(dtcli, fakeTenant, route):
+    fakeTenant.routes[dtcli.API_ENDPOINT_TIMESERIES] = route
+    with pytest.raises(Exception) as error:
+        dtcli.queryTimeseriesTotals("timeseriesId=" + TIMESERIES_ID + "&relativeTime=hour&aggregationType=avg", ["SERVICE-1"], "avg")
+    assert error.value.args[0] == "Error"
+    assert getQueryModes(fakeTenant, dtcli) == ["total"]
+
+def test_unknown_query_mode(dtcli):
+    with pytest.raises(Exception) as error:
+        dtcli.doTimeseries(False, ["dtcli", "ts", "query", TIMESERIES_ID + "[avg%hour%sometimes]", "SERVICE-1"], False)
+    assert "queryMode sometimes not supported" in error.value.args[1]
+
+def test_monspec_asks_for_the_total_of_a_single_entity(dtcli):
+    perfsignature = {dtcli.MONSPEC_PERFSIGNATURE_TIMESERIES : "service.responsetime", dtcli.MONSPEC_PERFSIGNATURE_AGGREGATE : "avg"}
+    assert dtcli.getMonspecTimeseriesQuery(perfsignature, "60", "0", ["SERVICE-1"]) == "service.responsetime[avg%60:0%total]"
+    assert dtcli.getMonspecTimeseriesQuery(perfsignature, "60", "0", ["SERVICE-1", "SERVICE-2"]) == "service.responsetime[avg%60:0]"
+    assert dtcli.getMonspecTimeseriesQuery(perfsignature, "60", "0", None) == "service.responsetime[avg%60:0]"
+    perfsignature[dtcli.MONSPEC_PERFSIGNATURE_AGGREGATE] = "max"
+    assert dtcli.getMonspecTimeseriesQuery(perfsignature, "60", "0", ["SERVICE-1"]) == "service.responsetime[max%60:0]"
+
+def test_totals_have_no_resolution(dtcli):
+    jsonContent = makeTimeseriesResult(TIMESERIES_ID, DATA_POINTS)
+    assert dtcli.getContentResolution(jsonContent, "timeseriesId=" + TIMESERIES_ID) == 60000
+    assert dtcli.getContentResolution(jsonContent, "timeseriesId=" + TIMESERIES_ID + "&queryMode=total") is None